@@ -0,0 +1,214 @@
+from bisect import bisect_left, bisect_right
+from typing import List
+
+import numpy as np
+
+UNKNOWN_SPEAKER = "UNKNOWN"
+
+ASSIGN_MIDPOINT = "midpoint"
+ASSIGN_MAX_OVERLAP = "max_overlap"
+ASSIGNMENT_MODES = (ASSIGN_MIDPOINT, ASSIGN_MAX_OVERLAP)
+
+
+class SpeakerIndex:
+    """Индекс реплик диаризации, отсортированных по началу.
+
+    Реплики pyannote могут перекрываться, поэтому кроме массива начал храним
+    префиксный максимум концов: первая реплика, которая ещё не закончилась к
+    моменту t, находится бинарным поиском по этому монотонному массиву.
+    """
+
+    def __init__(self, speaker_segments: List[dict]):
+        turns = sorted(speaker_segments, key=lambda s: s["start"])
+        self.starts = [t["start"] for t in turns]
+        self.ends = [t["end"] for t in turns]
+        self.speakers = [t["speaker"] for t in turns]
+
+        self.max_ends = []
+        running_max = float("-inf")
+        for end in self.ends:
+            running_max = max(running_max, end)
+            self.max_ends.append(running_max)
+
+        # Те же массивы в numpy для назначения спикеров словам пачкой
+        self.labels, codes = np.unique(np.asarray(self.speakers, dtype=object), return_inverse=True)
+        self.codes = codes.astype(np.int64)
+        self.label_codes = {label: code for code, label in enumerate(self.labels)}
+        self.start_array = np.asarray(self.starts, dtype=np.float64)
+        self.max_end_array = np.asarray(self.max_ends, dtype=np.float64)
+
+    def __len__(self):
+        return len(self.starts)
+
+    def speaker_at(self, t: float) -> str:
+        """Спикер первой по порядку реплики, содержащей момент t"""
+        last = bisect_right(self.starts, t) - 1
+        first = bisect_left(self.max_ends, t)
+        if first <= last:
+            return self.speakers[first]
+        return UNKNOWN_SPEAKER
+
+    def codes_at(self, times: np.ndarray) -> np.ndarray:
+        """speaker_at для массива моментов: коды спикеров (индексы в labels), -1 вне реплик"""
+        if not len(self.codes):
+            return np.full(len(times), -1, dtype=np.int64)
+        last = np.searchsorted(self.start_array, times, side="right") - 1
+        first = np.searchsorted(self.max_end_array, times, side="left")
+        return np.where(first <= last, self.codes[np.minimum(first, len(self.codes) - 1)], -1)
+
+    def codes_for(self, starts: np.ndarray, ends: np.ndarray) -> np.ndarray:
+        """speaker_for для массивов отрезков: код спикера с наибольшим пересечением, -1 без пересечений"""
+        result = np.full(len(starts), -1, dtype=np.int64)
+        if not len(self.codes) or not len(starts):
+            return result
+
+        # Отрезки нулевой длины, как в speaker_for, назначаются по началу
+        empty = ends <= starts
+        result[empty] = self.codes_at(starts[empty])
+
+        # Кандидаты для отрезка - реплики first..last, как в speaker_for; пары (отрезок, реплика) разворачиваются плоско
+        last = np.searchsorted(self.start_array, ends, side="left") - 1
+        first = np.searchsorted(self.max_end_array, starts, side="right")
+        counts = np.where(empty, 0, np.maximum(last - first + 1, 0))
+        if not counts.sum():
+            return result
+        segment = np.repeat(np.arange(len(starts)), counts)
+        turn = first[segment] + np.arange(len(segment)) - np.repeat(np.cumsum(counts) - counts, counts)
+        overlap = (
+            np.minimum(ends[segment], np.asarray(self.ends, dtype=np.float64)[turn])
+            - np.maximum(starts[segment], self.start_array[turn])
+        )
+        positive = overlap > 0
+        segment, turn, overlap = segment[positive], turn[positive], overlap[positive]
+
+        # Пересечения одного спикера суммируются, затем у каждого отрезка берётся максимум;
+        # при равенстве, как в speaker_for, побеждает спикер, чья реплика встретилась раньше
+        keys, inverse = np.unique(segment * len(self.labels) + self.codes[turn], return_inverse=True)
+        totals = np.bincount(inverse, weights=overlap)
+        first_turn = np.full(len(keys), len(self.codes), dtype=np.int64)
+        np.minimum.at(first_turn, inverse, turn)
+        key_segment, key_code = keys // len(self.labels), keys % len(self.labels)
+        order = np.lexsort((first_turn, -totals, key_segment))
+        best = order[np.flatnonzero(np.diff(np.concatenate([[-1], key_segment[order]])))]
+        result[key_segment[best]] = key_code[best]
+        return result
+
+    def code_of(self, speaker: str) -> int:
+        return self.label_codes.get(speaker, -1)
+
+    def speaker_for(self, start: float, end: float) -> str:
+        """Спикер с наибольшим пересечением с отрезком [start, end]"""
+        if end <= start:
+            return self.speaker_at(start)
+
+        last = bisect_left(self.starts, end) - 1
+        first = bisect_right(self.max_ends, start)
+
+        overlaps = {}
+        for i in range(first, last + 1):
+            overlap = min(end, self.ends[i]) - max(start, self.starts[i])
+            if overlap > 0:
+                overlaps[self.speakers[i]] = overlaps.get(self.speakers[i], 0.0) + overlap
+
+        if not overlaps:
+            return UNKNOWN_SPEAKER
+        return max(overlaps, key=overlaps.get)
+
+    def assign(self, start: float, end: float, mode: str = ASSIGN_MIDPOINT) -> str:
+        if mode == ASSIGN_MAX_OVERLAP:
+            return self.speaker_for(start, end)
+        return self.speaker_at((start + end) / 2)
+
+
+def words_from_tokens(tokens: List[dict]) -> List[dict]:
+    """Склеивает токены whisper ({"text", "start", "end", "p"}) в слова.
+
+    Новое слово начинается с токена с ведущим пробелом; знаки препинания и
+    продолжения слова приклеиваются к предыдущему. Служебные токены вида
+    [_BEG_], [_TT_150] пропускаются.
+    """
+    words = []
+    probabilities = []
+    for token in tokens:
+        text = token["text"]
+        if not text or (text.startswith("[_") and text.endswith("]")):
+            continue
+        if words and not text[0].isspace():
+            words[-1]["word"] += text
+            words[-1]["end"] = token["end"]
+            probabilities[-1].append(token.get("p", 1.0))
+            continue
+        if not text.strip():
+            continue
+        words.append({"word": text.strip(), "start": token["start"], "end": token["end"]})
+        probabilities.append([token.get("p", 1.0)])
+
+    for word, p in zip(words, probabilities):
+        word["start"] = round(word["start"], 3)
+        word["end"] = round(max(word["end"], word["start"]), 3)
+        word["probability"] = round(sum(p) / len(p), 3)
+    return words
+
+
+def split_by_speaker(segments: List[dict], index: SpeakerIndex, mode: str = ASSIGN_MIDPOINT) -> List[dict]:
+    """Назначает спикеров словам и режет сегменты whisper там, где спикер меняется.
+
+    Спикер слова выбирается по mode, как у сегмента: midpoint - реплика,
+    содержащая середину слова, max_overlap - спикер с наибольшим пересечением
+    со словом; все слова ищутся в индексе пачкой. Слова вне реплик получают
+    спикера своего сегмента, а одиночное слово другого спикера между словами
+    одного считается ошибкой границы. Сегменты без слов назначаются целиком.
+    """
+    seg_speakers = [index.assign(seg["start"], seg["end"], mode) for seg in segments]
+    counts = np.fromiter((len(seg.get("words") or ()) for seg in segments), dtype=np.int64, count=len(segments))
+    total = int(counts.sum())
+    if total == 0:
+        return [{**seg, "speaker": speaker} for seg, speaker in zip(segments, seg_speakers)]
+
+    words = [word for seg in segments for word in (seg.get("words") or ())]
+    starts = np.fromiter((w["start"] for w in words), dtype=np.float64, count=total)
+    ends = np.fromiter((w["end"] for w in words), dtype=np.float64, count=total)
+    owner = np.repeat(np.arange(len(segments)), counts)
+
+    if mode == ASSIGN_MAX_OVERLAP:
+        codes = index.codes_for(starts, ends)
+    else:
+        codes = index.codes_at((starts + ends) / 2)
+    unknown = codes < 0
+    codes[unknown] = np.fromiter(
+        (index.code_of(speaker) for speaker in seg_speakers), dtype=np.int64, count=len(segments)
+    )[owner[unknown]]
+
+    if total > 2:
+        inner = codes[1:-1]
+        isolated = (codes[:-2] == codes[2:]) & (inner != codes[:-2]) & (owner[:-2] == owner[2:])
+        inner[isolated] = codes[:-2][isolated]
+
+    # Куски - непрерывные отрезки слов одного сегмента с одним спикером
+    breaks = np.flatnonzero((codes[1:] != codes[:-1]) | (owner[1:] != owner[:-1])) + 1
+    piece_starts = np.concatenate([[0], breaks])
+    piece_ends = np.concatenate([breaks, [total]])
+    offsets = np.concatenate([[0], np.cumsum(counts)])
+    first_piece = np.searchsorted(piece_starts, offsets)
+    labels = list(index.labels) + [UNKNOWN_SPEAKER]
+
+    result = []
+    for i, seg in enumerate(segments):
+        if counts[i] == 0:
+            result.append({**seg, "speaker": seg_speakers[i]})
+            continue
+        pieces = range(first_piece[i], first_piece[i + 1])
+        if len(pieces) == 1:
+            result.append({**seg, "speaker": labels[codes[offsets[i]]]})
+            continue
+        for k in pieces:
+            a, b = piece_starts[k], piece_ends[k]
+            piece_words = words[a:b]
+            result.append({
+                "text": " ".join(w["word"] for w in piece_words),
+                "start": seg["start"] if k == pieces[0] else piece_words[0]["start"],
+                "end": seg["end"] if k == pieces[-1] else piece_words[-1]["end"],
+                "speaker": labels[codes[a]],
+                "words": piece_words,
+            })
+    return result
@@ -0,0 +1,107 @@
+import logging
+import os
+import struct
+import subprocess
+import tempfile
+
+import numpy as np
+
+from chunking import open_wav
+
+SAMPLE_RATE = 16000
+READ_CHUNK_SIZE = 1024 * 1024
+# Сколько последних символов stderr ffmpeg попадает в ошибку
+STDERR_TAIL_CHARS = 4000
+
+
+def _wav_header(data_size: int, sample_rate: int) -> bytes:
+    return struct.pack(
+        "<4sI4s4sIHHIIHH4sI",
+        b"RIFF", 36 + data_size, b"WAVE",
+        b"fmt ", 16, 1, 1, sample_rate, sample_rate * 2, 2, 16,
+        b"data", data_size,
+    )
+
+
+class AudioBuffer:
+    """Декодированная запись: один WAV-файл, PCM которого отображён в память.
+
+    Диаризация и длительность читают отсчёты из memmap, whisper получает
+    путь к этому же файлу, так что повторного декодирования нет.
+    """
+
+    def __init__(self, path: str, samples: np.ndarray, sample_rate: int):
+        self.path = path
+        self.samples = samples
+        self.sample_rate = sample_rate
+
+    @property
+    def duration(self) -> float:
+        return len(self.samples) / self.sample_rate
+
+    def waveform(self, start: int = 0, end: int = None) -> np.ndarray:
+        """float32 в диапазоне [-1, 1], как у torchaudio.load"""
+        return np.asarray(self.samples[start:end], dtype=np.float32) / 32768.0
+
+    def close(self):
+        self.samples = None
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+def probe_duration(input_file: str):
+    """Длительность записи в секундах по ffprobe, без декодирования; None, если не удалось"""
+    try:
+        result = subprocess.run(
+            ["ffprobe", "-v", "error", "-show_entries", "format=duration", "-of", "csv=p=0", input_file],
+            capture_output=True, text=True, timeout=30,
+        )
+        return float(result.stdout.strip())
+    except (OSError, subprocess.SubprocessError, ValueError) as e:
+        logging.warning(f"ffprobe could not read the duration of {input_file}: {str(e)}")
+        return None
+
+
+def decode_audio(input_file: str, sample_rate: int = SAMPLE_RATE) -> AudioBuffer:
+    """Декодирует файл одним проходом ffmpeg: сырой PCM из stdout пишется прямо за WAV-заголовок"""
+    fd, output_file = tempfile.mkstemp(suffix=".wav")
+    logging.info(f"Decoding {input_file} to PCM: {output_file}")
+
+    # stderr пишется в файл: читая только stdout, мы не даём ffmpeg
+    # заблокироваться на переполненном pipe stderr при потоке ошибок по кадрам
+    stderr_file = tempfile.TemporaryFile()
+    process = subprocess.Popen(
+        ["ffmpeg", "-loglevel", "error", "-i", input_file,
+         "-f", "s16le", "-acodec", "pcm_s16le", "-ac", "1", "-ar", str(sample_rate), "pipe:1"],
+        stdout=subprocess.PIPE, stderr=stderr_file
+    )
+    try:
+        data_size = 0
+        with os.fdopen(fd, "wb") as f:
+            f.write(_wav_header(0, sample_rate))
+            while chunk := process.stdout.read(READ_CHUNK_SIZE):
+                f.write(chunk)
+                data_size += len(chunk)
+            f.seek(0)
+            f.write(_wav_header(data_size, sample_rate))
+
+        returncode = process.wait()
+        stderr_file.seek(0)
+        stderr = stderr_file.read().decode(errors="replace")[-STDERR_TAIL_CHARS:]
+        if returncode != 0:
+            logging.error(f"FFmpeg error: {stderr}")
+            raise RuntimeError(f"FFmpeg error: {stderr}")
+        if data_size == 0:
+            raise RuntimeError("FFmpeg produced no audio")
+
+        samples, _ = open_wav(output_file)
+        return AudioBuffer(output_file, samples, sample_rate)
+    except BaseException:
+        process.kill()
+        process.wait()
+        if os.path.exists(output_file):
+            os.remove(output_file)
+        raise
+    finally:
+        process.stdout.close()
+        stderr_file.close()
@@ -0,0 +1,160 @@
+"""RTF настоящего pyannote на CPU при разных профилях исполнения.
+
+Запускается из каталога backend, нужен HF_TOKEN:
+
+    python -m benchmarks.bench_diarization --audio fixtures/meeting.mp3 --jobs 3 \\
+        --profile "slots=3 threads=32" --profile "slots=3" \\
+        --profile "slots=3 embedding_batch_size=32 segmentation_batch_size=32 quantize=int8"
+    python -m benchmarks.bench_diarization --duration 600 --profile "slots=1" --save cpu.json
+
+Профиль - параметры DiarizationRuntime через пробел (slots, threads,
+affinity, segmentation_batch_size, embedding_batch_size, quantize);
+device всегда cpu. Профиль "slots=N threads=<все ядра>" воспроизводит
+прежнее поведение, когда каждая из N параллельных задач брала все ядра.
+
+--jobs задач запускаются одновременно через Predictor._get_speaker_segments,
+как в сервисе. Каждый профиль идёт в отдельном процессе: число потоков
+torch задаётся один раз на процесс. Без --audio пишется синтетическая
+запись из тонов; pyannote считает её дешевле речи, поэтому для сравнения с
+продом нужна настоящая запись.
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import queue
+import resource
+import shutil
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from benchmarks.fakes import synthetic_turns, write_synthetic_wav
+
+
+def parse_profile(value: str) -> dict:
+    profile = {}
+    for item in value.split():
+        key, _, raw = item.partition("=")
+        profile[key] = raw if key in ("affinity", "quantize") else int(raw)
+    return profile
+
+
+def run_profile(profile: dict, args, results):
+    from pyannote.audio import Pipeline
+
+    import predict
+    from audio import decode_audio
+    from diarization import WindowedDiarizer
+    from diarization_runtime import DiarizationRuntime
+
+    workdir = tempfile.mkdtemp(prefix="bench_diarization_")
+    audio = None
+    try:
+        input_path = args.audio
+        if input_path is None:
+            input_path = os.path.join(workdir, "input.wav")
+            turns = synthetic_turns(args.duration, args.speakers, seed=args.seed)
+            write_synthetic_wav(input_path, args.duration, turns, seed=args.seed)
+        audio = decode_audio(input_path)
+
+        started = time.perf_counter()
+        runtime = DiarizationRuntime(device="cpu", **profile)
+        pipeline = runtime.prepare(Pipeline.from_pretrained(predict.DIARIZATION_MODEL, use_auth_token=os.getenv("HF_TOKEN")))
+        load_seconds = time.perf_counter() - started
+
+        predictor = predict.Predictor()
+        predictor.diarization_runtime = runtime
+        predictor.diarization_pipeline = pipeline
+        predictor.diarization_window_seconds = args.diarization_window
+        predictor.diarizer = WindowedDiarizer(pipeline, window_seconds=args.diarization_window)
+
+        def job():
+            job_started = time.perf_counter()
+            _, detected = predictor._get_speaker_segments(audio, args.num_speakers)
+            return time.perf_counter() - job_started, detected
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.jobs) as executor:
+            jobs = [f.result() for f in [executor.submit(job) for _ in range(args.jobs)]]
+        wall = time.perf_counter() - started
+
+        latencies = [seconds for seconds, _ in jobs]
+        results.put({
+            "profile": profile,
+            "audio_seconds": audio.duration,
+            "jobs": args.jobs,
+            "load_seconds": load_seconds,
+            "wall_seconds": wall,
+            # RTF по пропускной способности: сколько секунд занимает секунда аудио при такой загрузке
+            "rtf": wall / (audio.duration * args.jobs),
+            "job_rtf": sum(latencies) / len(latencies) / audio.duration,
+            "speakers": sorted(set(detected for _, detected in jobs)),
+            "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        })
+    except BaseException as e:
+        results.put({"profile": profile, "error": f"{type(e).__name__}: {e}"})
+        raise
+    finally:
+        if audio is not None:
+            audio.close()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def run_isolated(profile: dict, args) -> dict:
+    context = multiprocessing.get_context("spawn")
+    results = context.Queue()
+    process = context.Process(target=run_profile, args=(profile, args, results))
+    process.start()
+    while True:
+        try:
+            result = results.get(timeout=1)
+            break
+        except queue.Empty:
+            if not process.is_alive():
+                result = {"profile": profile, "error": f"process exited with code {process.exitcode}"}
+                break
+    process.join()
+    return result
+
+
+def report(result: dict):
+    name = " ".join(f"{k}={v}" for k, v in result["profile"].items()) or "defaults"
+    if "error" in result:
+        print(f"{name:<60} FAILED: {result['error']}")
+        return
+    print(
+        f"{name:<60} RTF {result['rtf']:.4f}  job RTF {result['job_rtf']:.4f}  "
+        f"wall {result['wall_seconds']:7.1f}s  load {result['load_seconds']:5.1f}s  "
+        f"peak RSS {result['peak_rss_mb']:6.0f} MB  speakers {result['speakers']}"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--audio", help="audio file (any ffmpeg format)")
+    parser.add_argument("--duration", type=float, default=600.0, help="seconds of synthetic audio without --audio")
+    parser.add_argument("--speakers", type=int, default=2, help="speakers in synthetic audio")
+    parser.add_argument("--num-speakers", type=int, default=None, help="speaker count passed to pyannote")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--jobs", type=int, default=1, help="concurrent diarization jobs")
+    parser.add_argument("--diarization-window", type=float, default=900.0)
+    parser.add_argument("--profile", action="append", default=[], help='e.g. "slots=2 embedding_batch_size=32"')
+    parser.add_argument("--save", help="write results to a JSON file")
+    args = parser.parse_args()
+
+    results = []
+    for profile in map(parse_profile, args.profile or [""]):
+        result = run_isolated(profile, args)
+        report(result)
+        results.append(result)
+
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(results, f, indent=2)
+    sys.exit(1 if any("error" in r for r in results) else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,192 @@
+"""Микро-бенчмарки горячих путей: merge сегментов и назначение спикеров сегментам и словам.
+
+Запускается из каталога backend:
+
+    python -m benchmarks.bench_hotpaths --segments 1000,10000,100000
+    python -m benchmarks.bench_hotpaths --save hotpaths.json
+    python -m benchmarks.bench_hotpaths --baseline hotpaths.json --tolerance 0.3
+
+Сегменты whisper и реплики диаризации генерируются детерминированно. Для
+назначения спикеров рядом с SpeakerIndex меряется линейный перебор реплик,
+и результаты обоих сверяются; так же сверяется пакетное назначение слов.
+Время - лучшее из --repeat прогонов.
+"""
+import argparse
+import json
+import sys
+import timeit
+
+import numpy as np
+
+from alignment import ASSIGN_MIDPOINT, ASSIGN_MAX_OVERLAP, UNKNOWN_SPEAKER, SpeakerIndex, split_by_speaker
+from benchmarks.fakes import VOCABULARY, _words, synthetic_turns
+from merge import merge_segments
+
+
+def whisper_segments(count: int, seed: int = 0) -> list:
+    """Сегменты длиной 1-8 с с короткими паузами, как у whisper"""
+    rng = np.random.default_rng(seed)
+    lengths = rng.uniform(1.0, 8.0, count)
+    gaps = rng.uniform(0.0, 1.5, count)
+    starts = np.concatenate([[0.0], np.cumsum(lengths + gaps)[:-1]])
+    return [
+        {
+            "text": " " + " ".join(VOCABULARY[(i + k) % len(VOCABULARY)] for k in range(int(length * 2) + 1)),
+            "start": float(start),
+            "end": float(start + length),
+            "words": _words(float(start), float(start + length)),
+        }
+        for i, (start, length) in enumerate(zip(starts, lengths))
+    ]
+
+
+def naive_speaker(turns: list, start: float, end: float) -> str:
+    """Линейный перебор реплик, как до появления SpeakerIndex"""
+    midpoint = (start + end) / 2
+    for turn in turns:
+        if turn["start"] <= midpoint <= turn["end"]:
+            return turn["speaker"]
+    return UNKNOWN_SPEAKER
+
+
+def naive_merge(segments: list) -> list:
+    """Склейка с наращиванием строки, как до колоночного merge"""
+    merged, current = [], None
+    for seg in segments:
+        if not seg["text"] or seg["text"].isspace():
+            continue
+        if current and seg["speaker"] == current["speaker"] and seg["start"] - current["end"] < 1.0:
+            if current["text"][-1].isalpha() and seg["text"][0].isalpha():
+                current["text"] += seg["text"]
+            else:
+                current["text"] += " " + seg["text"].lstrip()
+            current["end"] = seg["end"]
+            current["words"] = current["words"] + (seg.get("words") or [])
+            continue
+        if current:
+            current["text"] = current["text"].strip()
+            merged.append(current)
+        current = {"text": seg["text"], "start": seg["start"], "end": seg["end"], "speaker": seg["speaker"],
+                   "words": list(seg.get("words") or [])}
+    if current:
+        merged.append(current)
+    return merged
+
+
+def best_of(fn, repeat: int) -> float:
+    return min(timeit.repeat(fn, number=1, repeat=repeat))
+
+
+def bench_size(count: int, speakers: int, repeat: int, seed: int) -> dict:
+    segments = whisper_segments(count, seed)
+    duration = segments[-1]["end"]
+    turns = synthetic_turns(duration, speakers, seed=seed)
+    index = SpeakerIndex(turns)
+    monologue = [dict(seg, speaker="SPEAKER_00", start=float(i), end=i + 0.9) for i, seg in enumerate(segments)]
+
+    labelled = [
+        {**seg, "speaker": index.assign(seg["start"], seg["end"], ASSIGN_MIDPOINT)} for seg in segments
+    ]
+
+    results = {
+        "index_build": best_of(lambda: SpeakerIndex(turns), repeat),
+        "assign_midpoint": best_of(
+            lambda: [index.assign(s["start"], s["end"], ASSIGN_MIDPOINT) for s in segments], repeat
+        ),
+        "assign_max_overlap": best_of(
+            lambda: [index.assign(s["start"], s["end"], ASSIGN_MAX_OVERLAP) for s in segments], repeat
+        ),
+        "split_by_speaker": best_of(lambda: split_by_speaker(segments, index, ASSIGN_MIDPOINT), repeat),
+        "split_by_speaker_overlap": best_of(lambda: split_by_speaker(segments, index, ASSIGN_MAX_OVERLAP), repeat),
+        "merge": best_of(lambda: merge_segments(labelled), repeat),
+        # Один спикер без пауз: вся запись склеивается в один сегмент
+        "merge_monologue": best_of(lambda: merge_segments(monologue), repeat),
+    }
+
+    # Линейный перебор квадратичен, на больших размерах меряется по выборке
+    sample = segments[:min(len(segments), 2000)]
+    naive = best_of(lambda: [naive_speaker(turns, s["start"], s["end"]) for s in sample], repeat)
+    results["assign_naive"] = naive * len(segments) / len(sample)
+    results["merge_naive"] = best_of(lambda: naive_merge(labelled), repeat)
+
+    mismatches = sum(
+        naive_speaker(turns, s["start"], s["end"]) != index.assign(s["start"], s["end"], ASSIGN_MIDPOINT)
+        for s in sample
+    )
+
+    # Пакетный поиск по середине слов должен совпадать с поштучным speaker_at
+    midpoints = np.asarray([(w["start"] + w["end"]) / 2 for s in sample for w in s["words"]])
+    labels = list(index.labels) + [UNKNOWN_SPEAKER]
+    mismatches += sum(
+        index.speaker_at(t) != labels[code] for t, code in zip(midpoints, index.codes_at(midpoints))
+    )
+    # И пакетное пересечение слов - с поштучным speaker_for
+    word_starts = np.asarray([w["start"] for s in sample for w in s["words"]])
+    word_ends = np.asarray([w["end"] for s in sample for w in s["words"]])
+    mismatches += sum(
+        index.speaker_for(start, end) != labels[code]
+        for start, end, code in zip(word_starts, word_ends, index.codes_for(word_starts, word_ends))
+    )
+    mismatches += list(merge_segments(labelled).rows()) != naive_merge(labelled)
+    return {"segments": count, "turns": len(turns), "mismatches": mismatches, "seconds": results}
+
+
+def report(result: dict):
+    per_segment = "  ".join(
+        f"{name} {seconds * 1e3:8.2f} ms ({seconds / result['segments'] * 1e6:6.2f} us/seg)"
+        for name, seconds in result["seconds"].items()
+    )
+    print(f"{result['segments']:>7} segments / {result['turns']:>6} turns  {per_segment}")
+    if result["mismatches"]:
+        print(f"        WARNING: SpeakerIndex disagrees with the linear scan on {result['mismatches']} segments")
+
+
+def compare(results: list, baseline: list, tolerance: float) -> list:
+    reference = {r["segments"]: r for r in baseline}
+    regressions = []
+    for result in results:
+        base = reference.get(result["segments"])
+        if base is None:
+            continue
+        for name, seconds in result["seconds"].items():
+            expected = base["seconds"].get(name)
+            if not name.endswith("_naive") and expected and seconds > expected * (1 + tolerance):
+                regressions.append(
+                    f"{result['segments']} segments: {name} {seconds * 1e3:.2f} ms vs {expected * 1e3:.2f} ms"
+                )
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--segments", default="1000,10000,100000", help="segment counts, comma separated")
+    parser.add_argument("--speakers", type=int, default=4)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--save", help="write results to a JSON file")
+    parser.add_argument("--baseline", help="compare with results saved by --save")
+    parser.add_argument("--tolerance", type=float, default=0.3)
+    args = parser.parse_args()
+
+    results = []
+    for count in map(int, args.segments.split(",")):
+        result = bench_size(count, args.speakers, args.repeat, args.seed)
+        report(result)
+        results.append(result)
+
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(results, f, indent=2)
+
+    failed = any(r["mismatches"] for r in results)
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        failed = failed or bool(regressions)
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+"""Нагрузочный бенчмарк логина: bcrypt + PBKDF2 в event loop против CryptoPool.
+
+Запускается из каталога backend:
+
+    python -m benchmarks.bench_login --rate 20 --requests 200
+
+Каждый "логин" повторяет работу /login без БД: проверка bcrypt-хэша и
+расшифровка ключа. Запросы приходят с заданной частотой, задержка (p50/p99)
+считается от момента прихода. Параллельно тикает heartbeat-корутина; её
+задержка показывает, насколько event loop заблокирован для остальных запросов.
+"""
+import argparse
+import asyncio
+import statistics
+import time
+
+from crypto_pool import CryptoPool, CryptoPoolBusy
+from utils import check_password, decrypt_key, generate_encrypted_key, hash_password
+
+PASSWORD = "correct horse battery staple"
+
+
+def percentile(values, p):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(p / 100 * (len(ordered) - 1))))]
+
+
+async def heartbeat(lags: list, stop: asyncio.Event, interval: float = 0.01):
+    loop = asyncio.get_running_loop()
+    while not stop.is_set():
+        expected = loop.time() + interval
+        await asyncio.sleep(interval)
+        lags.append(max(0.0, loop.time() - expected))
+
+
+async def login_inline(password_hash: str, encrypted_key: str):
+    if not check_password(PASSWORD, password_hash):
+        raise RuntimeError("bad password")
+    decrypt_key(PASSWORD, encrypted_key)
+
+
+async def login_pooled(pool: CryptoPool, password_hash: str, encrypted_key: str):
+    if not await pool.run(check_password, PASSWORD, password_hash):
+        raise RuntimeError("bad password")
+    await pool.run(decrypt_key, PASSWORD, encrypted_key)
+
+
+async def run_load(login, requests: int, rate: float) -> dict:
+    """Открытая нагрузка: запросы приходят с частотой rate, задержка считается от момента прихода"""
+    latencies, rejected = [], 0
+    lags, stop = [], asyncio.Event()
+    beat = asyncio.create_task(heartbeat(lags, stop))
+
+    async def one(arrival: float):
+        nonlocal rejected
+        try:
+            await login()
+        except CryptoPoolBusy:
+            rejected += 1
+            return
+        latencies.append(time.perf_counter() - arrival)
+
+    started = time.perf_counter()
+    tasks = []
+    for i in range(requests):
+        arrival = started + i / rate
+        await asyncio.sleep(max(0.0, arrival - time.perf_counter()))
+        tasks.append(asyncio.create_task(one(arrival)))
+    await asyncio.gather(*tasks)
+    elapsed = time.perf_counter() - started
+    stop.set()
+    await beat
+
+    return {
+        "throughput": len(latencies) / elapsed,
+        "p50": percentile(latencies, 50) if latencies else float("nan"),
+        "p99": percentile(latencies, 99) if latencies else float("nan"),
+        "loop_lag_max": max(lags) if lags else 0.0,
+        "loop_lag_mean": statistics.mean(lags) if lags else 0.0,
+        "rejected": rejected,
+    }
+
+
+def report(name: str, stats: dict):
+    print(
+        f"{name:<10} {stats['throughput']:8.1f} req/s  "
+        f"p50 {stats['p50'] * 1000:8.1f} ms  p99 {stats['p99'] * 1000:8.1f} ms  "
+        f"loop lag max {stats['loop_lag_max'] * 1000:8.1f} ms  mean {stats['loop_lag_mean'] * 1000:6.1f} ms  "
+        f"429s {stats['rejected']}"
+    )
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=128)
+    parser.add_argument("--rate", type=float, default=20.0, help="logins per second")
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--max-pending", type=int, default=64)
+    parser.add_argument("--executor", choices=["thread", "process"], default="thread")
+    parser.add_argument("--bcrypt-rounds", type=int, default=12)
+    parser.add_argument("--pbkdf2-iterations", type=int, default=1000)
+    args = parser.parse_args()
+
+    password_hash = hash_password(PASSWORD, args.bcrypt_rounds)
+    encrypted_key = generate_encrypted_key(PASSWORD, args.pbkdf2_iterations)
+
+    print(f"{args.requests} logins at {args.rate:.0f}/s, "
+          f"bcrypt rounds {args.bcrypt_rounds}, PBKDF2 iterations {args.pbkdf2_iterations}")
+
+    report("inline", await run_load(lambda: login_inline(password_hash, encrypted_key), args.requests, args.rate))
+
+    pool = CryptoPool(max_workers=args.workers, max_pending=args.max_pending, kind=args.executor)
+    try:
+        report("pooled", await run_load(
+            lambda: login_pooled(pool, password_hash, encrypted_key), args.requests, args.rate
+        ))
+    finally:
+        pool.shutdown()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
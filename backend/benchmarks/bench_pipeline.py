@@ -0,0 +1,233 @@
+"""Офлайн-бенчмарк пайплайна Predictor.predict на синтетических и реальных записях.
+
+Запускается из каталога backend:
+
+    python -m benchmarks.bench_pipeline --durations 60,600,3600 --speakers 2,4
+    python -m benchmarks.bench_pipeline --durations 60,600,3600,10800 --save baseline.json
+    python -m benchmarks.bench_pipeline --audio fixtures/meeting.mp3 --baseline baseline.json
+
+Whisper, pyannote и llama заменены детерминированными заменителями
+(benchmarks/fakes.py), БД - заглушками, блобы пишутся во временный каталог.
+Остальное - ffmpeg, memmap, очередь, чанкинг, назначение спикеров, merge,
+шифрование - настоящее. Каждый случай идёт в отдельном процессе, чтобы
+пиковый RSS относился только к нему.
+
+С --baseline результат сравнивается с сохранённым, и при замедлении RTF или
+этапа больше чем на --tolerance скрипт завершается с кодом 1.
+"""
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import queue
+import resource
+import shutil
+import sys
+import tempfile
+import time
+
+from benchmarks.fakes import FakeDiarization, FakeLlamaServer, FakeWhisper, synthetic_turns, write_synthetic_wav
+
+# Этапы короче этого порога не сравниваются с эталоном: там один шум
+MIN_COMPARABLE_SECONDS = 0.05
+
+
+def make_predictor(workdir: str, args):
+    import predict
+    from diarization import WindowedDiarizer
+    from diarization_runtime import DiarizationRuntime
+    from metrics import JobTimer
+    from scheduler import TranscriptionQueue
+    from storage import LocalBlobStore
+    from summarizer import TranscriptSummarizer
+    from concurrent.futures import ThreadPoolExecutor
+
+    timers = []
+
+    class RecordingTimer(JobTimer):
+        def __init__(self, job_id=None):
+            super().__init__(job_id)
+            timers.append(self)
+
+    predict.JobTimer = RecordingTimer
+
+    predictor = predict.Predictor()
+    # Модели подменены заменителями, фоновая загрузка не нужна
+    predictor.warmup.set_running_or_notify_cancel()
+    predictor.warmup.set_result(None)
+    predictor.PROMPTS = {"summary": "Создай краткое содержание этого разговора в 2-3 предложениях:"}
+    predictor.summarizer = TranscriptSummarizer(
+        FakeLlamaServer(), predictor.PROMPTS, context_tokens=args.llama_context, max_new_tokens=256, parallel=2
+    )
+    predictor.model_path = "fake-whisper.bin"
+    predictor.whisper_cli_path = None
+    predictor.whisper_pool = FakeWhisper(rtf=args.whisper_rtf)
+    predictor.diarization_runtime = DiarizationRuntime(device="cpu", slots=args.workers)
+    predictor.diarization_pipeline = predictor.diarization_runtime.prepare(FakeDiarization(rtf=args.diarization_rtf))
+    predictor.diarization_window_seconds = args.diarization_window
+    predictor.diarizer = WindowedDiarizer(predictor.diarization_pipeline, window_seconds=args.diarization_window)
+    predictor.speaker_assignment = args.speaker_assignment
+    predictor.result_cache = None
+    predictor.blob_store = LocalBlobStore(os.path.join(workdir, "blobs"))
+    predictor.transcription_queue = TranscriptionQueue(max_concurrent=args.workers)
+    predictor.whisper_executor = ThreadPoolExecutor(max_workers=args.workers)
+    predictor.chunk_seconds = args.chunk_seconds
+    predictor.chunk_overlap_seconds = 1.0
+    predictor.chunk_executor = ThreadPoolExecutor(max_workers=args.whisper_parallel)
+
+    # БД в бенчмарке не участвует
+    predictor._create_transcript = lambda *a, **kw: 1
+    predictor._store_transcript = lambda *a, **kw: None
+    return predictor, timers
+
+
+def run_case(case: dict, args, results):
+    workdir = tempfile.mkdtemp(prefix="bench_pipeline_")
+    try:
+        if case["audio"]:
+            input_path = case["audio"]
+        else:
+            turns = synthetic_turns(case["duration"], case["speakers"], seed=args.seed)
+            input_path = os.path.join(workdir, "input.wav")
+            write_synthetic_wav(input_path, case["duration"], turns, seed=args.seed)
+
+        predictor, timers = make_predictor(workdir, args)
+        rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+        started = time.perf_counter()
+        result = asyncio.run(predictor.predict(
+            file_path=input_path, num_speakers=case["speakers"], email="bench@example.com",
+            decrypted_key="bench-key", meeting_name=case["name"],
+        ))
+        wall = time.perf_counter() - started
+
+        stages = dict(timers[-1].stages)
+        if args.summary:
+            summary_started = time.perf_counter()
+            predictor._generate_summary(list(result["segments"].rows()))
+            stages["summary"] = time.perf_counter() - summary_started
+
+        audio_seconds = timers[-1].audio_seconds
+        results.put({
+            **case,
+            "audio_seconds": audio_seconds,
+            "segments": len(result["segments"]),
+            "wall_seconds": wall,
+            "rtf": wall / audio_seconds,
+            "throughput": audio_seconds / wall,
+            "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+            "setup_rss_mb": rss_before / 1024,
+            "stages": stages,
+        })
+    except BaseException as e:
+        results.put({**case, "error": f"{type(e).__name__}: {e}"})
+        raise
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def run_isolated(case: dict, args) -> dict:
+    context = multiprocessing.get_context("spawn")
+    results = context.Queue()
+    process = context.Process(target=run_case, args=(case, args, results))
+    process.start()
+    # Процесс может быть убит OOM-киллером, не успев ничего вернуть
+    while True:
+        try:
+            result = results.get(timeout=1)
+            break
+        except queue.Empty:
+            if not process.is_alive():
+                result = {**case, "error": f"process exited with code {process.exitcode}"}
+                break
+    process.join()
+    return result
+
+
+def report(result: dict):
+    if "error" in result:
+        print(f"{result['name']:<16} FAILED: {result['error']}")
+        return
+    stages = "  ".join(f"{name} {seconds:.2f}s" for name, seconds in sorted(result["stages"].items()))
+    print(
+        f"{result['name']:<16} audio {result['audio_seconds']:8.0f}s  wall {result['wall_seconds']:7.2f}s  "
+        f"RTF {result['rtf']:.4f}  x{result['throughput']:7.1f}  peak RSS {result['peak_rss_mb']:7.0f} MB  "
+        f"segments {result['segments']}"
+    )
+    print(f"{'':<16} {stages}")
+
+
+def compare(results: list, baseline: list, tolerance: float) -> list:
+    """Возвращает описания регрессий относительно сохранённого прогона"""
+    reference = {r["name"]: r for r in baseline if "error" not in r}
+    regressions = []
+    for result in results:
+        base = reference.get(result["name"])
+        if base is None or "error" in result:
+            continue
+        metrics = [("rtf", result["rtf"], base["rtf"]), ("peak_rss_mb", result["peak_rss_mb"], base["peak_rss_mb"])]
+        metrics += [
+            (f"stage {name}", seconds, base["stages"][name])
+            for name, seconds in result["stages"].items()
+            if name in base["stages"] and base["stages"][name] >= MIN_COMPARABLE_SECONDS
+        ]
+        for name, value, expected in metrics:
+            if expected > 0 and value > expected * (1 + tolerance):
+                regressions.append(f"{result['name']}: {name} {value:.3f} vs {expected:.3f} (+{value / expected - 1:.0%})")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--durations", default="60,600,3600", help="seconds of synthetic audio, comma separated")
+    parser.add_argument("--speakers", default="2,4", help="speaker counts, comma separated")
+    parser.add_argument("--audio", action="append", default=[], help="fixture audio file (any ffmpeg format)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--chunk-seconds", type=float, default=0.0)
+    parser.add_argument("--whisper-parallel", type=int, default=2)
+    parser.add_argument("--whisper-rtf", type=float, default=0.0, help="simulated whisper cost")
+    parser.add_argument("--diarization-rtf", type=float, default=0.0, help="simulated diarization cost")
+    parser.add_argument("--diarization-window", type=float, default=900.0, help="0 disables windowed diarization")
+    parser.add_argument("--speaker-assignment", default="midpoint")
+    parser.add_argument("--summary", action="store_true", help="also run map-reduce summarization")
+    parser.add_argument("--llama-context", type=int, default=4096)
+    parser.add_argument("--save", help="write results to a JSON file")
+    parser.add_argument("--baseline", help="compare with results saved by --save")
+    parser.add_argument("--tolerance", type=float, default=0.25)
+    args = parser.parse_args()
+
+    cases = [
+        {"name": os.path.basename(path), "audio": path, "duration": None, "speakers": 2}
+        for path in args.audio
+    ]
+    if not args.audio:
+        cases = [
+            {"name": f"{int(duration)}s-{speakers}spk", "audio": None, "duration": float(duration), "speakers": speakers}
+            for duration in args.durations.split(",")
+            for speakers in map(int, args.speakers.split(","))
+        ]
+
+    results = []
+    for case in cases:
+        result = run_isolated(case, args)
+        report(result)
+        results.append(result)
+
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(results, f, indent=2, ensure_ascii=False)
+
+    failed = any("error" in r for r in results)
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        failed = failed or bool(regressions)
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
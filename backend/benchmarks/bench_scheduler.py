@@ -0,0 +1,138 @@
+"""Симуляция очереди транскрипции: FIFO против справедливого планировщика.
+
+Запускается из каталога backend:
+
+    python -m benchmarks.bench_scheduler
+    python -m benchmarks.bench_scheduler --heavy-jobs 10 --heavy-minutes 120 --light-users 40 --workers 3
+
+Тяжёлый аккаунт в начале загружает --heavy-jobs длинных записей, лёгкие
+пользователи в течение --hours присылают короткие заметки через случайные
+интервалы. Время воркера на задачу - длительность * RTF с шумом, так что
+оценка стоимости у планировщика неточная, как и в проде. Обе политики
+проигрываются на одной и той же нагрузке; печатаются среднее и p95 времени
+от загрузки до готовности по группам. Модели и БД не нужны.
+"""
+import argparse
+import heapq
+
+import numpy as np
+
+from scheduler import estimate_cost, pick_next
+
+HEAVY_ACCOUNT = "heavy"
+
+
+def workload(args) -> list:
+    rng = np.random.default_rng(args.seed)
+    jobs = [
+        {"account": HEAVY_ACCOUNT, "audio_seconds": args.heavy_minutes * 60 * rng.uniform(0.8, 1.2),
+         "arrival": i * 5.0}
+        for i in range(args.heavy_jobs)
+    ]
+    for user in range(args.light_users):
+        t = rng.uniform(0, 600)
+        while t < args.hours * 3600:
+            jobs.append({"account": f"user-{user}", "audio_seconds": rng.uniform(30, args.light_minutes * 60), "arrival": t})
+            t += rng.exponential(args.light_interval_minutes * 60)
+
+    jobs.sort(key=lambda job: job["arrival"])
+    for i, job in enumerate(jobs):
+        job["id"] = i
+        job["cost"] = estimate_cost(job["audio_seconds"], args.rtf)
+        job["enqueued_at"] = job["arrival"]
+        # Настоящее время работы отличается от оценки
+        job["actual"] = job["audio_seconds"] * args.rtf * rng.lognormal(0, 0.3) + 5
+    return jobs
+
+
+def fifo_pick(queued, running, served, now):
+    return min(queued, key=lambda job: job["enqueued_at"]) if queued else None
+
+
+def fair_pick(account_cap):
+    def pick(queued, running, served, now):
+        return pick_next(queued, running, served, now, account_cap=account_cap)
+    return pick
+
+
+def simulate(jobs: list, workers: int, pick, window: float) -> dict:
+    """Дискретно-событийная симуляция; возвращает время готовности каждой задачи"""
+    arrivals = list(jobs)
+    queued, active, finished = [], [], {}
+    running, history = {}, []
+    t, free, next_arrival = 0.0, workers, 0
+
+    while next_arrival < len(arrivals) or queued or active:
+        # Ближайшее событие: приход задачи или освобождение воркера
+        arrival_time = arrivals[next_arrival]["arrival"] if next_arrival < len(arrivals) else float("inf")
+        finish_time = active[0][0] if active else float("inf")
+        if arrival_time <= finish_time:
+            t = arrival_time
+            queued.append(arrivals[next_arrival])
+            next_arrival += 1
+        else:
+            t, _, job = heapq.heappop(active)
+            running[job["account"]] -= 1
+            finished[job["id"]] = t
+            free += 1
+
+        while free > 0 and queued:
+            # Как в TranscriptionQueue: старты за окно и все выполняющиеся задачи
+            served = {}
+            for started, account, cost in history:
+                if started >= t - window:
+                    served[account] = served.get(account, 0.0) + cost
+            for _, _, running_job in active:
+                if running_job["started"] < t - window:
+                    served[running_job["account"]] = served.get(running_job["account"], 0.0) + running_job["cost"]
+            job = pick(queued, running, served, t)
+            if job is None:
+                break
+            queued.remove(job)
+            running[job["account"]] = running.get(job["account"], 0) + 1
+            history.append((t, job["account"], job["cost"]))
+            heapq.heappush(active, (t + job["actual"], job["id"], {**job, "started": t}))
+            free -= 1
+
+    return finished
+
+
+def latency_report(jobs: list, finished: dict) -> dict:
+    groups = {"light": [], "heavy": [], "all": []}
+    for job in jobs:
+        latency = finished[job["id"]] - job["arrival"]
+        groups["heavy" if job["account"] == HEAVY_ACCOUNT else "light"].append(latency)
+        groups["all"].append(latency)
+    return {
+        name: {"jobs": len(values), "mean": float(np.mean(values)), "p95": float(np.percentile(values, 95))}
+        for name, values in groups.items() if values
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, default=3)
+    parser.add_argument("--heavy-jobs", type=int, default=10)
+    parser.add_argument("--heavy-minutes", type=float, default=120.0)
+    parser.add_argument("--light-users", type=int, default=30)
+    parser.add_argument("--light-minutes", type=float, default=4.0, help="longest light recording")
+    parser.add_argument("--light-interval-minutes", type=float, default=45.0)
+    parser.add_argument("--hours", type=float, default=4.0)
+    parser.add_argument("--rtf", type=float, default=0.25)
+    parser.add_argument("--account-cap", type=int, default=0)
+    parser.add_argument("--window", type=float, default=3600.0)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    jobs = workload(args)
+    policies = {"fifo": fifo_pick, "fair": fair_pick(args.account_cap)}
+    for name, pick in policies.items():
+        report = latency_report(jobs, simulate(jobs, args.workers, pick, args.window))
+        print(f"{name:<5} " + "  ".join(
+            f"{group} ({stats['jobs']}): mean {stats['mean'] / 60:7.1f} min  p95 {stats['p95'] / 60:7.1f} min"
+            for group, stats in report.items()
+        ))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,202 @@
+"""Детерминированные заменители whisper, pyannote и llama и синтетическое аудио.
+
+Заменители не зависят от моделей и сети, но читают те же файлы и memmap,
+что и настоящие, поэтому ввод-вывод, память и оркестрация пайплайна
+измеряются честно. Цену самих моделей можно имитировать параметром rtf:
+заменитель спит audio_seconds * rtf.
+"""
+import hashlib
+import time
+from typing import List
+
+import numpy as np
+
+from audio import SAMPLE_RATE, _wav_header
+from chunking import open_wav
+
+FRAME_SECONDS = 0.1
+SILENCE_RMS = 200
+MAX_SEGMENT_SECONDS = 8.0
+WRITE_BLOCK_SECONDS = 60
+
+VOCABULARY = (
+    "итак давайте обсудим план на следующий квартал бюджет команда сроки релиз "
+    "клиент договорились задача проверить отчёт вопрос предлагаю согласен"
+).split()
+
+
+def synthetic_turns(duration: float, speakers: int, seed: int = 0,
+                    min_turn: float = 2.0, max_turn: float = 12.0, gap: float = 0.4) -> List[dict]:
+    """Чередование реплик случайной длины с паузами между ними"""
+    rng = np.random.default_rng(seed)
+    turns, t, speaker = [], 0.0, 0
+    while t < duration:
+        end = min(duration, t + rng.uniform(min_turn, max_turn))
+        turns.append({"start": round(t, 3), "end": round(end, 3), "speaker": f"SPEAKER_{speaker:02d}"})
+        t = end + gap
+        speaker = (speaker + int(rng.integers(1, speakers))) % speakers if speakers > 1 else 0
+    return turns
+
+
+def write_synthetic_wav(path: str, duration: float, turns: List[dict], seed: int = 0):
+    """Пишет WAV блоками: у каждого спикера свой тон с модуляцией и шумом, в паузах тишина"""
+    rng = np.random.default_rng(seed)
+    total = int(duration * SAMPLE_RATE)
+    block = WRITE_BLOCK_SECONDS * SAMPLE_RATE
+    spans = [
+        (int(turn["start"] * SAMPLE_RATE), int(turn["end"] * SAMPLE_RATE), 120 + 40 * int(turn["speaker"].rsplit("_", 1)[1]))
+        for turn in turns
+    ]
+
+    with open(path, "wb") as f:
+        f.write(_wav_header(total * 2, SAMPLE_RATE))
+        for offset in range(0, total, block):
+            size = min(block, total - offset)
+            pitch = np.zeros(size, dtype=np.float32)
+            for start, end, frequency in spans:
+                if start < offset + size and end > offset:
+                    pitch[max(0, start - offset):end - offset] = frequency
+
+            t = np.arange(offset, offset + size) / SAMPLE_RATE
+            envelope = 0.5 + 0.5 * np.sin(2 * np.pi * 3 * t)
+            samples = np.sin(2 * np.pi * pitch * t) * envelope * 8000 * (pitch > 0) + rng.normal(0, 30, size)
+            f.write(np.clip(samples, -32768, 32767).astype("<i2").tobytes())
+
+
+def _frame_rms(samples: np.ndarray) -> np.ndarray:
+    frame = int(FRAME_SECONDS * SAMPLE_RATE)
+    count = len(samples) // frame
+    rms = np.empty(count, dtype=np.float32)
+    # Блоками по минуте, чтобы не материализовать многочасовую запись во float
+    step = 600
+    for i in range(0, count, step):
+        block = np.asarray(samples[i * frame:(i + step) * frame], dtype=np.float32)
+        n = len(block) // frame
+        rms[i:i + n] = np.sqrt((block[:n * frame].reshape(n, frame) ** 2).mean(axis=1))
+    return rms
+
+
+def _voiced_regions(samples: np.ndarray) -> List[tuple]:
+    voiced = _frame_rms(samples) > SILENCE_RMS
+    edges = np.flatnonzero(np.diff(np.concatenate([[0], voiced.astype(np.int8), [0]])))
+    return [
+        (float(start * FRAME_SECONDS), float(end * FRAME_SECONDS))
+        for start, end in zip(edges[::2], edges[1::2])
+    ]
+
+
+def _words(start: float, end: float) -> List[dict]:
+    seed = int(hashlib.sha256(f"{start:.1f}".encode()).hexdigest()[:8], 16)
+    count = max(1, int((end - start) * 2.5))
+    step = (end - start) / count
+    return [
+        {"word": VOCABULARY[(seed + i) % len(VOCABULARY)], "start": start + i * step, "end": start + (i + 1) * step}
+        for i in range(count)
+    ]
+
+
+class FakeWhisper:
+    """Заменитель WhisperServerPool: сегменты по озвученным участкам записи"""
+
+    def __init__(self, rtf: float = 0.0):
+        self.rtf = rtf
+
+    def transcribe(self, wav_file: str, language: str = "ru", translate: bool = False) -> dict:
+        samples, sample_rate = open_wav(wav_file)
+        time.sleep(len(samples) / sample_rate * self.rtf)
+
+        segments = []
+        for start, end in _voiced_regions(samples):
+            while start < end:
+                stop = min(end, start + MAX_SEGMENT_SECONDS)
+                words = _words(start, stop)
+                segments.append({
+                    "text": " ".join(w["word"] for w in words),
+                    "start": start,
+                    "end": stop,
+                    "words": words,
+                })
+                start = stop
+        return {"segments": segments, "language": language or "ru"}
+
+
+class _Turn:
+    def __init__(self, start: float, end: float):
+        self.start = start
+        self.end = end
+
+
+class FakeAnnotation:
+    def __init__(self, turns: List[dict]):
+        self.turns = turns
+
+    def itertracks(self, yield_label: bool = False):
+        for turn in self.turns:
+            yield _Turn(turn["start"], turn["end"]), None, turn["speaker"]
+
+    def labels(self) -> List[str]:
+        return sorted(set(turn["speaker"] for turn in self.turns))
+
+
+class FakeDiarization:
+    """Заменитель pyannote Pipeline.
+
+    Спикер озвученного участка определяется по основному тону: в синтетической
+    записи у каждого спикера своя частота. Работает с любым отрезком записи,
+    поэтому годится и для оконной диаризации; эмбеддинг спикера - единичный
+    вектор его номера.
+    """
+
+    EMBEDDING_SIZE = 16
+
+    def __init__(self, rtf: float = 0.0):
+        self.rtf = rtf
+
+    def to(self, device):
+        return self
+
+    @staticmethod
+    def _speaker(samples: np.ndarray, start: float, end: float) -> int:
+        lo = int(start * SAMPLE_RATE)
+        hi = min(int(end * SAMPLE_RATE), lo + SAMPLE_RATE)
+        spectrum = np.abs(np.fft.rfft(np.asarray(samples[lo:hi], dtype=np.float32)))
+        frequency = np.argmax(spectrum[1:]) + 1
+        frequency = frequency * SAMPLE_RATE / (hi - lo)
+        return max(0, int(round((frequency - 120) / 40)))
+
+    def __call__(self, file: dict, num_speakers: int = None, return_embeddings: bool = False, **kwargs):
+        waveform, sample_rate = file["waveform"], file["sample_rate"]
+        time.sleep(waveform.shape[-1] / sample_rate * self.rtf)
+
+        samples = (waveform.reshape(-1).numpy() * 32768).astype(np.int16)
+        turns = [
+            {"start": start, "end": end, "speaker": f"SPEAKER_{self._speaker(samples, start, end):02d}"}
+            for start, end in _voiced_regions(samples)
+        ]
+        annotation = FakeAnnotation(turns)
+        if not return_embeddings:
+            return annotation
+
+        embeddings = np.zeros((len(annotation.labels()), self.EMBEDDING_SIZE))
+        for row, label in enumerate(annotation.labels()):
+            embeddings[row, int(label.rsplit("_", 1)[1]) % self.EMBEDDING_SIZE] = 1.0
+        return annotation, embeddings
+
+
+class FakeLlamaServer:
+    """Заменитель LlamaServer: токен - слово, ответ - начало текста из промпта"""
+
+    def __init__(self, seconds_per_token: float = 0.0):
+        self.seconds_per_token = seconds_per_token
+
+    def ensure_running(self):
+        pass
+
+    def tokenize(self, text: str) -> list:
+        return text.split()
+
+    def complete(self, prompt: str, n_predict: int = 512) -> str:
+        text = prompt.rsplit("Текст:", 1)[-1].rsplit("Ответ:", 1)[0].split()
+        answer = text[:max(1, min(n_predict, len(text) // 4))]
+        time.sleep(len(answer) * self.seconds_per_token)
+        return " ".join(answer)
@@ -0,0 +1,125 @@
+import hashlib
+import json
+import logging
+import os
+import tempfile
+from threading import Lock
+from typing import Optional, Tuple
+
+from Crypto.Cipher import AES
+
+HASH_CHUNK_SAMPLES = 8 * 1024 * 1024
+
+
+class ResultCache:
+    """Кэш промежуточных результатов (реплики диаризации, сегменты whisper) на диске.
+
+    Ключ записи и ключ шифрования выводятся из хэша декодированного аудио и
+    параметров обработки. Сегменты whisper содержат текст разговора, поэтому
+    запись шифруется: прочитать её может только тот, у кого есть та же запись.
+    При превышении max_bytes удаляются записи, к которым дольше всего не обращались.
+    """
+
+    def __init__(self, directory: str, max_bytes: int):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.lock = Lock()
+        os.makedirs(directory, exist_ok=True)
+        self.total_bytes = sum(size for _, _, size in self._entries())
+
+    def key_for(self, audio, params: dict) -> Tuple[str, bytes]:
+        digest = hashlib.sha256()
+        for start in range(0, len(audio.samples), HASH_CHUNK_SAMPLES):
+            digest.update(memoryview(audio.samples[start:start + HASH_CHUNK_SAMPLES]))
+        digest.update(str(audio.sample_rate).encode())
+        digest.update(json.dumps(params, sort_keys=True).encode())
+        content = digest.digest()
+
+        cache_id = hashlib.sha256(b"voiceflow-cache-id:" + content).hexdigest()
+        key = hashlib.sha256(b"voiceflow-cache-key:" + content).digest()
+        return cache_id, key
+
+    def _path(self, cache_id: str) -> str:
+        return os.path.join(self.directory, cache_id[:2], f"{cache_id}.bin")
+
+    def get(self, cache_id: str, key: bytes) -> Optional[dict]:
+        path = self._path(cache_id)
+        try:
+            with open(path, "rb") as f:
+                blob = f.read()
+        except FileNotFoundError:
+            return None
+
+        try:
+            cipher = AES.new(key, AES.MODE_GCM, nonce=blob[:12])
+            value = json.loads(cipher.decrypt_and_verify(blob[12:-16], blob[-16:]))
+        except (ValueError, KeyError) as e:
+            logging.warning(f"Dropping unreadable cache entry {cache_id}: {str(e)}")
+            self._remove(path)
+            return None
+
+        os.utime(path)
+        return value
+
+    def put(self, cache_id: str, key: bytes, value: dict):
+        path = self._path(cache_id)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        nonce = os.urandom(12)
+        cipher = AES.new(key, AES.MODE_GCM, nonce=nonce)
+        ciphertext, tag = cipher.encrypt_and_digest(json.dumps(value, ensure_ascii=False).encode())
+        blob = nonce + ciphertext + tag
+
+        # Уникальный временный файл на каждую запись: одинаковый ключ могут писать
+        # несколько потоков и процессов сразу, os.replace публикует целый файл
+        fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(blob)
+        except BaseException:
+            os.remove(temp_path)
+            raise
+
+        with self.lock:
+            if os.path.exists(path):
+                self.total_bytes -= os.path.getsize(path)
+            os.replace(temp_path, path)
+            self.total_bytes += len(blob)
+            if self.total_bytes > self.max_bytes:
+                self._evict()
+
+    def _entries(self):
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                if name.endswith(".bin"):
+                    path = os.path.join(root, name)
+                    try:
+                        stat = os.stat(path)
+                    except FileNotFoundError:
+                        continue
+                    yield path, stat.st_mtime, stat.st_size
+
+    def _remove(self, path: str):
+        try:
+            size = os.path.getsize(path)
+            os.remove(path)
+        except FileNotFoundError:
+            return
+        with self.lock:
+            self.total_bytes -= size
+
+    def _evict(self):
+        entries = sorted(self._entries(), key=lambda entry: entry[1])
+        self.total_bytes = sum(size for _, _, size in entries)
+
+        # Освобождаем с запасом, чтобы не сканировать каталог на каждой записи
+        for path, _, size in entries:
+            if self.total_bytes <= self.max_bytes * 0.9:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            self.total_bytes -= size
+
+        logging.info(f"Result cache evicted down to {self.total_bytes / 1024 / 1024:.1f} MB")
@@ -0,0 +1,135 @@
+import re
+import struct
+import wave
+from typing import List, Tuple
+
+import numpy as np
+
+
+def open_wav(path: str) -> Tuple[np.ndarray, int]:
+    """Открывает 16-битный моно WAV как memmap без чтения в память"""
+    with open(path, "rb") as f:
+        riff, _, wave_id = struct.unpack("<4sI4s", f.read(12))
+        if riff != b"RIFF" or wave_id != b"WAVE":
+            raise ValueError(f"{path} is not a WAV file")
+
+        sample_rate = None
+        while True:
+            header = f.read(8)
+            if len(header) < 8:
+                raise ValueError(f"{path} has no data chunk")
+            chunk_id, chunk_size = struct.unpack("<4sI", header)
+            if chunk_id == b"fmt ":
+                fmt = f.read(chunk_size)
+                _, channels, sample_rate, _, _, bits = struct.unpack("<HHIIHH", fmt[:16])
+                if channels != 1 or bits != 16:
+                    raise ValueError(f"Expected 16-bit mono WAV, got {channels} channels, {bits} bits")
+            elif chunk_id == b"data":
+                offset = f.tell()
+                break
+            else:
+                f.seek(chunk_size + (chunk_size & 1), 1)
+
+    if sample_rate is None:
+        raise ValueError(f"{path} has no fmt chunk")
+    return np.memmap(path, dtype="<i2", mode="r", offset=offset), sample_rate
+
+
+def find_split_points(samples: np.ndarray, sample_rate: int, chunk_seconds: float,
+                      search_seconds: float = 5.0, frame_seconds: float = 0.03) -> List[int]:
+    """Ищет точки разреза возле каждой границы чанка в самом тихом кадре.
+
+    Энергия считается только в окне поиска вокруг границы, поэтому весь
+    сигнал в память не загружается.
+    """
+    total = len(samples)
+    chunk = int(chunk_seconds * sample_rate)
+    search = int(search_seconds * sample_rate)
+    frame = max(1, int(frame_seconds * sample_rate))
+
+    points = [0]
+    while total - points[-1] > chunk + search:
+        target = points[-1] + chunk
+        lo = max(points[-1] + frame, target - search)
+        hi = min(total, target + search)
+
+        window = np.asarray(samples[lo:hi], dtype=np.float32)
+        n_frames = len(window) // frame
+        if n_frames == 0:
+            points.append(target)
+            continue
+        energy = np.square(window[:n_frames * frame].reshape(n_frames, frame)).mean(axis=1)
+        # Среди одинаково тихих кадров (цифровая тишина) берём ближайший к целевой границе
+        quiet = np.flatnonzero(energy <= energy.min() + 1e-6)
+        centers = lo + quiet * frame + frame // 2
+        points.append(int(centers[np.argmin(np.abs(centers - target))]))
+
+    return points
+
+
+def plan_chunks(samples: np.ndarray, sample_rate: int, chunk_seconds: float,
+                overlap_seconds: float = 1.0) -> List[dict]:
+    """Разбивает запись на чанки с перекрытием.
+
+    owned_start/owned_end - часть записи, за которую отвечает чанк при сшивке,
+    start/end - фактически транскрибируемый отрезок с перекрытием.
+    """
+    total = len(samples)
+    overlap = int(overlap_seconds * sample_rate)
+    points = find_split_points(samples, sample_rate, chunk_seconds) + [total]
+
+    return [
+        {
+            "start": max(0, owned_start - overlap),
+            "end": min(total, owned_end + overlap),
+            "owned_start": owned_start / sample_rate,
+            "owned_end": owned_end / sample_rate,
+        }
+        for owned_start, owned_end in zip(points, points[1:])
+    ]
+
+
+def write_chunk(samples: np.ndarray, sample_rate: int, start: int, end: int, path: str):
+    with wave.open(path, "wb") as w:
+        w.setnchannels(1)
+        w.setsampwidth(2)
+        w.setframerate(sample_rate)
+        w.writeframes(np.ascontiguousarray(samples[start:end]).tobytes())
+
+
+def _normalize(text: str) -> str:
+    return re.sub(r"[^\w]+", " ", text.lower()).strip()
+
+
+def stitch_chunks(chunk_results: List[Tuple[dict, dict]], sample_rate: int) -> List[dict]:
+    """Склеивает сегменты чанков, сдвигая время и убирая дубли из перекрытий.
+
+    Сегмент остаётся в том чанке, которому принадлежит его середина; если на
+    стыке оба чанка всё же дали одинаковый текст, второй отбрасывается.
+    """
+    stitched = []
+    for chunk, result in chunk_results:
+        offset = chunk["start"] / sample_rate
+        is_last = chunk is chunk_results[-1][0]
+
+        for seg in result["segments"]:
+            start = seg["start"] + offset
+            end = seg["end"] + offset
+            middle = (start + end) / 2
+            if middle < chunk["owned_start"] or (middle >= chunk["owned_end"] and not is_last):
+                continue
+
+            if stitched and start < stitched[-1]["end"] and _normalize(seg["text"]) == _normalize(stitched[-1]["text"]):
+                continue
+
+            stitched.append({
+                **seg,
+                "start": start,
+                "end": end,
+                "words": [
+                    {**word, "start": word["start"] + offset, "end": word["end"] + offset}
+                    for word in seg.get("words", [])
+                ],
+            })
+
+    return stitched
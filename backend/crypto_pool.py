@@ -0,0 +1,46 @@
+import asyncio
+import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+
+class CryptoPoolBusy(Exception):
+    """Очередь KDF-операций переполнена, запрос нужно повторить позже"""
+
+
+class CryptoPool:
+    """Ограниченный пул для bcrypt/PBKDF2, чтобы они не блокировали event loop.
+
+    Одновременно выполняется не больше max_workers операций и ждёт ещё не
+    больше max_pending - max_workers; сверх этого запросы сразу отклоняются.
+    """
+
+    def __init__(self, max_workers: int = 4, max_pending: int = 64, kind: str = "thread"):
+        if kind == "process":
+            self.executor = ProcessPoolExecutor(max_workers=max_workers)
+        elif kind == "thread":
+            self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="crypto")
+        else:
+            raise ValueError(f"Unknown crypto executor kind: {kind}")
+        self.max_pending = max_pending
+        self.pending = 0
+
+    async def run(self, fn, *args):
+        # Счётчик меняется только из event loop, блокировка не нужна
+        if self.pending >= self.max_pending:
+            raise CryptoPoolBusy()
+        self.pending += 1
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self.executor, fn, *args)
+        finally:
+            self.pending -= 1
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False)
+
+
+def crypto_pool_from_env() -> CryptoPool:
+    return CryptoPool(
+        max_workers=int(os.getenv("CRYPTO_WORKERS", str(os.cpu_count() or 2))),
+        max_pending=int(os.getenv("CRYPTO_MAX_PENDING", "64")),
+        kind=os.getenv("CRYPTO_EXECUTOR", "thread"),
+    )
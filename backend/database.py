@@ -1,10 +1,12 @@
-from sqlalchemy import create_engine, Column, Integer, String, ForeignKey, LargeBinary, Text, Boolean, Float, DateTime
+from sqlalchemy import create_engine, inspect, text, Column, Integer, String, ForeignKey, LargeBinary, Text, Boolean, Float, DateTime, Index, BigInteger
 from sqlalchemy.orm import relationship
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
 from dotenv import load_dotenv
 from datetime import datetime
 import os
+import uuid
 
 load_dotenv()
 
@@ -19,9 +21,23 @@ DATABASE_URL = f"mysql+pymysql://{user}:{password}@{host}:{port}/{database}"
 
 Base = declarative_base()
 
-engine = create_engine(DATABASE_URL, pool_recycle=3600)
+ASYNC_DATABASE_URL = f"mysql+aiomysql://{user}:{password}@{host}:{port}/{database}"
+
+POOL_SETTINGS = dict(
+    pool_size=int(os.getenv('DB_POOL_SIZE', '10')),
+    max_overflow=int(os.getenv('DB_MAX_OVERFLOW', '20')),
+    pool_timeout=int(os.getenv('DB_POOL_TIMEOUT', '30')),
+    pool_recycle=int(os.getenv('DB_POOL_RECYCLE', '3600')),
+    pool_pre_ping=True,
+)
+
+# Синхронный движок - для потоков обработки, асинхронный - для эндпоинтов
+engine = create_engine(DATABASE_URL, **POOL_SETTINGS)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+async_engine = create_async_engine(ASYNC_DATABASE_URL, **POOL_SETTINGS)
+AsyncSessionLocal = sessionmaker(async_engine, class_=AsyncSession, autoflush=False, expire_on_commit=False)
+
 class Account(Base):
     __tablename__ = 'accounts'
 
@@ -32,6 +48,7 @@ class Account(Base):
     is_admin = Column(Boolean, default=False)
     emails = relationship("Email", back_populates="account", uselist=False)
     transcripts = relationship("Transcript", back_populates="account")
+    jobs = relationship("Job", back_populates="account")
 
 class Email(Base):
     __tablename__ = 'emails'
@@ -44,13 +61,87 @@ class Email(Base):
 
 class Transcript(Base):
     __tablename__ = 'transcripts'
+    __table_args__ = (
+        Index('ix_transcripts_account_created', 'account_id', 'created_at', 'id'),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
+    # encrypted_data - base64 в самой таблице (старые записи), новые лежат в хранилище блобов
     encrypted_data = Column(Text)
+    blob_ref = Column(String(64), nullable=True)
+    blob_size = Column(BigInteger, nullable=True)
     account_id = Column(Integer, ForeignKey('accounts.id'))
     account = relationship("Account", back_populates="transcripts")
     meeting_name = Column(String(255))
     created_at = Column(DateTime, default=datetime.utcnow)
     audio_duration = Column(Float)
 
-Base.metadata.create_all(bind=engine)
\ No newline at end of file
+class Job(Base):
+    __tablename__ = 'jobs'
+    __table_args__ = (
+        Index('ix_jobs_status_created', 'status', 'created_at'),
+    )
+
+    id = Column(String(36), primary_key=True, default=lambda: str(uuid.uuid4()))
+    account_id = Column(Integer, ForeignKey('accounts.id'), index=True)
+    account = relationship("Account", back_populates="jobs")
+    transcript_id = Column(Integer, ForeignKey('transcripts.id'), nullable=True)
+    status = Column(String(16), default="queued", index=True)
+    stage = Column(String(32), nullable=True)
+    progress = Column(Float, default=0.0)
+    error = Column(Text, nullable=True)
+    attempts = Column(Integer, default=0)
+    input_path = Column(String(1024))
+    encrypted_key = Column(String(512))
+    meeting_name = Column(String(255))
+    speaker_count = Column(Integer, nullable=True)
+    language = Column(String(16), default="ru")
+    # Длительность загруженной записи по ffprobe, для оценки стоимости задачи в планировщике
+    audio_seconds = Column(Float, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    started_at = Column(DateTime, nullable=True)
+    finished_at = Column(DateTime, nullable=True)
+    # Воркер, забравший задачу из очереди, и его последний heartbeat
+    worker_id = Column(String(64), nullable=True)
+    heartbeat_at = Column(DateTime, nullable=True)
+
+# create_all не меняет существующие таблицы: колонки, добавленные в уже
+# развёрнутые таблицы, дописываются здесь (таблица, колонка, DDL-тип)
+ADDED_COLUMNS = [
+    ('transcripts', 'blob_ref', 'VARCHAR(64) NULL'),
+    ('transcripts', 'blob_size', 'BIGINT NULL'),
+    ('jobs', 'worker_id', 'VARCHAR(64) NULL'),
+    ('jobs', 'heartbeat_at', 'DATETIME NULL'),
+    ('jobs', 'audio_seconds', 'FLOAT NULL'),
+]
+
+
+def migrate_columns(bind):
+    """Идемпотентно добавляет недостающие колонки из ADDED_COLUMNS"""
+    inspector = inspect(bind)
+    with bind.begin() as conn:
+        for table, column, ddl in ADDED_COLUMNS:
+            existing = {c['name'] for c in inspector.get_columns(table)}
+            if column not in existing:
+                conn.execute(text(f'ALTER TABLE {table} ADD COLUMN {column} {ddl}'))
+
+
+# Индексы этих таблиц из модели создаются, если их нет в развёрнутой БД
+MIGRATED_INDEX_TABLES = ('transcripts', 'jobs')
+
+
+def migrate_indexes(bind):
+    """Идемпотентно создаёт индексы моделей, которых нет в существующих таблицах"""
+    inspector = inspect(bind)
+    for table in Base.metadata.sorted_tables:
+        if table.name not in MIGRATED_INDEX_TABLES:
+            continue
+        existing = {index['name'] for index in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name not in existing:
+                index.create(bind)
+
+
+Base.metadata.create_all(bind=engine)
+migrate_columns(engine)
+migrate_indexes(engine)
\ No newline at end of file
@@ -0,0 +1,139 @@
+"""Оконная диаризация длинных записей с ограниченной памятью.
+
+Запись читается из memmap окнами по ~window_seconds, разрезанными в паузах
+(find_split_points), и каждое окно проходит через pyannote отдельно. Для
+каждого локального спикера окна сохраняется его эмбеддинг (центроид из
+pipeline(..., return_embeddings=True)). После последнего окна центроиды
+кластеризуются агломеративно по косинусному расстоянию, и локальные метки
+заменяются глобальными. Спикеры одного окна pyannote уже различил, поэтому
+объединять их между собой кластеризации запрещено.
+
+В памяти одновременно держится одно окно float32 и по вектору на локального
+спикера, так что пиковое потребление не зависит от длительности записи.
+"""
+import logging
+from typing import List, Tuple
+
+import numpy as np
+from scipy.cluster.hierarchy import fcluster, linkage
+from scipy.spatial.distance import squareform
+
+from audio import AudioBuffer
+from chunking import find_split_points
+
+logger = logging.getLogger(__name__)
+
+# Расстояние между спикерами одного окна: больше любого косинусного
+CANNOT_LINK_DISTANCE = 2.0
+# Реплики одного спикера, кончающиеся и начинающиеся так близко к границе окна, склеиваются
+BOUNDARY_JOIN_SECONDS = 0.5
+
+
+def cluster_centroids(embeddings: np.ndarray, windows: np.ndarray, num_speakers: int = None,
+                      threshold: float = 0.7) -> np.ndarray:
+    """Глобальные метки 0..K-1 для локальных спикеров по их центроидам"""
+    if len(embeddings) == 1:
+        return np.zeros(1, dtype=int)
+
+    normalized = embeddings / np.linalg.norm(embeddings, axis=1, keepdims=True)
+    distances = np.clip(1.0 - normalized @ normalized.T, 0.0, 2.0)
+    same_window = windows[:, None] == windows[None, :]
+    distances[same_window] = CANNOT_LINK_DISTANCE
+    np.fill_diagonal(distances, 0.0)
+
+    tree = linkage(squareform(distances, checks=False), method="average")
+    if num_speakers:
+        labels = fcluster(tree, t=num_speakers, criterion="maxclust")
+    else:
+        labels = fcluster(tree, t=threshold, criterion="distance")
+    return labels - 1
+
+
+class WindowedDiarizer:
+    def __init__(self, pipeline, window_seconds: float = 900.0, threshold: float = 0.7):
+        self.pipeline = pipeline
+        self.window_seconds = window_seconds
+        self.threshold = threshold
+
+    def _diarize_window(self, audio: AudioBuffer, start: int, end: int, num_speakers: int):
+        import torch
+
+        waveform = torch.from_numpy(audio.waveform(start, end)).unsqueeze(0)
+        # В окне может говорить только часть участников, поэтому число спикеров - верхняя граница
+        params = {"max_speakers": num_speakers} if num_speakers else {}
+        diarization, embeddings = self.pipeline(
+            {"waveform": waveform, "sample_rate": audio.sample_rate}, return_embeddings=True, **params
+        )
+        del waveform
+
+        offset = start / audio.sample_rate
+        turns = [
+            {"start": turn.start + offset, "end": turn.end + offset, "speaker": speaker}
+            for turn, _, speaker in diarization.itertracks(yield_label=True)
+        ]
+        # Строки эмбеддингов идут в порядке diarization.labels()
+        return turns, dict(zip(diarization.labels(), embeddings))
+
+    def __call__(self, audio: AudioBuffer, num_speakers: int = None) -> Tuple[List[dict], int]:
+        points = find_split_points(audio.samples, audio.sample_rate, self.window_seconds) + [len(audio.samples)]
+        logger.info(f"Windowed diarization of {audio.path}: {len(points) - 1} windows of ~{self.window_seconds:.0f}s")
+
+        turns, keys, centroids, speech = [], [], [], []
+        for index, (start, end) in enumerate(zip(points, points[1:])):
+            window_turns, window_embeddings = self._diarize_window(audio, start, end, num_speakers)
+            for turn in window_turns:
+                turn["speaker"] = (index, turn["speaker"])
+            turns.extend(window_turns)
+
+            for label, embedding in window_embeddings.items():
+                keys.append((index, label))
+                centroids.append(embedding)
+                speech.append(sum(t["end"] - t["start"] for t in window_turns if t["speaker"] == (index, label)))
+
+        if not turns:
+            return [], 0
+
+        mapping = self._global_labels(keys, np.asarray(centroids, dtype=np.float64), speech, num_speakers)
+        segments = self._stitch(turns, mapping, [point / audio.sample_rate for point in points[1:-1]])
+        detected = len(set(mapping.values()))
+        logger.info(f"Detected {detected} speakers across {len(points) - 1} windows")
+        return segments, detected
+
+    def _global_labels(self, keys: list, centroids: np.ndarray, speech: list, num_speakers: int) -> dict:
+        # У спикеров с очень короткой речью pyannote может вернуть NaN вместо эмбеддинга
+        valid = ~np.isnan(centroids).any(axis=1) & (np.linalg.norm(np.nan_to_num(centroids), axis=1) > 0)
+        mapping = {}
+        if valid.any():
+            windows = np.asarray([key[0] for key in keys])
+            labels = cluster_centroids(centroids[valid], windows[valid], num_speakers, self.threshold)
+            for key, label in zip([k for k, ok in zip(keys, valid) if ok], labels):
+                mapping[key] = f"SPEAKER_{label:02d}"
+
+        # Такие спикеры отдаются основному спикеру своего окна
+        for key, ok in zip(keys, valid):
+            if ok:
+                continue
+            same_window = [(s, mapping[k]) for k, s in zip(keys, speech) if k[0] == key[0] and k in mapping]
+            mapping[key] = max(same_window)[1] if same_window else "SPEAKER_00"
+        return mapping
+
+    def _stitch(self, turns: List[dict], mapping: dict, boundaries: List[float]) -> List[dict]:
+        """Заменяет метки на глобальные и склеивает реплики, разрезанные границей окна"""
+        boundaries = np.asarray(boundaries)
+
+        def near_boundary(t: float) -> bool:
+            return len(boundaries) > 0 and np.abs(boundaries - t).min() <= BOUNDARY_JOIN_SECONDS
+
+        segments = []
+        last_by_speaker = {}
+        for turn in sorted(turns, key=lambda t: t["start"]):
+            speaker = mapping.get(turn["speaker"], "SPEAKER_00")
+            previous = last_by_speaker.get(speaker)
+            if (previous is not None and previous["end"] <= turn["start"]
+                    and near_boundary(previous["end"]) and near_boundary(turn["start"])):
+                previous["end"] = turn["end"]
+                continue
+            segment = {"start": turn["start"], "end": turn["end"], "speaker": speaker}
+            segments.append(segment)
+            last_by_speaker[speaker] = segment
+        return segments
@@ -0,0 +1,180 @@
+"""Профиль исполнения pyannote: устройство, потоки, размеры батчей, квантизация.
+
+INFERENCE_DEVICE=auto|cpu|cuda выбирает устройство; auto - cuda, если она есть.
+
+На CPU диаризация выполняется в DIARIZATION_CPU_SLOTS выделенных потоках
+(по умолчанию по числу TRANSCRIPTION_WORKERS). Каждый слот получает
+cores // slots потоков intra-op torch, поэтому параллельные задачи не делят
+одни и те же ядра и не переподписывают процессор. С DIARIZATION_CPU_AFFINITY
+(например "0-15") ядра дополнительно делятся между слотами и каждый слот
+привязывается к своим: потоки OpenMP, созданные слотом, наследуют привязку.
+Остальные ядра остаются whisper-server и API.
+
+DIARIZATION_QUANTIZE=int8 включает динамическую int8-квантизацию LSTM и
+Linear слоёв модели сегментации (только на CPU). Модель эмбеддингов (WeSpeaker
+ResNet) почти целиком из Conv2d, которые динамическая квантизация не
+затрагивает, поэтому она остаётся в float32; выигрыш в RTF меряется
+benchmarks/bench_diarization.py.
+"""
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from queue import Queue
+from typing import List
+
+logger = logging.getLogger(__name__)
+
+QUANTIZE_MODES = ("", "int8")
+
+
+def available_cores() -> List[int]:
+    """Ядра, доступные процессу с учётом taskset/cpuset"""
+    try:
+        return sorted(os.sched_getaffinity(0))
+    except AttributeError:
+        return list(range(os.cpu_count() or 1))
+
+
+def parse_cpu_list(value: str) -> List[int]:
+    """Разбирает список ядер в формате taskset: "0-7,16,18-19" """
+    cores = []
+    for part in filter(None, (p.strip() for p in value.split(","))):
+        if "-" in part:
+            first, last = part.split("-", 1)
+            cores.extend(range(int(first), int(last) + 1))
+        else:
+            cores.append(int(part))
+    return sorted(set(cores))
+
+
+def resolve_device(requested: str = "auto"):
+    import torch
+
+    if requested == "auto":
+        return torch.device("cuda" if torch.cuda.is_available() else "cpu")
+    if requested.startswith("cuda") and not torch.cuda.is_available():
+        raise RuntimeError(f"INFERENCE_DEVICE={requested}, but CUDA is not available")
+    return torch.device(requested)
+
+
+def quantize_int8(pipeline):
+    """Динамическая int8-квантизация модели сегментации pyannote 3.1 (LSTM и Linear)"""
+    import torch
+    from torch.ao.quantization import quantize_dynamic
+
+    segmentation = getattr(pipeline, "_segmentation", None)
+    if segmentation is None or not hasattr(segmentation, "model"):
+        logger.warning("Diarization pipeline has no segmentation model to quantize, running in float32")
+        return
+    segmentation.model = quantize_dynamic(segmentation.model, {torch.nn.LSTM, torch.nn.Linear}, dtype=torch.qint8)
+    logger.info("Quantized the diarization segmentation model to int8")
+
+
+class DiarizationRuntime:
+    def __init__(self, device: str = "auto", slots: int = 1, threads: int = 0, affinity: str = "",
+                 segmentation_batch_size: int = 0, embedding_batch_size: int = 0, quantize: str = ""):
+        if quantize not in QUANTIZE_MODES:
+            raise ValueError(f"Unknown DIARIZATION_QUANTIZE {quantize!r}, expected one of {QUANTIZE_MODES}")
+        self.requested_device = device
+        self.device = None
+        self.slots = max(1, slots)
+        self.threads = threads
+        self.affinity = parse_cpu_list(affinity) if affinity else []
+        self.segmentation_batch_size = segmentation_batch_size
+        self.embedding_batch_size = embedding_batch_size
+        self.quantize = quantize
+        self.executors = Queue()
+
+    @classmethod
+    def from_env(cls, default_slots: int = 1) -> "DiarizationRuntime":
+        return cls(
+            device=os.getenv("INFERENCE_DEVICE", "auto"),
+            slots=int(os.getenv("DIARIZATION_CPU_SLOTS", str(default_slots))),
+            threads=int(os.getenv("DIARIZATION_CPU_THREADS", "0")),
+            affinity=os.getenv("DIARIZATION_CPU_AFFINITY", ""),
+            segmentation_batch_size=int(os.getenv("DIARIZATION_SEGMENTATION_BATCH_SIZE", "0")),
+            embedding_batch_size=int(os.getenv("DIARIZATION_EMBEDDING_BATCH_SIZE", "0")),
+            quantize=os.getenv("DIARIZATION_QUANTIZE", ""),
+        )
+
+    @property
+    def is_cuda(self) -> bool:
+        return self.device is not None and self.device.type == "cuda"
+
+    def prepare(self, pipeline):
+        """Переносит pipeline на устройство и применяет профиль; вызывается один раз при загрузке"""
+        import torch
+
+        self.device = resolve_device(self.requested_device)
+        pipeline.to(self.device)
+
+        # 0 - оставить значения из конфига pipeline
+        if self.segmentation_batch_size > 0:
+            pipeline.segmentation_batch_size = self.segmentation_batch_size
+        if self.embedding_batch_size > 0:
+            pipeline.embedding_batch_size = self.embedding_batch_size
+
+        if self.is_cuda:
+            if self.quantize:
+                logger.warning("DIARIZATION_QUANTIZE is ignored on CUDA")
+            logger.info(f"Diarization runs on {self.device}")
+            return pipeline
+
+        if self.quantize == "int8":
+            quantize_int8(pipeline)
+
+        cores = self.affinity or available_cores()
+        unavailable = sorted(set(cores) - set(available_cores()))
+        if unavailable:
+            raise RuntimeError(f"DIARIZATION_CPU_AFFINITY lists cores {unavailable} not available to the process")
+        threads = self.threads or max(1, len(cores) // self.slots)
+        try:
+            # Параллелизм внутри операторов уже даёт intra-op, отдельный inter-op пул только мешает
+            torch.set_num_interop_threads(1)
+        except RuntimeError:
+            pass
+        torch.set_num_threads(threads)
+
+        for slot in range(self.slots):
+            slot_cores = []
+            if self.affinity:
+                # Слоты получают непересекающиеся наборы ядер; если слотов больше, чем ядер, лишние делят последние
+                slot_cores = cores[slot * threads:(slot + 1) * threads] or cores[-threads:]
+            self.executors.put(ThreadPoolExecutor(
+                max_workers=1, thread_name_prefix=f"diarization-{slot}",
+                initializer=self._init_slot, initargs=(threads, slot_cores),
+            ))
+
+        logger.info(
+            f"Diarization runs on CPU: {self.slots} slots x {threads} threads"
+            + (f", pinned to cores {cores}" if self.affinity else "")
+            + (f", quantized {self.quantize}" if self.quantize else "")
+        )
+        return pipeline
+
+    @staticmethod
+    def _init_slot(threads: int, cores: List[int]):
+        import torch
+
+        # В Linux pid 0 - вызывающий поток, а не весь процесс
+        if cores:
+            os.sched_setaffinity(0, cores)
+        torch.set_num_threads(threads)
+
+    def run(self, fn, *args):
+        """Выполняет fn в свободном слоте CPU или в текущем потоке на CUDA"""
+        if self.is_cuda:
+            import torch
+
+            with torch.cuda.device(self.device):
+                try:
+                    return fn(*args)
+                finally:
+                    torch.cuda.empty_cache()
+
+        # Задача ждёт свободный слот, а не запускает ещё одну копию пула потоков torch
+        executor = self.executors.get()
+        try:
+            return executor.submit(fn, *args).result()
+        finally:
+            self.executors.put(executor)
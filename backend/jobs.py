@@ -0,0 +1,305 @@
+import asyncio
+import base64
+import hashlib
+import logging
+import os
+from datetime import datetime, timedelta
+
+from cryptography.fernet import Fernet
+from dotenv import load_dotenv
+from sqlalchemy import func, or_
+from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from database import SessionLocal, Job
+from scheduler import SCHEDULER_FAIRNESS_WINDOW_SECONDS, estimate_cost, pick_next, plan_queue
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_DONE = "done"
+JOB_FAILED = "failed"
+
+MAX_JOB_ATTEMPTS = int(os.getenv("MAX_JOB_ATTEMPTS", "3"))
+
+# inline - задачи выполняет сам процесс API, broker - API только ставит их
+# в таблицу jobs, а выполняют отдельные воркеры (worker.py)
+INFERENCE_MODE = os.getenv("INFERENCE_MODE", "inline")
+# Задача воркера без heartbeat дольше этого срока считается брошенной
+JOB_LEASE_SECONDS = int(os.getenv("JOB_LEASE_SECONDS", "120"))
+# Сколько задач все воркеры брокера выполняют одновременно, для оценки ETA
+SCHEDULER_SLOTS = int(os.getenv("SCHEDULER_SLOTS", os.getenv("TRANSCRIPTION_WORKERS", "3")))
+# Сколько кандидатов claim_job перебирает, если строки уже забрали другие воркеры
+CLAIM_ATTEMPTS = 5
+
+# Ключ пользователя нужен, чтобы дошифровать результат после рестарта,
+# поэтому пока задача не завершена, он хранится зашифрованным серверным
+# ключом из JOB_KEY_SECRET (общий для API и воркеров) и стирается, как только
+# задача готова или упала
+JOB_KEY_SECRET = os.getenv("JOB_KEY_SECRET")
+if not JOB_KEY_SECRET:
+    raise RuntimeError("JOB_KEY_SECRET is not set")
+_job_fernet = Fernet(base64.urlsafe_b64encode(hashlib.sha256(f"job-key:{JOB_KEY_SECRET}".encode()).digest()))
+
+
+async def create_job(db: AsyncSession, account, input_path: str, decrypted_key: str, meeting_name: str,
+                     speaker_count: int = None, language: str = "ru", audio_seconds: float = None) -> Job:
+    job = Job(
+        account_id=account.id,
+        status=JOB_QUEUED,
+        stage="queued",
+        progress=0.0,
+        input_path=input_path,
+        encrypted_key=_job_fernet.encrypt(decrypted_key.encode()).decode(),
+        meeting_name=meeting_name,
+        speaker_count=speaker_count,
+        language=language,
+        audio_seconds=audio_seconds,
+    )
+    db.add(job)
+    await db.commit()
+    await db.refresh(job)
+    return job
+
+
+def update_job(job_id: str, **fields):
+    """Обновляет задачу в отдельной короткой сессии"""
+    with SessionLocal() as db:
+        db.query(Job).filter(Job.id == job_id).update(fields)
+        db.commit()
+
+
+def job_key(job: Job) -> str:
+    return _job_fernet.decrypt(job.encrypted_key.encode()).decode()
+
+
+def job_status(job: Job) -> dict:
+    now = datetime.utcnow()
+    queued_until = job.started_at or now
+    processing_until = job.finished_at or now
+
+    return {
+        "id": job.id,
+        "status": job.status,
+        "stage": job.stage,
+        "progress": job.progress,
+        "error": job.error,
+        "transcript_id": job.transcript_id,
+        "meeting_name": job.meeting_name,
+        "created_at": job.created_at,
+        "started_at": job.started_at,
+        "finished_at": job.finished_at,
+        "queued_seconds": (queued_until - job.created_at).total_seconds() if job.created_at else None,
+        "processing_seconds": (processing_until - job.started_at).total_seconds() if job.started_at else None,
+    }
+
+
+def recover_jobs() -> list:
+    """Возвращает в очередь задачи, прерванные рестартом процесса"""
+    with SessionLocal() as db:
+        return _recover_jobs(db)
+
+
+def _recover_jobs(db: Session) -> list:
+    # Завершённые до стирания ключей задачи не должны хранить ключ пользователя
+    db.query(Job).filter(Job.status.in_([JOB_DONE, JOB_FAILED]), Job.encrypted_key.isnot(None)).update(
+        {"encrypted_key": None}, synchronize_session=False
+    )
+    interrupted = db.query(Job).filter(Job.status.in_([JOB_QUEUED, JOB_RUNNING])).all()
+    recovered = _requeue(db, interrupted)
+    if recovered:
+        logger.info(f"Re-enqueued {len(recovered)} interrupted jobs")
+    return recovered
+
+
+def _requeue(db: Session, interrupted: list) -> list:
+    recovered = []
+
+    for job in interrupted:
+        if not job.input_path or not os.path.exists(job.input_path):
+            job.status = JOB_FAILED
+            job.error = "Input file was lost before the job could be processed"
+            job.finished_at = datetime.utcnow()
+            job.encrypted_key = None
+        elif job.attempts >= MAX_JOB_ATTEMPTS:
+            job.status = JOB_FAILED
+            job.error = f"Job was interrupted {job.attempts} times"
+            job.finished_at = datetime.utcnow()
+            job.encrypted_key = None
+            _remove_input(job.input_path)
+        else:
+            job.status = JOB_QUEUED
+            job.stage = "queued"
+            job.progress = 0.0
+            job.worker_id = None
+            recovered.append(job.id)
+
+    db.commit()
+    return recovered
+
+
+def _seconds_ago(moment: datetime, now: datetime) -> float:
+    return -(now - moment).total_seconds() if moment else 0.0
+
+
+def _queue_state(db: Session, now: datetime):
+    """Очередь и выполняющиеся задачи в виде входа для политики планировщика.
+
+    Время отсчитывается от now: enqueued_at и started_at отрицательные.
+    """
+    queued = [
+        {"id": job_id, "account": account_id, "cost": estimate_cost(audio_seconds),
+         "enqueued_at": _seconds_ago(created_at, now)}
+        for job_id, account_id, audio_seconds, created_at in (
+            db.query(Job.id, Job.account_id, Job.audio_seconds, Job.created_at)
+            .filter(Job.status == JOB_QUEUED)
+            .all()
+        )
+    ]
+
+    window_start = now - timedelta(seconds=SCHEDULER_FAIRNESS_WINDOW_SECONDS)
+    running, running_jobs, served = {}, [], {}
+    for job_id, account_id, status, audio_seconds, started_at, heartbeat_at in (
+        db.query(Job.id, Job.account_id, Job.status, Job.audio_seconds, Job.started_at, Job.heartbeat_at)
+        .filter(or_(Job.status == JOB_RUNNING, Job.started_at >= window_start))
+        .all()
+    ):
+        cost = estimate_cost(audio_seconds)
+        served[account_id] = served.get(account_id, 0.0) + cost
+        if status == JOB_RUNNING:
+            running[account_id] = running.get(account_id, 0) + 1
+            running_jobs.append({
+                "id": job_id, "account": account_id, "cost": cost,
+                "started_at": _seconds_ago(started_at or heartbeat_at, now),
+            })
+    return queued, running, running_jobs, served
+
+
+def claim_job(worker_id: str):
+    """Забирает задачу из очереди по политике планировщика (scheduler.pick_next).
+
+    Выбор делается по снимку очереди, а строка блокируется через SKIP LOCKED:
+    если её уже забрал другой воркер, берётся следующий кандидат. Лимит на
+    аккаунт между воркерами соблюдается с точностью до такой гонки.
+    """
+    with SessionLocal() as db:
+        queued, running, _, served = _queue_state(db, datetime.utcnow())
+        for _ in range(CLAIM_ATTEMPTS):
+            candidate = pick_next(queued, running, served, 0.0)
+            if candidate is None:
+                break
+            job = (
+                db.query(Job)
+                .filter(Job.id == candidate["id"], Job.status == JOB_QUEUED)
+                .with_for_update(skip_locked=True)
+                .first()
+            )
+            if job is None:
+                queued.remove(candidate)
+                continue
+
+            job.status = JOB_RUNNING
+            job.stage = "claimed"
+            job.worker_id = worker_id
+            job.heartbeat_at = datetime.utcnow()
+            db.commit()
+            return job.id
+
+        db.rollback()
+        return None
+
+
+def count_queued_jobs() -> int:
+    with SessionLocal() as db:
+        return db.query(func.count(Job.id)).filter(Job.status == JOB_QUEUED).scalar()
+
+
+def broker_queue_plan() -> dict:
+    """Позиция в очереди и ETA задач брокера по id"""
+    with SessionLocal() as db:
+        queued, _, running_jobs, served = _queue_state(db, datetime.utcnow())
+    return plan_queue(queued, running_jobs, served, SCHEDULER_SLOTS, 0.0)
+
+
+def heartbeat_jobs(worker_id: str, job_ids: list):
+    if not job_ids:
+        return
+    with SessionLocal() as db:
+        db.query(Job).filter(Job.id.in_(job_ids), Job.worker_id == worker_id).update(
+            {"heartbeat_at": datetime.utcnow()}, synchronize_session=False
+        )
+        db.commit()
+
+
+def requeue_stale_jobs() -> list:
+    """Возвращает в очередь задачи воркеров, переставших присылать heartbeat"""
+    deadline = datetime.utcnow() - timedelta(seconds=JOB_LEASE_SECONDS)
+    with SessionLocal() as db:
+        stale = (
+            db.query(Job)
+            .filter(Job.status == JOB_RUNNING, Job.heartbeat_at < deadline)
+            .with_for_update(skip_locked=True)
+            .all()
+        )
+        recovered = _requeue(db, stale)
+    if recovered:
+        logger.info(f"Re-enqueued {len(recovered)} jobs abandoned by workers")
+    return recovered
+
+
+def _remove_input(path: str):
+    if path and os.path.exists(path):
+        os.remove(path)
+        logger.info(f"Removed input file: {path}")
+
+
+def _start_job(job_id: str):
+    with SessionLocal() as db:
+        job = db.query(Job).filter(Job.id == job_id).first()
+        if job is None or job.status not in (JOB_QUEUED, JOB_RUNNING):
+            return None
+        job.status = JOB_RUNNING
+        job.stage = "starting"
+        job.started_at = datetime.utcnow()
+        job.attempts = (job.attempts or 0) + 1
+        db.commit()
+
+        return dict(
+            file_path=job.input_path,
+            num_speakers=job.speaker_count,
+            translate=False,
+            language=job.language,
+            email=job.account.email,
+            decrypted_key=job_key(job),
+            meeting_name=job.meeting_name,
+            job_id=job.id,
+            transcript_id=job.transcript_id,
+        )
+
+
+async def run_job(predictor, job_id: str):
+    # Работа с БД идёт в потоках короткими сессиями, чтобы не блокировать event loop
+    params = await asyncio.to_thread(_start_job, job_id)
+    if params is None:
+        return
+    input_path = params["file_path"]
+
+    # Исключения, кроме отмены при остановке процесса, завершают задачу;
+    # при отмене задача остаётся в running и будет подхвачена recover_jobs
+    try:
+        await predictor.predict(**params)
+    except Exception as e:
+        logger.error(f"Job {job_id} failed: {str(e)}")
+        await asyncio.to_thread(
+            update_job, job_id, status=JOB_FAILED, error=str(e), finished_at=datetime.utcnow(), encrypted_key=None
+        )
+        _remove_input(input_path)
+        return
+
+    await asyncio.to_thread(
+        update_job, job_id, status=JOB_DONE, stage="done", progress=1.0, finished_at=datetime.utcnow(), encrypted_key=None
+    )
+    _remove_input(input_path)
@@ -0,0 +1,298 @@
+"""Живая расшифровка встречи через WebSocket.
+
+Протокол /ws/live?token=<JWT>:
+
+1. клиент -> JSON {"decrypted_key", "meeting_name", "speaker_count"?, "language"?, "format"?},
+   format: "pcm" (s16le, 16 кГц, моно; по умолчанию) или "container"
+   (поток webm/ogg из MediaRecorder, декодируется ffmpeg);
+2. клиент -> бинарные сообщения с аудио, текст {"type": "stop"} завершает запись;
+3. сервер -> {"type": "partial", "segments": [...]} - гипотеза для хвоста, ещё может измениться,
+             {"type": "final", "segments": [...]} - устоявшиеся сегменты, больше не меняются,
+             {"type": "done", "transcript_id": ..., "segments": [...]} - итог со спикерами,
+             {"type": "warning", "detail": "..."} - запись достигла LIVE_MAX_SECONDS и остановлена,
+             {"type": "error", "detail": "..."}.
+
+Whisper каждые LIVE_STEP_SECONDS прогоняется по окну от последнего
+зафиксированного сегмента до конца записи. Сегменты, закончившиеся раньше
+чем за LIVE_STABLE_SECONDS до конца окна, фиксируются, и окно сдвигается.
+Спикеры назначаются одним проходом диаризации после закрытия потока.
+
+Окна идут в whisper-server как срочные запросы: на WHISPER_LIVE_SERVERS
+выделенных серверах и вне очереди на общих, поэтому пакетные задачи их не
+задерживают. Без whisper-server (только whisper-cli) каждое окно заново
+загружало бы модель, поэтому живая расшифровка требует сервер.
+"""
+import asyncio
+import json
+import logging
+import os
+import tempfile
+
+import numpy as np
+from fastapi import WebSocket
+
+from audio import SAMPLE_RATE, AudioBuffer, _wav_header
+from chunking import open_wav, write_chunk
+from metrics import stage
+
+logger = logging.getLogger(__name__)
+
+LIVE_STEP_SECONDS = float(os.getenv("LIVE_STEP_SECONDS", "2.0"))
+LIVE_STABLE_SECONDS = float(os.getenv("LIVE_STABLE_SECONDS", "3.0"))
+LIVE_WINDOW_SECONDS = float(os.getenv("LIVE_WINDOW_SECONDS", "30.0"))
+LIVE_MAX_SECONDS = float(os.getenv("LIVE_MAX_SECONDS", str(4 * 3600)))
+LIVE_MAX_SESSIONS = int(os.getenv("LIVE_MAX_SESSIONS", "4"))
+
+WAV_HEADER_SIZE = 44
+MIN_WINDOW_SECONDS = 0.5
+
+active_sessions = 0
+
+
+class LiveSession:
+    """Копит PCM в WAV-файле и расшифровывает его скользящим окном"""
+
+    def __init__(self, predictor, email: str, decrypted_key: str, meeting_name: str,
+                 speaker_count: int = None, language: str = "ru"):
+        self.predictor = predictor
+        self.email = email
+        self.decrypted_key = decrypted_key
+        self.meeting_name = meeting_name
+        self.speaker_count = speaker_count
+        self.language = language
+
+        fd, self.path = tempfile.mkstemp(suffix=".wav")
+        self.file = os.fdopen(fd, "wb")
+        self.file.write(_wav_header(0, SAMPLE_RATE))
+        self.samples_written = 0
+        self.remainder = b""
+
+        self.committed_until = 0.0
+        self.decoded_until = 0
+        self.final_segments = []
+        self.new_audio = asyncio.Event()
+        self.input_closed = False
+        self.ffmpeg = None
+        self.ffmpeg_reader = None
+
+    @property
+    def duration(self) -> float:
+        return self.samples_written / SAMPLE_RATE
+
+    async def start_decoder(self):
+        """Запускает ffmpeg для контейнерных потоков (webm/ogg из браузера)"""
+        self.ffmpeg = await asyncio.create_subprocess_exec(
+            "ffmpeg", "-loglevel", "error", "-i", "pipe:0",
+            "-f", "s16le", "-acodec", "pcm_s16le", "-ac", "1", "-ar", str(SAMPLE_RATE), "pipe:1",
+            stdin=asyncio.subprocess.PIPE, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.DEVNULL
+        )
+        self.ffmpeg_reader = asyncio.create_task(self._read_ffmpeg())
+
+    async def _read_ffmpeg(self):
+        while chunk := await self.ffmpeg.stdout.read(64 * 1024):
+            self.append(chunk)
+
+    async def feed(self, data: bytes):
+        if self.full:
+            return
+        if self.ffmpeg is None:
+            self.append(data)
+            return
+        self.ffmpeg.stdin.write(data)
+        await self.ffmpeg.stdin.drain()
+
+    @property
+    def full(self) -> bool:
+        return self.samples_written >= int(LIVE_MAX_SECONDS * SAMPLE_RATE)
+
+    def append(self, pcm: bytes):
+        # Аудио сверх LIVE_MAX_SECONDS отбрасывается, записанное до предела сохраняется
+        if self.full:
+            return
+        data = self.remainder + pcm
+        usable = min(len(data) - len(data) % 2, (int(LIVE_MAX_SECONDS * SAMPLE_RATE) - self.samples_written) * 2)
+        self.file.write(data[:usable])
+        self.samples_written += usable // 2
+        self.remainder = b"" if self.full else data[usable:]
+        self.new_audio.set()
+
+    async def close_input(self):
+        if self.ffmpeg is not None:
+            self.ffmpeg.stdin.close()
+            await self.ffmpeg_reader
+            await self.ffmpeg.wait()
+        self.input_closed = True
+        self.new_audio.set()
+
+    def _transcribe_window(self, start: int, end: int) -> list:
+        self.file.flush()
+        samples = np.fromfile(self.path, dtype="<i2", count=end - start, offset=WAV_HEADER_SIZE + start * 2)
+        window_file = f"{tempfile.mktemp()}.wav"
+        try:
+            write_chunk(samples, SAMPLE_RATE, 0, len(samples), window_file)
+            with stage("live_whisper"):
+                result = self.predictor._run_whisper(window_file, self.language, urgent=True)
+        finally:
+            if os.path.exists(window_file):
+                os.remove(window_file)
+
+        offset = start / SAMPLE_RATE
+        return [
+            {
+                **seg,
+                "start": seg["start"] + offset,
+                "end": seg["end"] + offset,
+                "speaker": "",
+                "words": [
+                    {**word, "start": word["start"] + offset, "end": word["end"] + offset}
+                    for word in seg.get("words", [])
+                ],
+            }
+            for seg in result["segments"] if seg["text"].strip()
+        ]
+
+    async def step(self, final: bool = False):
+        """Расшифровывает текущее окно; возвращает (зафиксированные, предварительные) сегменты"""
+        start, end = int(self.committed_until * SAMPLE_RATE), self.samples_written
+        if end - start < MIN_WINDOW_SECONDS * SAMPLE_RATE:
+            return [], []
+
+        segments = await asyncio.to_thread(self._transcribe_window, start, end)
+        window_end = end / SAMPLE_RATE
+        horizon = window_end - LIVE_STABLE_SECONDS
+
+        if final:
+            committed = segments
+        else:
+            committed = [seg for seg in segments if seg["end"] <= horizon]
+            # Окно не должно расти бесконечно при сплошной речи без пауз
+            if not committed and window_end - self.committed_until > LIVE_WINDOW_SECONDS:
+                committed = segments[:-1] or segments
+
+        partial = segments[len(committed):]
+        if committed:
+            self.committed_until = committed[-1]["end"]
+            self.final_segments.extend(committed)
+        elif not segments:
+            self.committed_until = max(self.committed_until, horizon)
+        return committed, partial
+
+    async def run_decoder(self, send):
+        while True:
+            await self.new_audio.wait()
+            self.new_audio.clear()
+            if self.input_closed:
+                return
+            if self.samples_written - self.decoded_until < LIVE_STEP_SECONDS * SAMPLE_RATE:
+                continue
+            self.decoded_until = self.samples_written
+
+            committed, partial = await self.step()
+            if committed:
+                await send({"type": "final", "segments": committed})
+            await send({"type": "partial", "segments": partial})
+
+    def _finalize(self, audio: AudioBuffer):
+        with stage("diarization"):
+            speaker_segments, _ = self.predictor._get_speaker_segments(audio, self.speaker_count)
+        segments = self.predictor._label_segments(
+            self.final_segments, speaker_segments, self.predictor.speaker_assignment
+        )
+        transcript_id = self.predictor._create_transcript(self.email, self.meeting_name, audio.duration)
+        self.predictor._save_segments(transcript_id, segments, self.decrypted_key)
+        logger.info(f"Saved live transcript {transcript_id} for {self.email} ({audio.duration:.0f}s)")
+        return transcript_id, segments
+
+    async def finish(self):
+        """Дорасшифровывает хвост, проводит диаризацию и сохраняет транскрипт"""
+        committed, _ = await self.step(final=True)
+
+        self.file.seek(0)
+        self.file.write(_wav_header(self.samples_written * 2, SAMPLE_RATE))
+        self.file.close()
+        if self.samples_written == 0:
+            raise ValueError("No audio was received")
+
+        samples, _ = open_wav(self.path)
+        audio = AudioBuffer(self.path, samples, SAMPLE_RATE)
+        transcript_id, segments = await asyncio.wrap_future(
+            self.predictor.transcription_queue.add_task(
+                lambda: self._finalize(audio), account=self.email, audio_seconds=audio.duration
+            )
+        )
+        return committed, transcript_id, segments
+
+    def close(self):
+        if not self.file.closed:
+            self.file.close()
+        if self.ffmpeg is not None and self.ffmpeg.returncode is None:
+            self.ffmpeg.kill()
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+async def serve_live(websocket: WebSocket, predictor, email: str, config: dict):
+    """Ведёт сессию после рукопожатия; при обрыве соединения запись всё равно сохраняется"""
+    global active_sessions
+    if active_sessions >= LIVE_MAX_SESSIONS:
+        await websocket.send_json({"type": "error", "detail": "Too many live sessions, try again later"})
+        await websocket.close(code=1013)
+        return
+
+    active_sessions += 1
+    session = LiveSession(
+        predictor, email, config["decrypted_key"], config.get("meeting_name") or "Live meeting",
+        speaker_count=config.get("speaker_count"), language=config.get("language", "ru")
+    )
+    decoder = None
+    connected = True
+    try:
+        if config.get("format", "pcm") == "container":
+            await session.start_decoder()
+        decoder = asyncio.create_task(session.run_decoder(websocket.send_json))
+
+        while True:
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                connected = False
+                break
+            if message.get("bytes"):
+                await session.feed(message["bytes"])
+                # На пределе длительности приём прекращается, а записанное расшифровывается и сохраняется
+                if session.full:
+                    await websocket.send_json({
+                        "type": "warning",
+                        "detail": f"Live session is limited to {LIVE_MAX_SECONDS:.0f} seconds, recording stopped",
+                    })
+                    break
+            elif message.get("text") and json.loads(message["text"]).get("type") == "stop":
+                break
+
+        await session.close_input()
+        try:
+            await decoder
+        except Exception as e:
+            # Ошибка отправки гипотез не должна терять запись
+            logger.warning(f"Live decoder for {email} stopped: {str(e)}")
+
+        committed, transcript_id, segments = await session.finish()
+        if connected:
+            if committed:
+                await websocket.send_json({"type": "final", "segments": committed})
+            await websocket.send_json({
+                "type": "done", "transcript_id": transcript_id, "segments": list(segments.rows())
+            })
+            await websocket.close()
+    except Exception as e:
+        logger.error(f"Live session error for {email}: {str(e)}")
+        if connected:
+            try:
+                await websocket.send_json({"type": "error", "detail": str(e)})
+                await websocket.close(code=1011)
+            except Exception:
+                pass
+    finally:
+        if decoder is not None and not decoder.done():
+            decoder.cancel()
+        session.close()
+        active_sessions -= 1
@@ -1,6 +1,7 @@
+import asyncio
 import base64
-import bcrypt
 import os
+import tempfile
 import uuid
 import jwt
 import logging
@@ -9,22 +10,33 @@ import hashlib
 import hmac
 from datetime import datetime, timedelta
 
-from fastapi.responses import JSONResponse, RedirectResponse
+from fastapi.responses import JSONResponse, RedirectResponse, Response, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi import FastAPI, HTTPException, BackgroundTasks, UploadFile, File, Depends, Body, status, Form
+from fastapi import FastAPI, HTTPException, BackgroundTasks, UploadFile, File, Depends, Body, status, Form, Header, WebSocket
 from fastapi.security import OAuth2PasswordBearer
+from starlette.concurrency import iterate_in_threadpool
 
 from jose import JWTError, jwt
 from typing import List, Optional
-from predict import Predictor, TranscriptionResult
+from predict import Predictor
 from pydantic import BaseModel, EmailStr
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 from dotenv import load_dotenv
 from cryptography.fernet import Fernet
 from sqlalchemy.sql import text
-
-from database import SessionLocal, Account, Email, Transcript 
-from utils import generate_encrypted_key, decrypt_key 
+from sqlalchemy import func, or_, and_, select
+
+from database import SessionLocal, AsyncSessionLocal, Account, Email, Transcript, Job
+from utils import generate_encrypted_key, decrypt_key, hash_password, check_password
+from crypto_pool import CryptoPoolBusy, crypto_pool_from_env
+from jobs import (
+    INFERENCE_MODE, JOB_QUEUED, JOB_RUNNING, broker_queue_plan, count_queued_jobs, create_job, job_status, recover_jobs,
+    run_job,
+)
+from storage import get_blob_store
+from audio import probe_duration
+from live import serve_live
+from metrics import render_metrics, watch_broker_queue
 
 app = FastAPI()
 
@@ -46,10 +58,68 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["Content-Range", "Accept-Ranges"],
 )
 
+crypto_pool = crypto_pool_from_env()
+
+@app.exception_handler(CryptoPoolBusy)
+async def crypto_pool_busy_handler(request, exc: CryptoPoolBusy):
+    return JSONResponse(
+        status_code=429,
+        content={"detail": "Too many authentication requests, try again later"},
+        headers={"Retry-After": "1"},
+    )
+
+# Модели грузятся в фоне после старта, auth и список транскриптов доступны сразу.
+# В режиме broker задачи выполняет worker.py; модели API грузит только для
+# живой расшифровки (LIVE_TRANSCRIPTION=1), иначе /ws/live недоступен
 predictor = Predictor()
-predictor.setup()
+LIVE_TRANSCRIPTION = INFERENCE_MODE == "inline" or os.getenv("LIVE_TRANSCRIPTION", "0") == "1"
+QUEUE_METRICS_INTERVAL_SECONDS = float(os.getenv("QUEUE_METRICS_INTERVAL_SECONDS", "15"))
+
+blob_store = get_blob_store()
+
+recovered_tasks = set()
+metrics_tasks = set()
+
+@app.on_event("startup")
+async def warm_up_models():
+    if LIVE_TRANSCRIPTION:
+        predictor.start_warmup()
+
+@app.on_event("startup")
+async def export_broker_queue():
+    # Очередь брокера - строки jobs, локальная очередь API в этом режиме почти пуста
+    if INFERENCE_MODE != "inline":
+        task = asyncio.create_task(watch_broker_queue(count_queued_jobs, QUEUE_METRICS_INTERVAL_SECONDS))
+        metrics_tasks.add(task)
+
+@app.get("/healthz")
+async def healthz():
+    return {"status": "ok"}
+
+@app.get("/readyz")
+async def readyz():
+    # Процесс без моделей готов сразу; с моделями (inline или живая расшифровка) - после их загрузки
+    if not LIVE_TRANSCRIPTION or predictor.ready:
+        return {"status": "ready"}
+    if predictor.warmup.done():
+        # Ошибку загрузки моделей исправляет только перезапуск процесса
+        return JSONResponse(status_code=503, content={"status": "failed", "error": str(predictor.warmup.exception())})
+    return JSONResponse(status_code=503, content={"status": "loading"})
+
+@app.on_event("startup")
+async def resume_interrupted_jobs():
+    # В режиме broker брошенные задачи возвращают в очередь сами воркеры
+    if INFERENCE_MODE != "inline":
+        return
+    job_ids = await asyncio.to_thread(recover_jobs)
+
+    for job_id in job_ids:
+        task = asyncio.create_task(process_transcription(job_id))
+        recovered_tasks.add(task)
+        task.add_done_callback(recovered_tasks.discard)
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
 
@@ -113,8 +183,8 @@ def verify_secure_token(token: str):
         return None
 
 
-def verify_password(plain_password, hashed_password):
-    return bcrypt.checkpw(plain_password.encode(), hashed_password.encode())
+async def verify_password(plain_password, hashed_password):
+    return await crypto_pool.run(check_password, plain_password, hashed_password)
 
 def send_email(to_email: str, link: str):
     try:
@@ -129,24 +199,33 @@ def send_email(to_email: str, link: str):
     except subprocess.CalledProcessError as e:
         print(f"Error sending email: {e}")
 
-async def process_transcription(file_content: bytes, decrypted_key: bytes, email: str, meetingName: str, speaker_count: int):
+async def process_transcription(job_id: str):
     try:
-        file_string = base64.b64encode(file_content).decode("utf-8")
-
-        result: TranscriptionResult = await predictor.predict(
-            file_string=file_string,
-            num_speakers=speaker_count,
-            translate=False,
-            language='ru',
-            email=email,
-            decrypted_key=decrypted_key,
-            meeting_name=meetingName
-        )
+        await run_job(predictor, job_id)
+        logger.info(f"Transcription job {job_id} finished")
+    except Exception as e:
+        logger.error(f"Ошибка обработки транскрипции для задачи {job_id}: {str(e)}")
 
-        logger.info(f"Transcription completed for {email} in {meetingName} with {speaker_count} speakers")
+UPLOAD_DIR = os.getenv("UPLOAD_DIR", tempfile.gettempdir())
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+MAX_FILE_SIZE = 1000 * 1024 * 1024
 
-    except Exception as e:
-        logger.error(f"Ошибка обработки транскрипции для {email}: {str(e)}")
+async def spool_upload(file: UploadFile) -> str:
+    """Пишет загрузку на диск по частям, не держа файл целиком в памяти"""
+    os.makedirs(UPLOAD_DIR, exist_ok=True)
+    fd, path = tempfile.mkstemp(prefix="upload_", dir=UPLOAD_DIR)
+    file_size = 0
+    try:
+        with os.fdopen(fd, "wb") as f:
+            while chunk := await file.read(UPLOAD_CHUNK_SIZE):
+                file_size += len(chunk)
+                if file_size > MAX_FILE_SIZE:
+                    raise HTTPException(status_code=413, detail="File size too large. Maximum size is 1000MB")
+                f.write(chunk)
+    except BaseException:
+        os.remove(path)
+        raise
+    return path
 
 class RegisterRequest(BaseModel):
     token: str
@@ -159,28 +238,26 @@ class LoginRequest(BaseModel):
 class CheckEmailRequest(BaseModel):
     email: EmailStr
 
-def get_db():
-    db = SessionLocal()
-    try:
-        yield db
-    except Exception as e:
-        logger.error(f"Error connecting to the database: {e}")
-        raise e
-    finally:
-        db.close()
+async def get_db():
+    async with AsyncSessionLocal() as db:
+        try:
+            yield db
+        except Exception as e:
+            logger.error(f"Error connecting to the database: {e}")
+            raise e
 
 @app.get("/validate-token")
 async def validate_token(current_user: str = Depends(get_current_user)):
     return {"message": "Token is valid", "username": current_user}
 
 @app.post("/check")
-async def check_email(request: CheckEmailRequest, db: Session = Depends(get_db)):
+async def check_email(request: CheckEmailRequest, db: AsyncSession = Depends(get_db)):
     logger.info(f"Checking if email {request.email} already exists")
     
-    existing_email = db.query(Email).filter(Email.email == request.email).first()
+    existing_email = (await db.execute(select(Email).where(Email.email == request.email))).scalars().first()
     
     if existing_email:
-        account = db.query(Account).filter(Account.id == existing_email.account_id).first()
+        account = (await db.execute(select(Account).where(Account.id == existing_email.account_id))).scalars().first()
         
         if account:
             logger.info(f"Email {request.email} is already associated with an account, redirecting to /login")
@@ -191,7 +268,7 @@ async def check_email(request: CheckEmailRequest, db: Session = Depends(get_db))
             registration_link = f"https://voiceflow.ru/register?token={secure_token}"
 
             existing_email.token = secure_token
-            db.commit()
+            await db.commit()
             
             send_email(request.email, registration_link)
 
@@ -203,24 +280,24 @@ async def check_email(request: CheckEmailRequest, db: Session = Depends(get_db))
 
     email_record = Email(email=request.email, token=secure_token)
     db.add(email_record)
-    db.commit()
+    await db.commit()
     
     send_email(request.email, registration_link)
 
     return {"message": "Check your email to complete registration"}
 
 @app.post("/register")
-async def register(request: RegisterRequest, db: Session = Depends(get_db)):
+async def register(request: RegisterRequest, db: AsyncSession = Depends(get_db)):
     email = verify_secure_token(request.token)
     if not email:
         raise HTTPException(status_code=400, detail="Invalid or expired token")
 
-    existing_account = db.query(Account).filter(Account.email == email).first()
+    existing_account = (await db.execute(select(Account).where(Account.email == email))).scalars().first()
     if existing_account:
         raise HTTPException(status_code=400, detail="Email already registered")
 
-    hashed_password = bcrypt.hashpw(request.password.encode(), bcrypt.gensalt()).decode()
-    encrypted_key = generate_encrypted_key(request.password)
+    hashed_password = await crypto_pool.run(hash_password, request.password)
+    encrypted_key = await crypto_pool.run(generate_encrypted_key, request.password)
 
     new_account = Account(
         email=email,
@@ -229,17 +306,17 @@ async def register(request: RegisterRequest, db: Session = Depends(get_db)):
         is_admin=True
     )
     db.add(new_account)
-    db.commit()
+    await db.commit()
 
     return {"message": "Succesful"}
 
 @app.post("/login")
-async def login(request: LoginRequest, db: Session = Depends(get_db)):
-    user = db.query(Account).filter(Account.email == request.email).first()
-    if not user or not bcrypt.checkpw(request.password.encode(), user.password_hash.encode()):
+async def login(request: LoginRequest, db: AsyncSession = Depends(get_db)):
+    user = (await db.execute(select(Account).where(Account.email == request.email))).scalars().first()
+    if not user or not await verify_password(request.password, user.password_hash):
         raise HTTPException(status_code=400, detail="Invalid email or password")
     
-    decrypted_key = decrypt_key(request.password, user.encrypted_key) 
+    decrypted_key = await crypto_pool.run(decrypt_key, request.password, user.encrypted_key)
 
     access_token = create_access_token({"sub": request.email})
 
@@ -253,7 +330,7 @@ async def transcribe(
     decrypted_key: str = Form(...),
     meeting_name: str = Form(...),
     speaker_count: int = Form(...),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     try:
         email = token
@@ -261,50 +338,227 @@ async def transcribe(
         if not decrypted_key:
             raise HTTPException(status_code=400, detail="Decrypted key is required")
 
-        MAX_FILE_SIZE = 1000 * 1024 * 1024
-        file_size = 0
-        file_content = bytearray()
+        # Загрузка копируется до первого запроса: сессия берёт соединение из
+        # пула при первом запросе и держит его до commit
+        file_path = await spool_upload(file)
+        try:
+            # Длительность нужна планировщику, чтобы оценить стоимость задачи
+            audio_seconds = await asyncio.to_thread(probe_duration, file_path)
+
+            account = (await db.execute(select(Account).where(Account.email == email))).scalars().first()
+            if not account:
+                raise HTTPException(status_code=404, detail="Account not found")
 
-        while chunk := await file.read(1024 * 1024):
-            file_size += len(chunk)
-            if file_size > MAX_FILE_SIZE:
-                raise HTTPException(status_code=413, detail="File size too large. Maximum size is 1000MB")
-            file_content.extend(chunk)
+            job = await create_job(
+                db, account, file_path, decrypted_key, meeting_name, speaker_count=speaker_count, language='ru',
+                audio_seconds=audio_seconds,
+            )
+        except BaseException:
+            if os.path.exists(file_path):
+                os.remove(file_path)
+            raise
 
-        response = JSONResponse(status_code=202, content={"message": "File accepted for processing"})
+        response = JSONResponse(status_code=202, content={"message": "File accepted for processing", "job_id": job.id})
 
-        background_tasks.add_task(
-            process_transcription, bytes(file_content), decrypted_key, email, meeting_name, speaker_count
-        )
+        if INFERENCE_MODE == "inline":
+            background_tasks.add_task(process_transcription, job.id)
 
         return response
 
+    except HTTPException:
+        raise
     except Exception as e:
         import traceback
         error_details = f"Ошибка обработки файла: {str(e)}\n{traceback.format_exc()}"
         raise HTTPException(status_code=500, detail=error_details)
     
+@app.get("/metrics")
+async def metrics():
+    body, content_type = render_metrics()
+    return Response(content=body, media_type=content_type)
+
+@app.websocket("/ws/live")
+async def live_transcription(websocket: WebSocket, token: str):
+    # Браузер не может передать заголовок Authorization в WebSocket, поэтому токен идёт в query
+    try:
+        email = await get_current_user(token)
+    except HTTPException:
+        await websocket.close(code=1008)
+        return
+
+    await websocket.accept()
+    if not LIVE_TRANSCRIPTION:
+        await websocket.send_json({"type": "error", "detail": "Live transcription is not available on this server"})
+        await websocket.close(code=1013)
+        return
+    if not predictor.ready:
+        await websocket.send_json({"type": "error", "detail": "Models are still loading, try again later"})
+        await websocket.close(code=1013)
+        return
+    if predictor.whisper_pool is None:
+        await websocket.send_json({"type": "error", "detail": "Live transcription requires whisper-server"})
+        await websocket.close(code=1013)
+        return
+
+    config = await websocket.receive_json()
+    if not config.get("decrypted_key"):
+        await websocket.send_json({"type": "error", "detail": "Decrypted key is required"})
+        await websocket.close(code=1008)
+        return
+
+    async with AsyncSessionLocal() as db:
+        account = (await db.execute(select(Account).where(Account.email == email))).scalars().first()
+    if not account:
+        await websocket.send_json({"type": "error", "detail": "Account not found"})
+        await websocket.close(code=1008)
+        return
+
+    await serve_live(websocket, predictor, email, config)
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str, current_user: str = Depends(get_current_user), db: AsyncSession = Depends(get_db)):
+    job = (await db.execute(
+        select(Job)
+        .join(Account, Job.account_id == Account.id)
+        .where(Job.id == job_id, Account.email == current_user)
+    )).scalars().first()
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+
+    return {**job_status(job), **(await queue_estimate(job))}
+
+async def queue_estimate(job: Job) -> dict:
+    """Позиция в очереди и ETA задачи по текущему плану планировщика"""
+    plan = {}
+    if job.status in (JOB_QUEUED, JOB_RUNNING):
+        if INFERENCE_MODE == "inline":
+            if predictor.ready:
+                plan = predictor.transcription_queue.plan()
+        else:
+            plan = await asyncio.to_thread(broker_queue_plan)
+    return plan.get(job.id, {"queue_position": None, "eta_seconds": None})
+
+TRANSCRIPTS_PAGE_SIZE = 50
+TRANSCRIPTS_MAX_PAGE_SIZE = 200
+
+def encode_cursor(created_at: datetime, transcript_id: int) -> str:
+    return base64.urlsafe_b64encode(f"{created_at.isoformat()}|{transcript_id}".encode()).decode()
+
+def decode_cursor(cursor: str):
+    try:
+        created_at, transcript_id = base64.urlsafe_b64decode(cursor.encode()).decode().split("|")
+        return datetime.fromisoformat(created_at), int(transcript_id)
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
 @app.get("/transcripts")
-async def get_transcripts(current_user: str = Depends(get_current_user), db: Session = Depends(get_db)):
+async def get_transcripts(
+    cursor: Optional[str] = None,
+    limit: int = TRANSCRIPTS_PAGE_SIZE,
+    current_user: str = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db)
+):
     email = current_user
     
-    account = db.query(Account).filter(Account.email == email).first()
+    account = (await db.execute(select(Account).where(Account.email == email))).scalars().first()
     if not account:
         raise HTTPException(status_code=404, detail="Account not found")
 
-    transcripts = db.query(Transcript).filter(Transcript.account_id == account.id).all()
+    limit = max(1, min(limit, TRANSCRIPTS_MAX_PAGE_SIZE))
+
+    # Только метаданные: сами зашифрованные данные отдаются по одному через /transcripts/{id}
+    query = select(
+        Transcript.id,
+        Transcript.created_at,
+        Transcript.meeting_name,
+        Transcript.audio_duration,
+        func.coalesce(Transcript.blob_size, func.length(Transcript.encrypted_data)).label("size"),
+    ).where(Transcript.account_id == account.id)
+
+    if cursor:
+        cursor_created_at, cursor_id = decode_cursor(cursor)
+        query = query.where(or_(
+            Transcript.created_at < cursor_created_at,
+            and_(Transcript.created_at == cursor_created_at, Transcript.id < cursor_id),
+        ))
+
+    rows = (await db.execute(
+        query.order_by(Transcript.created_at.desc(), Transcript.id.desc()).limit(limit + 1)
+    )).all()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
 
     response_data = [
         {
-            "encrypted_data": transcript.encrypted_data,
-            "created_at": transcript.created_at,
-            "meeting_name": transcript.meeting_name,
-            "audio_duration": transcript.audio_duration 
+            "id": row.id,
+            "created_at": row.created_at,
+            "meeting_name": row.meeting_name,
+            "audio_duration": row.audio_duration,
+            "size": row.size or 0
         }
-        for transcript in transcripts
+        for row in rows
     ]
 
-    return {"transcripts": response_data}
+    next_cursor = encode_cursor(rows[-1].created_at, rows[-1].id) if has_more else None
+
+    return {"transcripts": response_data, "next_cursor": next_cursor}
+
+def parse_range(range_header: str, size: int):
+    """Разбирает заголовок Range вида bytes=start-end (один диапазон)"""
+    try:
+        unit, spec = range_header.split("=", 1)
+        if unit.strip() != "bytes" or "," in spec:
+            raise ValueError
+        start, end = spec.strip().split("-", 1)
+        if start:
+            start, end = int(start), min(int(end), size - 1) if end else size - 1
+        else:
+            start, end = max(0, size - int(end)), size - 1
+    except ValueError:
+        raise HTTPException(status_code=416, detail="Invalid range", headers={"Content-Range": f"bytes */{size}"})
+
+    if start > end or start >= size:
+        raise HTTPException(status_code=416, detail="Range not satisfiable", headers={"Content-Range": f"bytes */{size}"})
+    return start, end
+
+@app.get("/transcripts/{transcript_id}")
+async def get_transcript(
+    transcript_id: int,
+    range_header: Optional[str] = Header(None, alias="Range"),
+    current_user: str = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db)
+):
+    transcript = (await db.execute(
+        select(Transcript)
+        .join(Account, Transcript.account_id == Account.id)
+        .where(Transcript.id == transcript_id, Account.email == current_user)
+    )).scalars().first()
+    if not transcript:
+        raise HTTPException(status_code=404, detail="Transcript not found")
+
+    # Старые записи хранят base64 в таблице, отдаём их в том же бинарном виде
+    if not transcript.blob_ref:
+        return Response(content=base64.b64decode(transcript.encrypted_data or ""), media_type="application/octet-stream")
+
+    size = transcript.blob_size
+    if size is None:
+        size = await asyncio.to_thread(blob_store.size, transcript.blob_ref)
+    headers = {"Accept-Ranges": "bytes"}
+
+    if range_header:
+        start, end = parse_range(range_header, size)
+        headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+        headers["Content-Length"] = str(end - start + 1)
+        return StreamingResponse(
+            iterate_in_threadpool(blob_store.open_range(transcript.blob_ref, start, end)),
+            status_code=206, media_type="application/octet-stream", headers=headers
+        )
+
+    headers["Content-Length"] = str(size)
+    return StreamingResponse(
+        iterate_in_threadpool(blob_store.open_range(transcript.blob_ref)),
+        media_type="application/octet-stream", headers=headers
+    )
 
 if __name__ == "__main__":
     import uvicorn
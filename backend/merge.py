@@ -0,0 +1,110 @@
+"""Объединение соседних сегментов одного спикера в колоночном представлении.
+
+Сегменты хранятся параллельными массивами (начало, конец, id спикера, текст,
+слова), а не словарём на сегмент. Решение о склейке для всех сегментов
+считается векторно, текст группы собирается одним "".join, поэтому длинный
+монолог больше не копирует растущую строку на каждом сегменте. Predictor
+возвращает саму таблицу, а шифрование читает её строками (rows), без
+промежуточных моделей pydantic.
+
+С параметрами по умолчанию результат совпадает с прежним
+Predictor._merge_segments, включая то, что текст последней группы не
+обрезается справа.
+"""
+from typing import Iterable, Iterator, List
+
+import numpy as np
+
+DEFAULT_MAX_GAP_SECONDS = 1.0
+
+
+class SegmentTable:
+    """Сегменты транскрипта как параллельные массивы"""
+
+    def __init__(self, starts: np.ndarray, ends: np.ndarray, speaker_ids: np.ndarray, speakers: List[str],
+                 texts: List[str], words: List[list]):
+        self.starts = starts
+        self.ends = ends
+        self.speaker_ids = speaker_ids
+        self.speakers = speakers
+        self.texts = texts
+        self.words = words
+
+    @classmethod
+    def from_segments(cls, segments: Iterable[dict]) -> "SegmentTable":
+        segments = list(segments)
+        codes = {}
+        speaker_ids = np.fromiter(
+            (codes.setdefault(seg["speaker"], len(codes)) for seg in segments), dtype=np.int64, count=len(segments)
+        )
+        return cls(
+            np.fromiter((seg["start"] for seg in segments), dtype=np.float64, count=len(segments)),
+            np.fromiter((seg["end"] for seg in segments), dtype=np.float64, count=len(segments)),
+            speaker_ids,
+            list(codes),
+            [seg["text"] for seg in segments],
+            [seg.get("words", []) for seg in segments],
+        )
+
+    def __len__(self):
+        return len(self.texts)
+
+    @property
+    def text(self) -> str:
+        return " ".join(self.texts)
+
+    def rows(self) -> Iterator[dict]:
+        """Сегменты словарями {"text", "start", "end", "speaker", "words"}"""
+        for start, end, speaker_id, text, words in zip(
+            self.starts.tolist(), self.ends.tolist(), self.speaker_ids.tolist(), self.texts, self.words
+        ):
+            yield {"text": text, "start": start, "end": end, "speaker": self.speakers[speaker_id], "words": words}
+
+
+def merge_segments(segments: Iterable[dict], max_gap: float = DEFAULT_MAX_GAP_SECONDS,
+                   max_seconds: float = 0.0) -> SegmentTable:
+    """Склеивает подряд идущие сегменты одного спикера с паузой меньше max_gap.
+
+    max_seconds > 0 ограничивает длительность склеенного сегмента: сегмент,
+    который вывел бы группу за предел, начинает новую.
+    """
+    # Пустые сегменты не участвуют в склейке и не разрывают её
+    table = SegmentTable.from_segments(seg for seg in segments if seg["text"] and not seg["text"].isspace())
+    if not len(table):
+        return table
+    starts, ends, speaker_ids, texts = table.starts, table.ends, table.speaker_ids, table.texts
+
+    joined = np.zeros(len(table), dtype=bool)
+    joined[1:] = (speaker_ids[1:] == speaker_ids[:-1]) & (starts[1:] - ends[:-1] < max_gap)
+    if max_seconds > 0:
+        starts_list, ends_list = starts.tolist(), ends.tolist()
+        group_start = starts_list[0]
+        for i in range(1, len(table)):
+            if joined[i] and ends_list[i] - group_start > max_seconds:
+                joined[i] = False
+            if not joined[i]:
+                group_start = starts_list[i]
+
+    # Часть слова (буква к букве) приклеивается без пробела, остальное - через пробел
+    parts = list(texts)
+    for i in np.flatnonzero(joined).tolist():
+        if not (texts[i - 1][-1].isalpha() and texts[i][0].isalpha()):
+            parts[i] = " " + texts[i].lstrip()
+
+    firsts = np.flatnonzero(~joined)
+    lasts = np.append(firsts[1:] - 1, len(table) - 1)
+    merged_texts, merged_words = [], []
+    for first, last in zip(firsts.tolist(), lasts.tolist()):
+        if first == last:
+            merged_texts.append(texts[first])
+            merged_words.append(table.words[first])
+            continue
+        merged_texts.append(texts[first] + "".join(parts[first + 1:last + 1]))
+        merged_words.append([word for words in table.words[first:last + 1] if words for word in words])
+
+    # Прежний merge обрезал текст группы при её закрытии; последняя группа не закрывалась
+    merged_texts[:-1] = [text.strip() for text in merged_texts[:-1]]
+
+    return SegmentTable(
+        starts[firsts], ends[lasts], speaker_ids[firsts], table.speakers, merged_texts, merged_words
+    )
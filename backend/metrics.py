@@ -0,0 +1,139 @@
+"""Метрики пайплайна для Prometheus и структурированные тайминги этапов в логе.
+
+Каждый этап задачи (ffmpeg, диаризация, whisper, merge, шифрование, запись в БД)
+попадает в гистограмму voiceflow_stage_seconds, а по завершении задачи в лог
+пишется одна JSON-строка со всеми этапами и real-time factor.
+"""
+import asyncio
+import json
+import logging
+import time
+from contextlib import contextmanager
+
+from prometheus_client import CONTENT_TYPE_LATEST, Counter, Gauge, Histogram, generate_latest, start_http_server
+
+logger = logging.getLogger("voiceflow.metrics")
+
+STAGE_BUCKETS = (0.01, 0.05, 0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800, 3600)
+RTF_BUCKETS = (0.02, 0.05, 0.1, 0.2, 0.3, 0.5, 0.75, 1, 1.5, 2, 3, 5)
+
+STAGE_SECONDS = Histogram(
+    "voiceflow_stage_seconds", "Duration of a pipeline stage", ["stage"], buckets=STAGE_BUCKETS
+)
+STAGE_FAILURES = Counter("voiceflow_stage_failures_total", "Pipeline stages that raised", ["stage"])
+JOBS = Counter("voiceflow_jobs_total", "Finished transcription jobs", ["status"])
+JOB_RTF = Histogram(
+    "voiceflow_job_real_time_factor", "Job processing time divided by audio duration", buckets=RTF_BUCKETS
+)
+AUDIO_SECONDS = Counter("voiceflow_audio_seconds_total", "Audio processed by finished jobs")
+RESULT_CACHE = Counter("voiceflow_result_cache_total", "Result cache lookups", ["result"])
+MODEL_LOAD_SECONDS = Gauge("voiceflow_model_load_seconds", "Time of the last model load", ["model"])
+QUEUE_DEPTH = Gauge("voiceflow_queue_depth", "Tasks waiting for a transcription worker")
+ACTIVE_WORKERS = Gauge("voiceflow_active_workers", "Transcription workers busy with a task")
+
+
+@contextmanager
+def stage(name: str):
+    """Замеряет этап вне задачи (например, в live-сессии)"""
+    started = time.perf_counter()
+    try:
+        yield
+    except BaseException:
+        STAGE_FAILURES.labels(name).inc()
+        raise
+    finally:
+        STAGE_SECONDS.labels(name).observe(time.perf_counter() - started)
+
+
+def record_model_load(model: str, seconds: float):
+    MODEL_LOAD_SECONDS.labels(model).set(seconds)
+    logger.info(json.dumps({"event": "model_load", "model": model, "seconds": round(seconds, 3)}))
+
+
+@contextmanager
+def model_load(model: str):
+    started = time.perf_counter()
+    yield
+    record_model_load(model, time.perf_counter() - started)
+
+
+class JobTimer:
+    """Собирает тайминги этапов одной задачи.
+
+    Этапы могут идти параллельно в разных потоках (диаризация и whisper),
+    поэтому сумма этапов может превышать общее время задачи.
+    """
+
+    def __init__(self, job_id: str = None):
+        self.job_id = job_id
+        self.started = time.perf_counter()
+        self.stages = {}
+        self.audio_seconds = None
+
+    @contextmanager
+    def stage(self, name: str):
+        started = time.perf_counter()
+        try:
+            yield
+        except BaseException:
+            STAGE_FAILURES.labels(name).inc()
+            raise
+        finally:
+            self.record(name, time.perf_counter() - started)
+
+    def record(self, name: str, seconds: float):
+        STAGE_SECONDS.labels(name).observe(seconds)
+        self.stages[name] = self.stages.get(name, 0.0) + seconds
+
+    def finish(self, status: str):
+        wall = time.perf_counter() - self.started
+        JOBS.labels(status).inc()
+
+        record = {
+            "event": "job",
+            "job_id": self.job_id,
+            "status": status,
+            "wall_seconds": round(wall, 3),
+            "stages": {name: round(seconds, 3) for name, seconds in self.stages.items()},
+        }
+        if self.audio_seconds:
+            record["audio_seconds"] = round(self.audio_seconds, 3)
+            record["rtf"] = round(wall / self.audio_seconds, 4)
+            if status == "done":
+                AUDIO_SECONDS.inc(self.audio_seconds)
+                JOB_RTF.observe(wall / self.audio_seconds)
+        logger.info(json.dumps(record))
+
+
+# Источники глубины очереди процесса: локальная TranscriptionQueue и, в API
+# в режиме broker, строки jobs со статусом queued
+_queue_sources = {}
+QUEUE_DEPTH.set_function(lambda: sum(source() for source in list(_queue_sources.values())))
+
+
+def watch_queue(queue):
+    """Глубина очереди и занятые воркеры считываются в момент запроса /metrics"""
+    _queue_sources["local"] = lambda: queue.pending
+    ACTIVE_WORKERS.set_function(lambda: queue.current_tasks)
+
+
+async def watch_broker_queue(count_queued, interval: float):
+    """Периодически считает задачи брокера в очереди; /metrics не ходит в БД сам"""
+    depth = 0
+    _queue_sources["broker"] = lambda: depth
+    while True:
+        try:
+            depth = await asyncio.to_thread(count_queued)
+        except Exception as e:
+            logger.warning(f"Failed to count queued jobs: {str(e)}")
+        await asyncio.sleep(interval)
+
+
+def render_metrics():
+    return generate_latest(), CONTENT_TYPE_LATEST
+
+
+def serve_metrics(port: int):
+    """Отдельный HTTP-сервер метрик для процессов без FastAPI (воркер)"""
+    if port > 0:
+        start_http_server(port)
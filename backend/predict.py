@@ -4,24 +4,28 @@ import os
 import base64
 import asyncio
 import datetime
-from typing import Optional, List
-from pydantic import BaseModel
 import tempfile
-import torch
-import torchaudio
-from pyannote.audio import Pipeline
-from queue import Queue
-from threading import Thread, Lock
 import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from threading import Lock, Thread
 from dotenv import load_dotenv
 import logging
-from cryptography.fernet import Fernet
-from sqlalchemy.orm import Session
-from database import SessionLocal, Account, Email, Transcript 
+from database import SessionLocal, Account, Transcript
+from scheduler import TranscriptionQueue
+from jobs import update_job
+from alignment import SpeakerIndex, ASSIGNMENT_MODES, split_by_speaker, words_from_tokens
+from chunking import plan_chunks, write_chunk, stitch_chunks
+from audio import AudioBuffer, decode_audio
+from cache import ResultCache
+from storage import get_blob_store
+from servers import WhisperServer, WhisperServerPool, LlamaServer
+from summarizer import TranscriptSummarizer
+from diarization import WindowedDiarizer
+from diarization_runtime import DiarizationRuntime
+from merge import DEFAULT_MAX_GAP_SECONDS, SegmentTable, merge_segments
+from transcript_crypto import encrypt_segments
+from metrics import JobTimer, RESULT_CACHE, model_load, watch_queue
 
-from Crypto.Cipher import AES
-from Crypto.Util.Padding import pad
-import hashlib
 
 load_dotenv()
 
@@ -34,52 +38,54 @@ logging.basicConfig(
     ]
 )
 
-class TranscriptionSegment(BaseModel):
-    text: str
-    start: float
-    end: float
-    speaker: str
-    words: Optional[List[dict]] = None
-
-class TranscriptionResult(BaseModel):
-    segments: List[TranscriptionSegment]
-    language: str
-    num_speakers: int
-    text: str
-    translation: Optional[str] = None
-    summary: Optional[str] = None
-
-class TranscriptionQueue:
-    def __init__(self, max_concurrent=2):
-        self.queue = Queue()
-        self.max_concurrent = max_concurrent
-        self.current_tasks = 0
-        self.lock = Lock()
-        self.worker = Thread(target=self._process_queue, daemon=True)
-        self.worker.start()
-
-    def add_task(self, task):
-        return self.queue.put(task)
-
-    def _process_queue(self):
-        while True:
-            task = self.queue.get()
-            with self.lock:
-                while self.current_tasks >= self.max_concurrent:
-                    time.sleep(1)
-                self.current_tasks += 1
-            
-            try:
-                task()
-            finally:
-                with self.lock:
-                    self.current_tasks -= 1
-                self.queue.task_done()
+DIARIZATION_MODEL = "pyannote/speaker-diarization-3.1"
 
 class Predictor:
+    """Модели грузятся в фоне (start_warmup), чтобы API отвечал сразу после старта.
+
+    torch и pyannote импортируются только при загрузке моделей.
+    """
+
+    def __init__(self):
+        self.warmup = Future()
+        self.warmup_lock = Lock()
+        self.warmup_thread = None
+        self.merge_max_gap = DEFAULT_MAX_GAP_SECONDS
+        self.merge_max_seconds = 0.0
+
+    def start_warmup(self):
+        with self.warmup_lock:
+            if self.warmup_thread is not None or self.warmup.done():
+                return
+            # Future в состоянии running нельзя отменить из ожидающих его корутин
+            self.warmup.set_running_or_notify_cancel()
+            self.warmup_thread = Thread(target=self._warmup, name="model-warmup", daemon=True)
+            self.warmup_thread.start()
+
+    def _warmup(self):
+        started = time.perf_counter()
+        try:
+            self.setup()
+        except BaseException as e:
+            logging.error(f"Model warm-up failed: {str(e)}")
+            self.warmup.set_exception(e)
+            return
+        logging.info(f"Models are ready in {time.perf_counter() - started:.1f}s")
+        self.warmup.set_result(None)
+
+    @property
+    def ready(self) -> bool:
+        return self.warmup.done() and self.warmup.exception() is None
+
+    async def wait_ready(self):
+        self.start_warmup()
+        await asyncio.wrap_future(self.warmup)
+
     def setup(self):
+        from pyannote.audio import Pipeline
+
         logging.info("Loading summarization model...")
-        self.llama_path = "./llama.cpp/main"
+        self.llama_path = os.getenv("LLAMA_SERVER", "./llama.cpp/server")
         self.llama_model_path = "./llama.cpp/models/llama-2-7b-chat.gguf"
 
         if not os.path.exists(self.llama_model_path):
@@ -90,34 +96,92 @@ class Predictor:
             "hr_interview": "Проанализируй это интервью и выдели основные компетенции кандидата, его сильные и слабые стороны:"
         }
 
+        # Сервер поднимается при первой суммаризации и дальше держит модель в памяти
+        llama_context = int(os.getenv("LLAMA_CONTEXT", "4096"))
+        llama_parallel = int(os.getenv("LLAMA_PARALLEL", "2"))
+        self.summarizer = TranscriptSummarizer(
+            LlamaServer(
+                self.llama_path, self.llama_model_path,
+                port=int(os.getenv("LLAMA_SERVER_PORT", "8190")),
+                context_tokens=llama_context,
+                parallel=llama_parallel,
+                threads=int(os.getenv("LLAMA_THREADS", "8")),
+            ),
+            self.PROMPTS,
+            context_tokens=llama_context,
+            max_new_tokens=int(os.getenv("LLAMA_MAX_NEW_TOKENS", "512")),
+            parallel=llama_parallel,
+        )
+
         logging.info("Setting up Predictor...")
         self.model_path = "./whisper.cpp/models/ggml-large-v3-turbo.bin"
         if not os.path.exists(self.model_path):
             logging.info("Model not found, downloading...")
             self._download_model("large-v3-turbo")
 
+        self.whisper_cli_path = os.getenv("WHISPER_CLI", "./whisper.cpp/build-cuda/bin/whisper-cli")
+        self.whisper_pool = None
+        whisper_server_path = os.getenv("WHISPER_SERVER", "./whisper.cpp/build-cuda/bin/whisper-server")
+        if whisper_server_path and os.path.exists(whisper_server_path):
+            # Модель загружается один раз и остаётся в памяти сервера между задачами
+            base_port = int(os.getenv("WHISPER_SERVER_PORT", "8178"))
+            # На CPU-узлах WHISPER_THREADS ограничивает whisper, чтобы ядра остались диаризации
+            whisper_threads = int(os.getenv("WHISPER_THREADS", "0")) or None
+            # WHISPER_LIVE_SERVERS серверов сверх WHISPER_SERVERS отданы живой расшифровке
+            live_servers = int(os.getenv("WHISPER_LIVE_SERVERS", "1"))
+            self.whisper_pool = WhisperServerPool([
+                WhisperServer(whisper_server_path, self.model_path, port=base_port + i, threads=whisper_threads)
+                for i in range(int(os.getenv("WHISPER_SERVERS", "1")) + live_servers)
+            ], reserved=live_servers)
+            self.whisper_pool.start()
+        else:
+            logging.info("whisper-server not found, falling back to whisper-cli per job")
+
         hf_token = os.getenv("HF_TOKEN")
         if not hf_token:
             raise RuntimeError("Hugging Face auth token is missing")
         
         logging.info("Initializing speaker diarization pipeline...")
-        self.diarization_pipeline = Pipeline.from_pretrained(
-            "pyannote/speaker-diarization-3.1",
-            use_auth_token=hf_token
-        ).to(torch.device("cuda" if torch.cuda.is_available() else "cpu"))
-
-        self.transcription_queue = TranscriptionQueue(max_concurrent=3)
-
-    def _encrypt_aes(self, data: str, key: str) -> str:
-        key_bytes = hashlib.sha256(key.encode()).digest()
-
-        iv = os.urandom(16)
-
-        cipher = AES.new(key_bytes, AES.MODE_CBC, iv)
-        ciphertext = cipher.encrypt(pad(data.encode(), AES.block_size))
-
-        result = base64.b64encode(iv + ciphertext).decode()
-        return result
+        max_concurrent = int(os.getenv("TRANSCRIPTION_WORKERS", "3"))
+        self.diarization_runtime = DiarizationRuntime.from_env(default_slots=max_concurrent)
+        with model_load("diarization"):
+            self.diarization_pipeline = self.diarization_runtime.prepare(Pipeline.from_pretrained(
+                DIARIZATION_MODEL,
+                use_auth_token=hf_token
+            ))
+
+        self.diarization_window_seconds = float(os.getenv("DIARIZATION_WINDOW_SECONDS", "900"))
+        self.diarizer = WindowedDiarizer(
+            self.diarization_pipeline,
+            window_seconds=self.diarization_window_seconds,
+            threshold=float(os.getenv("DIARIZATION_CLUSTER_THRESHOLD", "0.7")),
+        )
+
+        # midpoint - спикер по середине сегмента, max_overlap - по наибольшему пересечению
+        self.speaker_assignment = os.getenv("SPEAKER_ASSIGNMENT", "midpoint")
+        # Реплики одного спикера склеиваются при паузе меньше MERGE_MAX_GAP_SECONDS; 0 - без ограничения длины
+        self.merge_max_gap = float(os.getenv("MERGE_MAX_GAP_SECONDS", str(DEFAULT_MAX_GAP_SECONDS)))
+        self.merge_max_seconds = float(os.getenv("MERGE_MAX_SEGMENT_SECONDS", "0"))
+
+        # Повторно загруженная запись с теми же параметрами не проходит диаризацию и whisper заново
+        cache_max_bytes = int(os.getenv("RESULT_CACHE_MAX_BYTES", str(2 * 1024 ** 3)))
+        self.result_cache = None
+        if cache_max_bytes > 0:
+            self.result_cache = ResultCache(os.getenv("RESULT_CACHE_DIR", "./cache/results"), cache_max_bytes)
+
+        self.blob_store = get_blob_store()
+
+        self.transcription_queue = TranscriptionQueue(max_concurrent=max_concurrent)
+        watch_queue(self.transcription_queue)
+        # Whisper работает в отдельном процессе или сервере, поток лишь ждёт ответа
+        self.whisper_executor = ThreadPoolExecutor(max_workers=max_concurrent, thread_name_prefix="whisper")
+
+        # Длинные записи режутся на чанки, которые распознаются общим пулом процессов whisper
+        self.chunk_seconds = float(os.getenv("WHISPER_CHUNK_SECONDS", "0"))
+        self.chunk_overlap_seconds = float(os.getenv("WHISPER_CHUNK_OVERLAP_SECONDS", "1.0"))
+        self.chunk_executor = ThreadPoolExecutor(
+            max_workers=int(os.getenv("WHISPER_PARALLEL", "2")), thread_name_prefix="whisper-chunk"
+        )
 
     def _download_model(self, model_name):
         logging.info(f"Downloading model: {model_name}")
@@ -125,52 +189,80 @@ class Predictor:
             "bash", "./whisper.cpp/models/download-ggml-model.sh", model_name
         ], check=True)
 
-    def _convert_to_wav(self, input_file: str) -> str:
-        output_file = f"{tempfile.mktemp()}.wav"
-        logging.info(f"Converting {input_file} to WAV: {output_file}")
-        try:
-            subprocess.run([
-                "ffmpeg", "-i", input_file, "-ar", "16000", "-ac", "1", "-c:a", "pcm_s16le", output_file
-            ], check=True, capture_output=True)
-            return output_file
-        except subprocess.CalledProcessError as e:
-            logging.error(f"FFmpeg error: {e.stderr.decode()}")
-            raise RuntimeError(f"FFmpeg error: {e.stderr.decode()}")
-        finally:
-            if os.path.exists(input_file):
-                os.remove(input_file)
-                logging.info(f"Removed input file: {input_file}")
-
-
-    def _get_speaker_segments(self, audio_path, num_speakers):
-        logging.info(f"Running speaker diarization on {audio_path}")
+    def _get_speaker_segments(self, audio: AudioBuffer, num_speakers):
+        logging.info(f"Running speaker diarization on {audio.path}")
         try:
-            waveform, sample_rate = torchaudio.load(audio_path)
-            with torch.cuda.device('cuda' if torch.cuda.is_available() else 'cpu'):
-                diarization = self.diarization_pipeline(
-                    {"waveform": waveform, "sample_rate": sample_rate}, num_speakers=num_speakers
-                )
-            speaker_segments = [
-                {"start": turn.start, "end": turn.end, "speaker": speaker}
-                for turn, _, speaker in diarization.itertracks(yield_label=True)
-            ]
-            logging.info(f"Detected {len(set(s['speaker'] for s in speaker_segments))} speakers")
-
-            del diarization
-            torch.cuda.empty_cache()
-
-            return speaker_segments, len(set(s['speaker'] for s in speaker_segments))
+            # На CPU вызов ждёт свободный слот с закреплёнными потоками
+            return self.diarization_runtime.run(self._diarize, audio, num_speakers)
         except Exception as e:
             logging.error(f"Diarization error: {str(e)}")
             raise RuntimeError(f"Diarization error: {str(e)}")
 
-    def _process_audio(self, wav_file: str, language: str = "ru", translate: bool = False) -> dict:
+    def _diarize(self, audio: AudioBuffer, num_speakers):
+        import torch
+
+        # Длинные записи идут окнами из memmap, чтобы память не росла с длительностью
+        if self.diarization_window_seconds > 0 and audio.duration > self.diarization_window_seconds * 1.5:
+            return self.diarizer(audio, num_speakers)
+
+        waveform = torch.from_numpy(audio.waveform()).unsqueeze(0)
+        diarization = self.diarization_pipeline(
+            {"waveform": waveform, "sample_rate": audio.sample_rate}, num_speakers=num_speakers
+        )
+        speaker_segments = [
+            {"start": turn.start, "end": turn.end, "speaker": speaker}
+            for turn, _, speaker in diarization.itertracks(yield_label=True)
+        ]
+        detected_speakers = len(set(s['speaker'] for s in speaker_segments))
+        logging.info(f"Detected {detected_speakers} speakers")
+        return speaker_segments, detected_speakers
+
+    def _process_audio(self, audio: AudioBuffer, language: str = "ru", translate: bool = False) -> dict:
+        if self.chunk_seconds > 0 and audio.duration > self.chunk_seconds * 1.5:
+            return self._process_audio_chunked(audio, language, translate)
+        return self._run_whisper(audio.path, language, translate)
+
+    def _process_audio_chunked(self, audio: AudioBuffer, language: str, translate: bool) -> dict:
+        """Режет длинную запись по паузам и распознаёт чанки параллельно"""
+        samples, sample_rate = audio.samples, audio.sample_rate
+        chunks = plan_chunks(samples, sample_rate, self.chunk_seconds, self.chunk_overlap_seconds)
+        logging.info(f"Processing {audio.path} in {len(chunks)} chunks of ~{self.chunk_seconds:.0f}s")
+
+        chunk_files = []
+        try:
+            futures = []
+            for chunk in chunks:
+                chunk_file = f"{tempfile.mktemp()}.wav"
+                chunk_files.append(chunk_file)
+                write_chunk(samples, sample_rate, chunk["start"], chunk["end"], chunk_file)
+                futures.append(self.chunk_executor.submit(self._run_whisper, chunk_file, language, translate))
+
+            results = [future.result() for future in futures]
+        finally:
+            for future in futures:
+                future.cancel()
+            for chunk_file in chunk_files:
+                if os.path.exists(chunk_file):
+                    os.remove(chunk_file)
+
+        return {
+            "segments": stitch_chunks(list(zip(chunks, results)), sample_rate),
+            "language": results[0]["language"] if results else "auto"
+        }
+
+    def _run_whisper(self, wav_file: str, language: str = "ru", translate: bool = False, urgent: bool = False) -> dict:
+        if self.whisper_pool is not None:
+            logging.info(f"Processing audio with whisper-server: {wav_file}")
+            return self.whisper_pool.transcribe(wav_file, language, translate, urgent=urgent)
+        return self._run_whisper_cli(wav_file, language, translate)
+
+    def _run_whisper_cli(self, wav_file: str, language: str = "ru", translate: bool = False) -> dict:
         logging.info(f"Processing audio with Whisper: {wav_file}")
         output_json = tempfile.mktemp(suffix=".json")
         command = [
-            "./whisper.cpp/build-cuda/bin/whisper-cli",
+            self.whisper_cli_path,
             "-m", self.model_path, "-f", wav_file,
-            "--output-json", "--print-progress"
+            "--output-json-full", "--print-progress"
         ]
         if language:
             command.extend(["--language", language])
@@ -188,7 +280,7 @@ class Predictor:
             with open(output_json, 'r') as f:
                 result = json.load(f)
                 
-            logging.info(f"Whisper result: {result}")
+            logging.debug(f"Whisper result: {result}")
             
             # Преобразуем формат вывода в нужную структуру
             if "transcription" in result:
@@ -198,11 +290,22 @@ class Predictor:
                     start = trans["offsets"]["from"] / 1000.0
                     end = trans["offsets"]["to"] / 1000.0
                     
+                    # В полном JSON у каждого токена есть время в миллисекундах
+                    words = words_from_tokens([
+                        {
+                            "text": token["text"],
+                            "start": token["offsets"]["from"] / 1000.0,
+                            "end": token["offsets"]["to"] / 1000.0,
+                            "p": token.get("p", 1.0),
+                        }
+                        for token in trans.get("tokens", [])
+                    ])
+
                     segments.append({
                         "text": trans["text"].strip(),
                         "start": start,
                         "end": end,
-                        "words": []  # если нужно, можно добавить обработку слов
+                        "words": words
                     })
                 
                 return {
@@ -217,205 +320,223 @@ class Predictor:
             if os.path.exists(output_json):
                 os.remove(output_json)
 
-    def _merge_segments(self, segments):
+    def _merge_segments(self, segments) -> SegmentTable:
         """Объединяет сегменты в осмысленные группы по спикерам"""
-        merged = []
-        current = None
-        
-        for seg in segments:
-            # Пропускаем пустые сегменты
-            if not seg["text"] or seg["text"].isspace():
-                continue
-
-            if not current:
-                current = {
-                    "text": seg["text"],
-                    "start": seg["start"],
-                    "end": seg["end"],
-                    "speaker": seg["speaker"],
-                    "words": seg.get("words", [])
-                }
-                continue
-
-            # Если тот же спикер и промежуток между сегментами меньше 1 секунды
-            if (seg["speaker"] == current["speaker"] and 
-                (seg["start"] - current["end"]) < 1.0):
-                
-                # Проверяем, что текущий текст не пустой
-                if current["text"] and seg["text"]:
-                    # Убираем пробел в начале, если это часть слова
-                    if (len(current["text"]) > 0 and 
-                        len(seg["text"]) > 0 and 
-                        current["text"][-1].isalpha() and 
-                        seg["text"][0].isalpha()):
-                        current["text"] += seg["text"]
-                    else:
-                        current["text"] += " " + seg["text"].lstrip()
-                else:
-                    # Если один из текстов пустой, просто используем непустой
-                    current["text"] = current["text"] or seg["text"]
-                
-                current["end"] = seg["end"]
-                if seg.get("words"):
-                    current["words"].extend(seg["words"])
-            else:
-                # Очищаем текст от лишних пробелов и знаков препинания
-                current["text"] = current["text"].strip()
-                if current["text"] and not current["text"].isspace():
-                    merged.append(current)
-                current = {
-                    "text": seg["text"],
-                    "start": seg["start"],
-                    "end": seg["end"],
-                    "speaker": seg["speaker"],
-                    "words": seg.get("words", [])
-                }
-
-        # Добавляем последний сегмент, если он существует и не пустой
-        if current and current["text"] and current["text"].strip() and not current["text"].isspace():
-            merged.append(current)
-
-        return merged
-    
-    def _generate_summary(self, text: str, prompt_type: str = "summary") -> str:
-        """Generate summary using llama.cpp"""
+        return merge_segments(
+            segments,
+            max_gap=self.merge_max_gap,
+            max_seconds=self.merge_max_seconds,
+        )
+
+    def _generate_summary(self, segments, prompt_type: str = "summary") -> str:
+        """Generate summary using the resident llama.cpp server"""
         logging.info(f"Generating {prompt_type}...")
         
         if prompt_type not in self.PROMPTS:
             raise ValueError(f"Invalid prompt type. Must be one of: {list(self.PROMPTS.keys())}")
         
         try:
-            prompt = f"{self.PROMPTS[prompt_type]}\n\nТекст: {text}\n\nОтвет:"
-            
-            command = [
-                self.llama_path,
-                "-m", self.llama_model_path,
-                "-propmt", prompt,
-                "-n", "512",  # максимальное количество токенов
-                "--temp", "0.7",
-                "--repeat_penalty", "1.1",
-                "-t", "8",  # количество потоков
-                "--top_p", "0.9",
-                "-c", "2048"  # размер контекста
-            ]
-
-            try:
-                result = subprocess.run(
-                    command,
-                    capture_output=True,
-                    text=True,
-                    check=True
-                )
-                
-                # Извлекаем сгенерированный текст
-                output = result.stdout
-                summary = output.split("Ответ:")[1].strip()
-                
-                logging.info(f"Generated {prompt_type}: {summary}")
-                return summary
-
-            except subprocess.CalledProcessError as e:
-                logging.error(f"Llama.cpp error: {e.stderr}")
-                raise RuntimeError(f"Llama.cpp error: {e.stderr}")
-                
+            summary = self.summarizer.summarize(segments, prompt_type)
+            logging.info(f"Generated {prompt_type} ({len(summary)} chars)")
+            return summary
         except Exception as e:
             logging.error(f"Summary generation error: {str(e)}")
             raise RuntimeError(f"Summary generation error: {str(e)}")
 
-    async def predict(self, file_string: str, num_speakers: int = None, translate: bool = False, 
+    def _analyze(self, audio: AudioBuffer, num_speakers, language, translate, email, report, timer: JobTimer):
+        """Диаризация и распознавание, с повторным использованием результата для той же записи"""
+        cache_key = None
+        if self.result_cache is not None:
+            cache_key = self.result_cache.key_for(audio, {
+                "num_speakers": num_speakers,
+                "language": language,
+                "translate": translate,
+                "whisper_model": os.path.basename(self.model_path),
+                "diarization_model": DIARIZATION_MODEL,
+                "chunk_seconds": self.chunk_seconds,
+                "diarization_window_seconds": self.diarization_window_seconds,
+                "diarization_quantize": self.diarization_runtime.quantize,
+                "word_timestamps": True,
+            })
+            with timer.stage("cache_lookup"):
+                cached = self.result_cache.get(*cache_key)
+            RESULT_CACHE.labels("hit" if cached is not None else "miss").inc()
+            if cached is not None:
+                logging.info(f"Result cache hit for {email}, skipping diarization and whisper")
+                return cached["speaker_segments"], cached["num_speakers"], cached["whisper"]
+
+        # Диаризация и whisper независимы: whisper-cli работает в фоне, пока pyannote считает в этом потоке
+        def run_whisper():
+            with timer.stage("whisper"):
+                return self._process_audio(audio, language, translate)
+
+        whisper_future = self.whisper_executor.submit(run_whisper)
+        try:
+            with timer.stage("diarization"):
+                speaker_segments, detected_speakers = self._get_speaker_segments(audio, num_speakers)
+            report(progress=0.5)
+            result = whisper_future.result()
+        except Exception:
+            whisper_future.cancel()
+            raise
+
+        if cache_key is not None:
+            self.result_cache.put(*cache_key, {
+                "speaker_segments": speaker_segments,
+                "num_speakers": detected_speakers,
+                "whisper": result,
+            })
+        return speaker_segments, detected_speakers, result
+
+    def _create_transcript(self, email: str, meeting_name: str, audio_length: float, transcript_id: int = None) -> int:
+        """Создаёт запись транскрипта в короткой сессии и возвращает её id"""
+        with SessionLocal() as db:
+            account = db.query(Account).filter(Account.email == email).first()
+            if not account:
+                raise ValueError("Аккаунт с таким email не найден")
+
+            # Повторный запуск задачи после рестарта переиспользует уже созданную запись
+            if transcript_id is not None:
+                transcript = db.query(Transcript).filter(Transcript.id == transcript_id).first()
+                if transcript is not None:
+                    return transcript.id
+
+            transcript = Transcript(
+                encrypted_data='',
+                account=account,
+                meeting_name=meeting_name,
+                created_at=datetime.datetime.utcnow().replace(second=0, microsecond=0),
+                audio_duration=audio_length
+            )
+            db.add(transcript)
+            db.commit()
+            db.refresh(transcript)
+            return transcript.id
+
+    def _label_segments(self, whisper_segments, speaker_segments, speaker_assignment: str,
+                        timer: JobTimer = None) -> SegmentTable:
+        """Назначает спикеров сегментам whisper и объединяет соседние реплики"""
+        with (timer or JobTimer()).stage("merge"):
+            return self._assign_and_merge(whisper_segments, speaker_segments, speaker_assignment)
+
+    def _assign_and_merge(self, whisper_segments, speaker_segments, speaker_assignment: str) -> SegmentTable:
+        speaker_index = SpeakerIndex(speaker_segments)
+        # Сегмент, на котором сменился спикер, режется по словам
+        raw_segments = [
+            {
+                "text": (seg["text"].strip() + " "),
+                "start": seg["start"],
+                "end": seg["end"],
+                "speaker": seg["speaker"],
+                "words": seg.get("words") or []
+            }
+            for seg in split_by_speaker(whisper_segments, speaker_index, speaker_assignment)
+        ]
+
+        return self._merge_segments(raw_segments)
+
+    def _save_segments(self, transcript_id: int, segments: SegmentTable, decrypted_key: str,
+                       timer: JobTimer = None):
+        timer = timer or JobTimer()
+        # Сегменты шифруются по одному прямо в хранилище, без общего JSON в памяти
+        with timer.stage("encrypt"):
+            blob_ref, blob_size = self.blob_store.put(
+                encrypt_segments(segments.rows(), decrypted_key)
+            )
+        with timer.stage("db_write"):
+            self._store_transcript(transcript_id, blob_ref, blob_size)
+
+    def _store_transcript(self, transcript_id: int, blob_ref: str, blob_size: int):
+        with SessionLocal() as db:
+            db.query(Transcript).filter(Transcript.id == transcript_id).update(
+                {"blob_ref": blob_ref, "blob_size": blob_size}
+            )
+            db.commit()
+
+    async def predict(self, file_string: str = None, num_speakers: int = None, translate: bool = False, 
                     language: str = "ru", group_segments: bool = False, 
-                    prompt_type: str = "summary", email: str = None, decrypted_key: str = None, meeting_name: str = None) -> TranscriptionResult:
-        
-        db: Session = SessionLocal()
+                    prompt_type: str = "summary", email: str = None, decrypted_key: str = None, meeting_name: str = None,
+                    file_path: str = None, job_id: str = None, transcript_id: int = None,
+                    speaker_assignment: str = None) -> dict:
+        """Расшифровывает запись и сохраняет транскрипт.
+
+        Возвращает {"segments": SegmentTable, "language", "num_speakers", "text"};
+        сегменты остаются колоночными, словари строк даёт SegmentTable.rows().
+        """
+
+        if file_path is None and file_string is None:
+            raise ValueError("Either file_path or file_string must be provided")
+
+        await self.wait_ready()
+
+        speaker_assignment = speaker_assignment or self.speaker_assignment
+        if speaker_assignment not in ASSIGNMENT_MODES:
+            raise ValueError(f"Invalid speaker assignment mode. Must be one of: {list(ASSIGNMENT_MODES)}")
 
-        temp_input = tempfile.mktemp()
-        wav_file = None
+        def report(**fields):
+            if job_id:
+                update_job(job_id, **fields)
+
+        timer = JobTimer(job_id)
+        status = "failed"
+
+        # file_path - файл, уже записанный на диск при загрузке; base64 поддерживается для совместимости
+        temp_input = file_path or tempfile.mktemp()
+        audio = None
         try:
-            logging.info(f"Decoding input file for user {email}...")
-            with open(temp_input, "wb") as f:
-                f.write(base64.b64decode(file_string))
-            wav_file = self._convert_to_wav(temp_input)
-            future_result = {}
+            if file_path is None:
+                logging.info(f"Decoding input file for user {email}...")
+                with timer.stage("decode"), open(temp_input, "wb") as f:
+                    f.write(base64.b64decode(file_string))
+            await asyncio.to_thread(report, stage="converting", progress=0.05)
+            with timer.stage("ffmpeg"):
+                audio = await asyncio.to_thread(decode_audio, temp_input)
+            timer.audio_seconds = audio.duration
+            enqueued = time.perf_counter()
 
             def process_task():
                 try:
+                    timer.record("queue_wait", time.perf_counter() - enqueued)
                     logging.info(f"Processing audio for {email} with key {decrypted_key[:6]}***")
                     
-                    account = db.query(Account).filter(Account.email == email).first()
-                    if not account:
-                        raise ValueError("Аккаунт с таким email не найден")
-                    
-                    audio_info = torchaudio.info(wav_file)
-                    audio_length = audio_info.num_frames / audio_info.sample_rate
-                    creation_time = datetime.datetime.utcnow().replace(second=0, microsecond=0)
-                    
-                    transcript = Transcript(
-                        encrypted_data='',
-                        account=account,
-                        meeting_name=meeting_name,
-                        created_at=creation_time,
-                        audio_duration=audio_length
-                    )
-                    db.add(transcript)
-                    db.commit()
-                    db.refresh(transcript)
+                    with timer.stage("db_write"):
+                        stored_transcript_id = self._create_transcript(email, meeting_name, audio.duration, transcript_id)
+                    report(transcript_id=stored_transcript_id, stage="diarization_transcription", progress=0.1)
 
-                    speaker_segments, detected_speakers = self._get_speaker_segments(wav_file, num_speakers)
-                    result = self._process_audio(wav_file, language, translate)
-                    
-                    raw_segments = [
-                        {
-                            "text": (seg["text"].strip() + " "),
-                            "start": seg["start"],
-                            "end": seg["end"],
-                            "speaker": next((s["speaker"] for s in speaker_segments if s["start"] <= (seg["start"] + seg["end"]) / 2 <= s["end"]), "UNKNOWN"),
-                            "words": seg.get("words", [])
-                        }
-                        for seg in result["segments"]
-                    ]
-                    
-                    merged_segments = self._merge_segments(raw_segments)
-                    
-                    segments = [TranscriptionSegment(**seg) for seg in merged_segments]
-
-                    full_text = " ".join([s.text for s in segments])
-
-                    transcription_result = TranscriptionResult(
-                        segments=segments,
-                        language=result.get("language", "auto"),
-                        num_speakers=detected_speakers,
-                        text=full_text,
-                        translation=None,
-                        summary=None
+                    speaker_segments, detected_speakers, result = self._analyze(
+                        audio, num_speakers, language, translate, email, report, timer
                     )
+                    report(stage="merging", progress=0.9)
+                    
+                    segments = self._label_segments(result["segments"], speaker_segments, speaker_assignment, timer)
 
-                    segments_json = json.dumps([s.dict() for s in segments], ensure_ascii=False)
-
-                    # Сохранение данных в файл перед шифрованием
-                    temp_output = tempfile.mktemp()
-                    with open(temp_output, "w", encoding="utf-8") as f:
-                        f.write(segments_json)
-
-                    encrypted_data = self._encrypt_aes(segments_json, decrypted_key)
+                    transcription_result = {
+                        "segments": segments,
+                        "language": result.get("language", "auto"),
+                        "num_speakers": detected_speakers,
+                        "text": segments.text,
+                    }
 
-                    transcript.encrypted_data = encrypted_data
-                    db.commit()
+                    report(stage="encrypting", progress=0.95)
+                    self._save_segments(stored_transcript_id, segments, decrypted_key, timer)
 
-                    logging.info(f"Updated transcription for {email} with ID {transcript.id}")
+                    logging.info(f"Updated transcription for {email} with ID {stored_transcript_id}")
 
-                    future_result['result'] = transcription_result
+                    return transcription_result
                 except Exception as e:
                     logging.error(f"Prediction error for {email}: {str(e)}")
-                    future_result['error'] = e
-
-            self.transcription_queue.add_task(process_task)
-            while 'result' not in future_result and 'error' not in future_result:
-                await asyncio.sleep(0.1)
-            if 'error' in future_result:
-                raise future_result['error']
-            return future_result['result']
+                    raise
+
+            await asyncio.to_thread(report, stage="queued_for_worker", progress=0.08)
+            transcription_result = await asyncio.wrap_future(self.transcription_queue.add_task(
+                process_task, account=email, audio_seconds=audio.duration, job_id=job_id
+            ))
+            status = "done"
+            return transcription_result
         finally:
-            if os.path.exists(temp_input):
+            timer.finish(status)
+            # Загруженный файл удаляет владелец задачи, чтобы его можно было обработать после рестарта
+            if file_path is None and os.path.exists(temp_input):
                 os.remove(temp_input)
-            if wav_file and os.path.exists(wav_file):
-                os.remove(wav_file)
\ No newline at end of file
+            if audio is not None:
+                audio.close()
\ No newline at end of file
@@ -0,0 +1,221 @@
+"""Очередь транскрипции со справедливым разделением воркеров между аккаунтами.
+
+Стоимость задачи оценивается по длительности записи (estimate_cost). Следующую
+задачу получает аккаунт, который за последние SCHEDULER_FAIRNESS_WINDOW_SECONDS
+занял воркеры меньше всех (выполняющиеся задачи считаются целиком), а внутри
+аккаунта - самая короткая задача. Ожидание уменьшает оценку задачи на
+SCHEDULER_AGING секунд за секунду, поэтому длинная запись не голодает за
+потоком коротких. SCHEDULER_ACCOUNT_MAX_RUNNING ограничивает число
+одновременных задач одного аккаунта (0 - без ограничения).
+
+Та же политика (pick_next) выбирает задачу в брокере БД (jobs.claim_job), а
+plan_queue проигрывает её вперёд, чтобы оценить позицию в очереди и ETA.
+"""
+import heapq
+import itertools
+import os
+import time
+from collections import deque
+from concurrent.futures import Future
+from threading import Condition, Thread
+from typing import Dict, List, Optional
+
+SCHEDULER_RTF = float(os.getenv("SCHEDULER_RTF", "0.25"))
+SCHEDULER_JOB_OVERHEAD_SECONDS = float(os.getenv("SCHEDULER_JOB_OVERHEAD_SECONDS", "5"))
+# Оценка для записи, длительность которой не удалось определить
+SCHEDULER_DEFAULT_AUDIO_SECONDS = float(os.getenv("SCHEDULER_DEFAULT_AUDIO_SECONDS", "600"))
+SCHEDULER_ACCOUNT_MAX_RUNNING = int(os.getenv("SCHEDULER_ACCOUNT_MAX_RUNNING", "0"))
+SCHEDULER_AGING = float(os.getenv("SCHEDULER_AGING", "1.0"))
+SCHEDULER_FAIRNESS_WINDOW_SECONDS = float(os.getenv("SCHEDULER_FAIRNESS_WINDOW_SECONDS", "3600"))
+# Вес нового замера в скользящей оценке RTF
+RTF_SMOOTHING = 0.2
+
+_sequence = itertools.count()
+
+
+def estimate_cost(audio_seconds: Optional[float], rtf: float = SCHEDULER_RTF) -> float:
+    """Ожидаемое время воркера на задачу, в секундах"""
+    if audio_seconds is None:
+        audio_seconds = SCHEDULER_DEFAULT_AUDIO_SECONDS
+    return audio_seconds * rtf + SCHEDULER_JOB_OVERHEAD_SECONDS
+
+
+def pick_next(queued: List[dict], running: Dict, served: Dict, now: float,
+              account_cap: int = SCHEDULER_ACCOUNT_MAX_RUNNING, aging: float = SCHEDULER_AGING) -> Optional[dict]:
+    """Выбирает задачу для освободившегося воркера.
+
+    queued - {"id", "account", "cost", "enqueued_at"}, running - число
+    выполняющихся задач по аккаунтам, served - занятое аккаунтом время воркеров.
+    """
+    best, best_key = None, None
+    for job in queued:
+        account = job["account"]
+        if account_cap and running.get(account, 0) >= account_cap:
+            continue
+        key = (served.get(account, 0.0), job["cost"] - aging * (now - job["enqueued_at"]), job["enqueued_at"])
+        if best is None or key < best_key:
+            best, best_key = job, key
+    return best
+
+
+def plan_queue(queued: List[dict], running_jobs: List[dict], served: Dict, slots: int, now: float,
+               account_cap: int = SCHEDULER_ACCOUNT_MAX_RUNNING, aging: float = SCHEDULER_AGING) -> Dict:
+    """Позиция и ETA каждой задачи: политика проигрывается вперёд по оценкам стоимости.
+
+    running_jobs - {"id", "account", "cost", "started_at"}. Для выполняющихся
+    задач позиция 0, eta_seconds - оценка оставшегося времени до готовности.
+    """
+    served = dict(served)
+    running = {}
+    active = []
+    plan = {}
+    for job in running_jobs:
+        end = max(now, job["started_at"] + job["cost"])
+        heapq.heappush(active, (end, next(_sequence), job["account"]))
+        running[job["account"]] = running.get(job["account"], 0) + 1
+        plan[job["id"]] = {"queue_position": 0, "eta_seconds": round(end - now, 1)}
+
+    pending = list(queued)
+    free = max(1, slots) - len(active)
+    t = now
+    position = 0
+    while pending:
+        job = pick_next(pending, running, served, t, account_cap, aging) if free > 0 else None
+        if job is None:
+            if not active:
+                break
+            end, _, account = heapq.heappop(active)
+            t = max(t, end)
+            running[account] -= 1
+            free += 1
+            continue
+
+        pending.remove(job)
+        position += 1
+        account = job["account"]
+        served[account] = served.get(account, 0.0) + job["cost"]
+        running[account] = running.get(account, 0) + 1
+        free -= 1
+        heapq.heappush(active, (t + job["cost"], next(_sequence), account))
+        plan[job["id"]] = {"queue_position": position, "eta_seconds": round(t + job["cost"] - now, 1)}
+    return plan
+
+
+class TranscriptionQueue:
+    """Пул воркеров с ограничением на число одновременных задач.
+
+    Каждая задача получает свой concurrent.futures.Future, который можно
+    ждать из asyncio через asyncio.wrap_future без опроса. Порядок выдачи
+    задач воркерам определяет pick_next; RTF для оценок уточняется по
+    завершённым задачам.
+    """
+
+    def __init__(self, max_concurrent=2, account_cap: int = SCHEDULER_ACCOUNT_MAX_RUNNING,
+                 aging: float = SCHEDULER_AGING):
+        self.max_concurrent = max_concurrent
+        self.account_cap = account_cap
+        self.aging = aging
+        self.rtf = SCHEDULER_RTF
+        self.queued = []
+        self.running = {}
+        self.running_jobs = {}
+        # (время старта, аккаунт, стоимость) задач за окно справедливости
+        self.history = deque()
+        self.current_tasks = 0
+        self.available = Condition()
+        self.workers = [
+            Thread(target=self._process_queue, name=f"transcription-worker-{i}", daemon=True)
+            for i in range(max_concurrent)
+        ]
+        for worker in self.workers:
+            worker.start()
+
+    def add_task(self, task, account=None, audio_seconds: float = None, job_id: str = None) -> Future:
+        future = Future()
+        with self.available:
+            self.queued.append({
+                "id": job_id or f"task-{next(_sequence)}",
+                "account": account or "",
+                "cost": estimate_cost(audio_seconds, self.rtf),
+                "audio_seconds": audio_seconds,
+                "enqueued_at": time.monotonic(),
+                "task": task,
+                "future": future,
+            })
+            self.available.notify_all()
+        return future
+
+    @property
+    def pending(self) -> int:
+        return len(self.queued)
+
+    def _served(self, now: float) -> Dict:
+        while self.history and self.history[0][0] < now - SCHEDULER_FAIRNESS_WINDOW_SECONDS:
+            self.history.popleft()
+        served = {}
+        for _, account, cost in self.history:
+            served[account] = served.get(account, 0.0) + cost
+        # Выполняющиеся задачи считаются, даже если начались раньше окна
+        for job in self.running_jobs.values():
+            if job["started_at"] < now - SCHEDULER_FAIRNESS_WINDOW_SECONDS:
+                served[job["account"]] = served.get(job["account"], 0.0) + job["cost"]
+        return served
+
+    def plan(self) -> Dict:
+        """Позиция в очереди и ETA для ожидающих и выполняющихся задач по id"""
+        with self.available:
+            now = time.monotonic()
+            queued = [job for job in self.queued if not job["future"].cancelled()]
+            return plan_queue(
+                queued, list(self.running_jobs.values()), self._served(now), self.max_concurrent, now,
+                self.account_cap, self.aging,
+            )
+
+    def _next_job(self) -> Optional[dict]:
+        # Задачу могли отменить, пока она стояла в очереди
+        self.queued = [job for job in self.queued if not job["future"].cancelled()]
+        now = time.monotonic()
+        job = pick_next(self.queued, self.running, self._served(now), now, self.account_cap, self.aging)
+        if job is None:
+            return None
+
+        self.queued.remove(job)
+        self.running[job["account"]] = self.running.get(job["account"], 0) + 1
+        self.running_jobs[job["id"]] = {**job, "started_at": now}
+        self.history.append((now, job["account"], job["cost"]))
+        self.current_tasks += 1
+        return job
+
+    def _finish_job(self, job: dict, started: float, succeeded: bool):
+        with self.available:
+            self.running[job["account"]] -= 1
+            self.running_jobs.pop(job["id"], None)
+            self.current_tasks -= 1
+            elapsed = time.monotonic() - started
+            # Упавшие задачи заканчиваются раньше и занизили бы оценку
+            if succeeded and job["audio_seconds"]:
+                observed = max(0.0, elapsed - SCHEDULER_JOB_OVERHEAD_SECONDS) / job["audio_seconds"]
+                self.rtf += RTF_SMOOTHING * (observed - self.rtf)
+            self.available.notify_all()
+
+    def _process_queue(self):
+        while True:
+            with self.available:
+                job = self._next_job()
+                while job is None:
+                    self.available.wait()
+                    job = self._next_job()
+
+            started = time.monotonic()
+            future = job["future"]
+            succeeded = False
+            try:
+                if not future.set_running_or_notify_cancel():
+                    continue
+                try:
+                    future.set_result(job["task"]())
+                    succeeded = True
+                except BaseException as e:
+                    future.set_exception(e)
+            finally:
+                self._finish_job(job, started, succeeded)
@@ -0,0 +1,227 @@
+import atexit
+import logging
+import os
+import socket
+import subprocess
+import time
+from threading import Condition, Lock
+
+import requests
+
+from alignment import words_from_tokens
+from metrics import record_model_load
+
+SERVER_CONNECT_TIMEOUT_SECONDS = 10.0
+# Время ответа whisper-server: база плюс доля длительности записи
+WHISPER_TIMEOUT_BASE_SECONDS = float(os.getenv("WHISPER_TIMEOUT_BASE_SECONDS", "60"))
+WHISPER_TIMEOUT_RTF = float(os.getenv("WHISPER_TIMEOUT_RTF", "1.0"))
+LLAMA_TIMEOUT_SECONDS = float(os.getenv("LLAMA_TIMEOUT_SECONDS", "300"))
+
+
+class ManagedServer:
+    """Долгоживущий дочерний процесс с HTTP API, который держит модель в памяти"""
+
+    name = "server"
+
+    def __init__(self, command: list, host: str = "127.0.0.1", port: int = 8178, startup_timeout: float = 300.0):
+        self.command = command
+        self.host = host
+        self.port = port
+        self.startup_timeout = startup_timeout
+        self.process = None
+        self.lock = Lock()
+        atexit.register(self.stop)
+
+    @property
+    def url(self) -> str:
+        return f"http://{self.host}:{self.port}"
+
+    def start(self):
+        with self.lock:
+            if self.process is not None and self.process.poll() is None:
+                return
+            self._spawn()
+
+    def ensure_running(self):
+        if self.process is None or self.process.poll() is not None:
+            if self.process is not None:
+                logging.warning(f"{self.name} on port {self.port} exited with code {self.process.returncode}, restarting")
+            self.start()
+
+    def restart(self):
+        self.stop()
+        self.start()
+
+    def stop(self):
+        if self.process is not None and self.process.poll() is None:
+            self.process.terminate()
+            try:
+                self.process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+        self.process = None
+
+    def _spawn(self):
+        command = self.command + ["--host", self.host, "--port", str(self.port)]
+        logging.info(f"Starting {self.name}: {' '.join(command)}")
+        started = time.perf_counter()
+        self.process = subprocess.Popen(command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+        # Сервер начинает слушать порт только после загрузки модели
+        deadline = started + self.startup_timeout
+        while time.perf_counter() < deadline:
+            if self.process.poll() is not None:
+                raise RuntimeError(f"{self.name} exited during startup with code {self.process.returncode}")
+            try:
+                with socket.create_connection((self.host, self.port), timeout=1):
+                    logging.info(f"{self.name} ready on port {self.port} in {time.perf_counter() - started:.1f}s")
+                    record_model_load(self.name, time.perf_counter() - started)
+                    return
+            except OSError:
+                time.sleep(0.5)
+
+        self.stop()
+        raise RuntimeError(f"{self.name} did not start within {self.startup_timeout:.0f}s")
+
+
+class WhisperServer(ManagedServer):
+    name = "whisper-server"
+
+    def __init__(self, binary: str, model_path: str, port: int, threads: int = None):
+        command = [binary, "-m", model_path]
+        if threads:
+            command.extend(["-t", str(threads)])
+        super().__init__(command, port=port)
+
+    def transcribe(self, wav_file: str, language: str = "ru", translate: bool = False) -> dict:
+        data = {
+            "response_format": "verbose_json",
+            "temperature": "0.0",
+            "translate": "true" if translate else "false",
+        }
+        if language:
+            data["language"] = language
+
+        # Файлы - 16-битный моно WAV на 16 кГц, длительность видна по размеру
+        audio_seconds = max(0, os.path.getsize(wav_file) - 44) / (2 * 16000)
+        timeout = (SERVER_CONNECT_TIMEOUT_SECONDS, WHISPER_TIMEOUT_BASE_SECONDS + WHISPER_TIMEOUT_RTF * audio_seconds)
+        with open(wav_file, "rb") as f:
+            response = requests.post(f"{self.url}/inference", files={"file": f}, data=data, timeout=timeout)
+        response.raise_for_status()
+        result = response.json()
+        if "error" in result:
+            raise RuntimeError(f"whisper-server error: {result['error']}")
+
+        return {
+            "segments": [
+                {
+                    "text": seg["text"].strip(),
+                    "start": float(seg["start"]),
+                    "end": float(seg["end"]),
+                    # В verbose_json "words" - это токены со временем в секундах
+                    "words": words_from_tokens([
+                        {"text": w["word"], "start": float(w["start"]), "end": float(w["end"]),
+                         "p": w.get("probability", 1.0)}
+                        for w in seg.get("words", []) if "start" in w
+                    ]),
+                }
+                for seg in result.get("segments", [])
+            ],
+            "language": result.get("language", "auto")
+        }
+
+
+class WhisperServerPool:
+    """Несколько whisper-server; каждый обрабатывает один запрос за раз.
+
+    Последние reserved серверов принимают только срочные запросы (живая
+    расшифровка), поэтому длинная задача не держит их. Срочный запрос также
+    получает освободившийся общий сервер раньше обычных.
+    """
+
+    def __init__(self, servers: list, reserved: int = 0):
+        if reserved >= len(servers):
+            raise ValueError("WhisperServerPool needs at least one server that is not reserved")
+        self.servers = servers
+        self.reserved = servers[len(servers) - reserved:]
+        self.free = servers[:len(servers) - reserved]
+        self.free_reserved = list(self.reserved)
+        self.urgent_waiting = 0
+        self.available = Condition()
+
+    def start(self):
+        for server in self.servers:
+            server.start()
+
+    def stop(self):
+        for server in self.servers:
+            server.stop()
+
+    def _acquire(self, urgent: bool):
+        with self.available:
+            if urgent:
+                self.urgent_waiting += 1
+            try:
+                while True:
+                    if urgent and self.free_reserved:
+                        return self.free_reserved.pop()
+                    if self.free and (urgent or not self.urgent_waiting):
+                        return self.free.pop()
+                    self.available.wait()
+            finally:
+                if urgent:
+                    self.urgent_waiting -= 1
+
+    def _release(self, server):
+        with self.available:
+            (self.free_reserved if server in self.reserved else self.free).append(server)
+            self.available.notify_all()
+
+    def transcribe(self, wav_file: str, language: str = "ru", translate: bool = False, urgent: bool = False) -> dict:
+        server = self._acquire(urgent)
+        try:
+            server.ensure_running()
+            try:
+                return server.transcribe(wav_file, language, translate)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                # Зависший сервер не отвечает так же, как упавший: перезапускаем и повторяем один раз
+                logging.warning(f"whisper-server on port {server.port} failed ({type(e).__name__}), restarting")
+                server.restart()
+                return server.transcribe(wav_file, language, translate)
+        finally:
+            self._release(server)
+
+
+class LlamaServer(ManagedServer):
+    """llama.cpp server с несколькими слотами для параллельной генерации"""
+
+    name = "llama-server"
+
+    def __init__(self, binary: str, model_path: str, port: int, context_tokens: int = 4096,
+                 parallel: int = 2, threads: int = 8):
+        # Контекст сервера делится между слотами поровну
+        command = [
+            binary, "-m", model_path,
+            "-c", str(context_tokens * parallel),
+            "-np", str(parallel),
+            "-t", str(threads),
+        ]
+        super().__init__(command, port=port)
+
+    def tokenize(self, text: str) -> list:
+        response = requests.post(
+            f"{self.url}/tokenize", json={"content": text}, timeout=(SERVER_CONNECT_TIMEOUT_SECONDS, LLAMA_TIMEOUT_SECONDS)
+        )
+        response.raise_for_status()
+        return response.json()["tokens"]
+
+    def complete(self, prompt: str, n_predict: int = 512) -> str:
+        response = requests.post(f"{self.url}/completion", json={
+            "prompt": prompt,
+            "n_predict": n_predict,
+            "temperature": 0.7,
+            "top_p": 0.9,
+            "repeat_penalty": 1.1,
+        }, timeout=(SERVER_CONNECT_TIMEOUT_SECONDS, LLAMA_TIMEOUT_SECONDS))
+        response.raise_for_status()
+        return response.json()["content"].strip()
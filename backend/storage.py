@@ -0,0 +1,141 @@
+import hashlib
+import os
+import tempfile
+from typing import Iterable, Iterator, Optional, Tuple
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+STREAM_CHUNK_SIZE = 1024 * 1024
+
+
+class BlobStore:
+    """Хранилище бинарных блобов, адресуемых по SHA-256 содержимого"""
+
+    def put(self, chunks: Iterable[bytes]) -> Tuple[str, int]:
+        raise NotImplementedError
+
+    def size(self, ref: str) -> int:
+        raise NotImplementedError
+
+    def open_range(self, ref: str, start: int = 0, end: Optional[int] = None) -> Iterator[bytes]:
+        """Отдаёт байты [start, end] включительно, как в HTTP Range"""
+        raise NotImplementedError
+
+    def delete(self, ref: str):
+        raise NotImplementedError
+
+    def read(self, ref: str) -> bytes:
+        return b"".join(self.open_range(ref))
+
+
+class LocalBlobStore(BlobStore):
+    def __init__(self, root: str):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+
+    def _path(self, ref: str) -> str:
+        return os.path.join(self.root, ref[:2], ref[2:4], ref)
+
+    def put(self, chunks: Iterable[bytes]) -> Tuple[str, int]:
+        digest = hashlib.sha256()
+        size = 0
+        fd, temp_path = tempfile.mkstemp(dir=self.root, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                for chunk in chunks:
+                    digest.update(chunk)
+                    size += len(chunk)
+                    f.write(chunk)
+
+            ref = digest.hexdigest()
+            path = self._path(ref)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            os.replace(temp_path, path)
+            return ref, size
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+
+    def size(self, ref: str) -> int:
+        return os.path.getsize(self._path(ref))
+
+    def open_range(self, ref: str, start: int = 0, end: Optional[int] = None) -> Iterator[bytes]:
+        with open(self._path(ref), "rb") as f:
+            f.seek(start)
+            remaining = None if end is None else end - start + 1
+            while remaining is None or remaining > 0:
+                chunk = f.read(STREAM_CHUNK_SIZE if remaining is None else min(STREAM_CHUNK_SIZE, remaining))
+                if not chunk:
+                    break
+                if remaining is not None:
+                    remaining -= len(chunk)
+                yield chunk
+
+    def delete(self, ref: str):
+        path = self._path(ref)
+        if os.path.exists(path):
+            os.remove(path)
+
+
+class S3BlobStore(BlobStore):
+    """Блобы в S3-совместимом хранилище (AWS S3, MinIO и т.п.) через клиент boto3"""
+
+    def __init__(self, client, bucket: str, prefix: str = "transcripts/"):
+        self.client = client
+        self.bucket = bucket
+        self.prefix = prefix
+
+    def _key(self, ref: str) -> str:
+        return f"{self.prefix}{ref}"
+
+    def put(self, chunks: Iterable[bytes]) -> Tuple[str, int]:
+        # Ключ зависит от хэша, поэтому содержимое сначала копится во временном файле
+        digest = hashlib.sha256()
+        size = 0
+        with tempfile.SpooledTemporaryFile(max_size=8 * 1024 * 1024) as f:
+            for chunk in chunks:
+                digest.update(chunk)
+                size += len(chunk)
+                f.write(chunk)
+            f.seek(0)
+            ref = digest.hexdigest()
+            self.client.put_object(Bucket=self.bucket, Key=self._key(ref), Body=f, ContentLength=size)
+        return ref, size
+
+    def size(self, ref: str) -> int:
+        return self.client.head_object(Bucket=self.bucket, Key=self._key(ref))["ContentLength"]
+
+    def open_range(self, ref: str, start: int = 0, end: Optional[int] = None) -> Iterator[bytes]:
+        byte_range = f"bytes={start}-{'' if end is None else end}"
+        response = self.client.get_object(Bucket=self.bucket, Key=self._key(ref), Range=byte_range)
+        yield from response["Body"].iter_chunks(STREAM_CHUNK_SIZE)
+
+    def delete(self, ref: str):
+        self.client.delete_object(Bucket=self.bucket, Key=self._key(ref))
+
+
+def get_blob_store() -> BlobStore:
+    backend = os.getenv("BLOB_STORE", "local")
+
+    if backend == "local":
+        return LocalBlobStore(os.getenv("BLOB_DIR", "./blobs"))
+
+    if backend == "s3":
+        try:
+            import boto3
+        except ImportError:
+            raise RuntimeError("boto3 is required for BLOB_STORE=s3")
+
+        client = boto3.client(
+            "s3",
+            endpoint_url=os.getenv("S3_ENDPOINT_URL"),
+            aws_access_key_id=os.getenv("S3_ACCESS_KEY_ID"),
+            aws_secret_access_key=os.getenv("S3_SECRET_ACCESS_KEY"),
+            region_name=os.getenv("S3_REGION"),
+        )
+        return S3BlobStore(client, os.environ["S3_BUCKET"], os.getenv("S3_PREFIX", "transcripts/"))
+
+    raise RuntimeError(f"Unknown BLOB_STORE: {backend}")
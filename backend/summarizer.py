@@ -0,0 +1,141 @@
+import logging
+import math
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Union
+
+from servers import LlamaServer
+
+PROMPT_TEMPLATE = "{instruction}\n\nТекст: {text}\n\nОтвет:"
+
+# Чанки режутся по оценке токенов из числа символов: соотношение меряется
+# одним /tokenize по началу текста, оценка берётся с запасом, а готовые
+# чанки проверяются точным подсчётом
+CALIBRATION_CHARS = 8000
+TOKEN_ESTIMATE_MARGIN = 1.2
+
+# Промежуточные шаги сжимают фрагменты, финальный шаг применяет исходный промпт
+MAP_PROMPTS = {
+    "summary": "Кратко перескажи этот фрагмент разговора, сохранив ключевые факты, решения и договорённости:",
+    "hr_interview": "Выпиши из этого фрагмента интервью факты о компетенциях, опыте, сильных и слабых сторонах кандидата:",
+}
+
+
+class TranscriptSummarizer:
+    """Map-reduce суммаризация транскрипта через резидентный llama-server.
+
+    Сегменты упаковываются в чанки, помещающиеся в контекст одного слота,
+    чанки сжимаются параллельно, а промежуточные пересказы сворачиваются
+    дальше, пока всё не уместится в один финальный запрос.
+    """
+
+    def __init__(self, server: LlamaServer, prompts: dict, context_tokens: int = 4096,
+                 max_new_tokens: int = 512, parallel: int = 2):
+        self.server = server
+        self.prompts = prompts
+        self.context_tokens = context_tokens
+        self.max_new_tokens = max_new_tokens
+        self.executor = ThreadPoolExecutor(max_workers=parallel, thread_name_prefix="summarizer")
+
+    def count_tokens(self, text: str) -> int:
+        return len(self.server.tokenize(text))
+
+    def _budget(self, instruction: str) -> int:
+        overhead = self.count_tokens(PROMPT_TEMPLATE.format(instruction=instruction, text=""))
+        return self.context_tokens - self.max_new_tokens - overhead
+
+    def chars_per_token(self, lines: List[str]) -> float:
+        sample = "\n".join(lines)[:CALIBRATION_CHARS]
+        if not sample:
+            return 1.0
+        return len(sample) / max(1, self.count_tokens(sample))
+
+    @staticmethod
+    def _estimate(text: str, chars_per_token: float) -> int:
+        return math.ceil(len(text) / chars_per_token * TOKEN_ESTIMATE_MARGIN)
+
+    def _split_long_line(self, line: str, tokens: int, budget: int) -> List[str]:
+        words = line.split()
+        if len(words) < 2:
+            middle = len(line) // 2
+            return [line[:middle], line[middle:]]
+        parts = max(2, -(-tokens // budget))
+        size = -(-len(words) // parts)
+        return [" ".join(words[i:i + size]) for i in range(0, len(words), size)]
+
+    def _pack(self, lines: List[str], budget: int, chars_per_token: float) -> List[List[str]]:
+        chunks = []
+        current, current_tokens = [], 0
+
+        pending = list(reversed(lines))
+        while pending:
+            line = pending.pop()
+            tokens = self._estimate(line, chars_per_token) + 1
+            if tokens > budget:
+                pending.extend(reversed(self._split_long_line(line, tokens, budget)))
+                continue
+            if current and current_tokens + tokens > budget:
+                chunks.append(current)
+                current, current_tokens = [], 0
+            current.append(line)
+            current_tokens += tokens
+
+        if current:
+            chunks.append(current)
+        return chunks
+
+    def chunk_lines(self, lines: List[str], budget: int, chars_per_token: float = None) -> List[str]:
+        """Упаковывает строки в чанки не длиннее budget токенов.
+
+        Запросов к /tokenize - по одному на чанк, а не на строку; чанк, который
+        оценка всё же недосчитала, делится пополам и проверяется снова.
+        """
+        if chars_per_token is None:
+            chars_per_token = self.chars_per_token(lines)
+
+        chunks = []
+        pending = list(reversed(self._pack(lines, budget, chars_per_token)))
+        while pending:
+            chunk = pending.pop()
+            text = "\n".join(chunk)
+            tokens = self.count_tokens(text)
+            if tokens <= budget:
+                chunks.append(text)
+                continue
+            if len(chunk) > 1:
+                middle = len(chunk) // 2
+                pending.extend([chunk[middle:], chunk[:middle]])
+            else:
+                pending.extend([[part] for part in reversed(self._split_long_line(text, tokens, budget))])
+        return chunks
+
+    def _complete(self, instruction: str, text: str) -> str:
+        return self.server.complete(PROMPT_TEMPLATE.format(instruction=instruction, text=text), self.max_new_tokens)
+
+    def summarize(self, segments: Union[str, List[dict]], prompt_type: str = "summary") -> str:
+        if prompt_type not in self.prompts:
+            raise ValueError(f"Invalid prompt type. Must be one of: {list(self.prompts.keys())}")
+
+        self.server.ensure_running()
+
+        if isinstance(segments, str):
+            lines = [line for line in segments.splitlines() if line.strip()]
+        else:
+            lines = [f"{seg['speaker']}: {seg['text']}" for seg in segments if seg["text"].strip()]
+
+        instruction = self.prompts[prompt_type]
+        map_instruction = MAP_PROMPTS.get(prompt_type, MAP_PROMPTS["summary"])
+        chars_per_token = self.chars_per_token(lines)
+        map_budget = self._budget(map_instruction)
+        chunks = self.chunk_lines(lines, min(self._budget(instruction), map_budget), chars_per_token)
+
+        level = 0
+        while len(chunks) > 1:
+            level += 1
+            logging.info(f"Summarizing {len(chunks)} chunks (level {level})")
+            partials = list(self.executor.map(lambda chunk: self._complete(map_instruction, chunk), chunks))
+            regrouped = self.chunk_lines(partials, map_budget, chars_per_token)
+            if len(regrouped) >= len(chunks):
+                raise RuntimeError("Context is too small for the configured max_new_tokens to reduce the transcript")
+            chunks = regrouped
+
+        return self._complete(instruction, chunks[0] if chunks else "")
@@ -0,0 +1,158 @@
+"""Шифрование транскриптов.
+
+Формат v2 (потоковый, AES-256-GCM):
+
+    header  = b"VFT" | version (1) | salt (16)
+    record  = flags (1) | length (4) | ciphertext (length) | tag (16)
+    footer  = offsets (8 * (count + 1)) | count (4) | b"VFIX"
+
+Ключ записи - HMAC-SHA256(SHA256(ключ пользователя), salt), nonce записи -
+7 нулевых байт | номер записи (4) | flags (1), заголовок идёт в AAD. Каждая
+запись - один сегмент в JSON; последняя запись пустая и помечена флагом
+FINAL, поэтому обрезанный или переставленный поток не расшифруется. Футер со
+смещениями записей (включая финальную) даёт произвольный доступ к диапазонам
+сегментов через HTTP Range; он не аутентифицирован, но подмена смещений лишь
+приводит к ошибке расшифровки.
+
+Формат v1 - base64(iv | AES-256-CBC(JSON всех сегментов)) с ключом
+SHA256(ключ пользователя), остаётся читаемым.
+"""
+import hashlib
+import hmac
+import json
+import os
+import struct
+from typing import Callable, Iterable, Iterator, List
+
+from Crypto.Cipher import AES
+from Crypto.Util.Padding import unpad
+
+MAGIC = b"VFT"
+VERSION = 2
+SALT_SIZE = 16
+HEADER_SIZE = len(MAGIC) + 1 + SALT_SIZE
+RECORD_HEADER_SIZE = 5
+TAG_SIZE = 16
+FOOTER_MAGIC = b"VFIX"
+FOOTER_SIZE = 8
+
+FLAG_FINAL = 1
+
+
+def _base_key(key: str) -> bytes:
+    return hashlib.sha256(key.encode()).digest()
+
+
+def _nonce(index: int, flags: int) -> bytes:
+    return bytes(7) + struct.pack(">IB", index, flags)
+
+
+class TranscriptWriter:
+    """Шифрует записи по одной по мере их появления"""
+
+    def __init__(self, key: str):
+        self.salt = os.urandom(SALT_SIZE)
+        self.header = MAGIC + bytes([VERSION]) + self.salt
+        self.record_key = hmac.new(_base_key(key), self.salt, hashlib.sha256).digest()
+        self.offsets = []
+        self.position = 0
+
+    def start(self) -> bytes:
+        self.position = len(self.header)
+        return self.header
+
+    def _encrypt(self, plaintext: bytes, flags: int) -> bytes:
+        index = len(self.offsets)
+        self.offsets.append(self.position)
+
+        cipher = AES.new(self.record_key, AES.MODE_GCM, nonce=_nonce(index, flags))
+        cipher.update(self.header)
+        ciphertext, tag = cipher.encrypt_and_digest(plaintext)
+
+        record = struct.pack(">BI", flags, len(ciphertext)) + ciphertext + tag
+        self.position += len(record)
+        return record
+
+    def record(self, plaintext: bytes) -> bytes:
+        return self._encrypt(plaintext, 0)
+
+    def finish(self) -> bytes:
+        final = self._encrypt(b"", FLAG_FINAL)
+        count = len(self.offsets) - 1
+        footer = struct.pack(f">{len(self.offsets)}Q", *self.offsets) + struct.pack(">I", count) + FOOTER_MAGIC
+        return final + footer
+
+
+def encrypt_segments(segments: Iterable[dict], key: str) -> Iterator[bytes]:
+    """Потоково шифрует сегменты: по одной записи на сегмент"""
+    writer = TranscriptWriter(key)
+    yield writer.start()
+    for segment in segments:
+        yield writer.record(json.dumps(segment, ensure_ascii=False).encode())
+    yield writer.finish()
+
+
+def is_framed(blob: bytes) -> bool:
+    return blob[:len(MAGIC)] == MAGIC and len(blob) > len(MAGIC) and blob[len(MAGIC)] == VERSION
+
+
+def _record_cipher(key: str, header: bytes, index: int, flags: int):
+    record_key = hmac.new(_base_key(key), header[len(MAGIC) + 1:HEADER_SIZE], hashlib.sha256).digest()
+    cipher = AES.new(record_key, AES.MODE_GCM, nonce=_nonce(index, flags))
+    cipher.update(header)
+    return cipher
+
+
+def _decrypt_record(key: str, header: bytes, index: int, record: bytes) -> bytes:
+    flags, length = struct.unpack(">BI", record[:RECORD_HEADER_SIZE])
+    body = record[RECORD_HEADER_SIZE:RECORD_HEADER_SIZE + length]
+    tag = record[RECORD_HEADER_SIZE + length:RECORD_HEADER_SIZE + length + TAG_SIZE]
+    return _record_cipher(key, header, index, flags).decrypt_and_verify(body, tag)
+
+
+def decrypt_transcript(blob: bytes, key: str) -> List[dict]:
+    """Расшифровывает транскрипт целиком в любом из форматов"""
+    if not is_framed(blob):
+        key_bytes = _base_key(key)
+        cipher = AES.new(key_bytes, AES.MODE_CBC, blob[:16])
+        return json.loads(unpad(cipher.decrypt(blob[16:]), AES.block_size))
+
+    header = blob[:HEADER_SIZE]
+    segments = []
+    position, index = HEADER_SIZE, 0
+    while True:
+        flags, length = struct.unpack(">BI", blob[position:position + RECORD_HEADER_SIZE])
+        end = position + RECORD_HEADER_SIZE + length + TAG_SIZE
+        plaintext = _decrypt_record(key, header, index, blob[position:end])
+        if flags & FLAG_FINAL:
+            return segments
+        segments.append(json.loads(plaintext))
+        position, index = end, index + 1
+
+
+def read_segment_range(read: Callable[[int, int], bytes], size: int, key: str, first: int, last: int) -> List[dict]:
+    """Расшифровывает сегменты [first, last] по индексу в футере.
+
+    read(start, end) должен вернуть байты start..end включительно (как HTTP Range).
+    """
+    header = read(0, HEADER_SIZE - 1)
+    if not is_framed(header):
+        raise ValueError("Random access is only supported for framed transcripts")
+
+    count, magic = struct.unpack(">I4s", read(size - FOOTER_SIZE, size - 1))
+    if magic != FOOTER_MAGIC:
+        raise ValueError("Transcript index is missing")
+
+    index_start = size - FOOTER_SIZE - 8 * (count + 1)
+    offsets = struct.unpack(f">{count + 1}Q", read(index_start, size - FOOTER_SIZE - 1))
+
+    last = min(last, count - 1)
+    if first > last:
+        return []
+
+    records = read(offsets[first], offsets[last + 1] - 1)
+    segments = []
+    for index in range(first, last + 1):
+        start, end = offsets[index] - offsets[first], offsets[index + 1] - offsets[first]
+        segments.append(json.loads(_decrypt_record(key, header, index, records[start:end])))
+    return segments
@@ -1,24 +1,48 @@
 import os
+import bcrypt
 from Crypto.Cipher import AES
+from Crypto.Hash import SHA256
 from Crypto.Protocol.KDF import PBKDF2
 from hashlib import sha256
 import base64
 
-def generate_encrypted_key(password: str):
-    key = base64.b64encode(os.urandom(32)).decode() 
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+# По умолчанию стоимость прежнего формата (1000 итераций); увеличение - отдельное решение
+# с замером benchmarks/bench_login.py, старые ключи хранят своё число итераций
+PBKDF2_ITERATIONS = int(os.getenv("PBKDF2_ITERATIONS", "1000"))
+
+# v2$<итерации>$<base64>: PBKDF2-HMAC-SHA256 с сохранённым числом итераций.
+# Ключи без префикса - исходный формат (PBKDF2-HMAC-SHA1, 1000 итераций)
+KEY_FORMAT_V2 = "v2"
+
+def hash_password(password: str, rounds: int = BCRYPT_ROUNDS) -> str:
+    return bcrypt.hashpw(password.encode(), bcrypt.gensalt(rounds)).decode()
+
+def check_password(password: str, password_hash: str) -> bool:
+    return bcrypt.checkpw(password.encode(), password_hash.encode())
+
+def generate_encrypted_key(password: str, iterations: int = PBKDF2_ITERATIONS):
+    key = base64.b64encode(os.urandom(32)).decode()
     salt = os.urandom(16)
-    derived_key = PBKDF2(password, salt, dkLen=32)
+    derived_key = PBKDF2(password, salt, dkLen=32, count=iterations, hmac_hash_module=SHA256)
     cipher = AES.new(derived_key, AES.MODE_GCM)
-    encrypted_key, tag = cipher.encrypt_and_digest(key.encode()) 
-    return base64.b64encode(salt + cipher.nonce + encrypted_key + tag).decode()
+    encrypted_key, tag = cipher.encrypt_and_digest(key.encode())
+    payload = base64.b64encode(salt + cipher.nonce + encrypted_key + tag).decode()
+    return f"{KEY_FORMAT_V2}${iterations}${payload}"
 
 def decrypt_key(password: str, encrypted_data: str):
-    encrypted_data_bytes = base64.b64decode(encrypted_data) 
+    if encrypted_data.startswith(f"{KEY_FORMAT_V2}$"):
+        _, iterations, encrypted_data = encrypted_data.split("$", 2)
+        kdf_params = dict(count=int(iterations), hmac_hash_module=SHA256)
+    else:
+        kdf_params = {}
+
+    encrypted_data_bytes = base64.b64decode(encrypted_data)
     salt = encrypted_data_bytes[:16]
     nonce = encrypted_data_bytes[16:32]
     ciphertext = encrypted_data_bytes[32:-16]
     tag = encrypted_data_bytes[-16:]
-    derived_key = PBKDF2(password, salt, dkLen=32)
+    derived_key = PBKDF2(password, salt, dkLen=32, **kdf_params)
     cipher = AES.new(derived_key, AES.MODE_GCM, nonce)
     decrypted_key = cipher.decrypt_and_verify(ciphertext, tag).decode()
-    return decrypted_key
\ No newline at end of file
+    return decrypted_key
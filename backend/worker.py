@@ -0,0 +1,115 @@
+"""Воркер инференса: забирает задачи из таблицы jobs и пишет результат в Transcript.
+
+    INFERENCE_MODE=broker uvicorn main:app --host 0.0.0.0 --port 8000
+    python worker.py
+
+API в режиме broker только сохраняет загрузку в общий UPLOAD_DIR и ставит
+задачу в очередь, модели держат только воркеры. Воркеров может быть
+несколько: задачи разбираются через SELECT ... FOR UPDATE SKIP LOCKED.
+Каждый воркер обновляет heartbeat своих задач; задачи упавшего воркера
+после JOB_LEASE_SECONDS возвращаются в очередь любым живым воркером.
+"""
+import asyncio
+import logging
+import os
+import signal
+import socket
+import uuid
+
+from dotenv import load_dotenv
+
+from jobs import JOB_LEASE_SECONDS, claim_job, heartbeat_jobs, requeue_stale_jobs, run_job
+from metrics import serve_metrics
+from predict import Predictor
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+JOB_POLL_SECONDS = float(os.getenv("JOB_POLL_SECONDS", "1.0"))
+WORKER_METRICS_PORT = int(os.getenv("WORKER_METRICS_PORT", "9100"))
+WORKER_SHUTDOWN_TIMEOUT = float(os.getenv("WORKER_SHUTDOWN_TIMEOUT", "600"))
+
+
+class Worker:
+    def __init__(self, predictor: Predictor, concurrency: int, worker_id: str = None):
+        self.predictor = predictor
+        self.concurrency = concurrency
+        self.worker_id = worker_id or f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+        self.active = {}
+        self.stopping = asyncio.Event()
+
+    def stop(self):
+        logger.info(f"Worker {self.worker_id} stops claiming jobs")
+        self.stopping.set()
+
+    async def _heartbeat(self):
+        # Чаще срока аренды, чтобы одна пропущенная запись не отдала задачу другому воркеру
+        # Работает и во время остановки, пока доделываются текущие задачи
+        interval = JOB_LEASE_SECONDS / 4
+        while True:
+            try:
+                await asyncio.to_thread(heartbeat_jobs, self.worker_id, list(self.active))
+                if not self.stopping.is_set():
+                    await asyncio.to_thread(requeue_stale_jobs)
+            except Exception as e:
+                logger.error(f"Heartbeat failed: {str(e)}")
+            await asyncio.sleep(interval)
+
+    async def _run(self, job_id: str):
+        try:
+            await run_job(self.predictor, job_id)
+            logger.info(f"Transcription job {job_id} finished")
+        except Exception as e:
+            logger.error(f"Ошибка обработки транскрипции для задачи {job_id}: {str(e)}")
+        finally:
+            self.active.pop(job_id, None)
+
+    async def run(self):
+        logger.info(f"Worker {self.worker_id} loading models")
+        self.predictor.start_warmup()
+        await self.predictor.wait_ready()
+
+        heartbeat = asyncio.create_task(self._heartbeat())
+        logger.info(f"Worker {self.worker_id} is consuming jobs, concurrency {self.concurrency}")
+
+        while not self.stopping.is_set():
+            # Берём не больше задач, чем можем выполнять одновременно: остальные достанутся другим воркерам
+            job_id = None
+            if len(self.active) < self.concurrency:
+                try:
+                    job_id = await asyncio.to_thread(claim_job, self.worker_id)
+                except Exception as e:
+                    logger.error(f"Failed to claim a job: {str(e)}")
+
+            if job_id is None:
+                try:
+                    await asyncio.wait_for(self.stopping.wait(), timeout=JOB_POLL_SECONDS)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            logger.info(f"Worker {self.worker_id} claimed job {job_id}")
+            self.active[job_id] = asyncio.create_task(self._run(job_id))
+
+        # Текущие задачи доделываются; не успевшие останутся running и вернутся в очередь по аренде
+        if self.active:
+            logger.info(f"Waiting for {len(self.active)} running jobs")
+            await asyncio.wait(list(self.active.values()), timeout=WORKER_SHUTDOWN_TIMEOUT)
+        heartbeat.cancel()
+
+
+async def main():
+    predictor = Predictor()
+    worker = Worker(predictor, concurrency=int(os.getenv("TRANSCRIPTION_WORKERS", "3")))
+
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(sig, worker.stop)
+
+    serve_metrics(WORKER_METRICS_PORT)
+    await worker.run()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
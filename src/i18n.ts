@@ -27,6 +27,7 @@ const messages = {
     source: "Source",
     meetingName: "Meeting name (optional)",
     meetingNamePlaceholder: "Meeting name",
+    loadMore: "Load more",
 
     // File Upload
     uploadFile: "Upload audio or video file",
@@ -109,6 +110,7 @@ const messages = {
     source: "Источник",
     meetingName: "Название встречи (опционально)",
     meetingNamePlaceholder: "Название встречи",
+    loadMore: "Загрузить ещё",
 
     // Загрузка файлов
     uploadFile: "Загрузка аудио или видео файла",
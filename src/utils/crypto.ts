@@ -80,6 +80,211 @@ export const decryptTranscriptData = (
   }
 };
 
+const API_URL = "https://voiceflow.ru/api";
+
+// Потоковый формат v2 (см. backend/transcript_crypto.py):
+// header = "VFT" | version | salt(16), record = flags | length(4) | ciphertext | tag(16),
+// footer = offsets(8 * (count + 1)) | count(4) | "VFIX"
+const FRAMED_MAGIC = [0x56, 0x46, 0x54];
+const FRAMED_VERSION = 2;
+const HEADER_SIZE = 20;
+const RECORD_HEADER_SIZE = 5;
+const TAG_SIZE = 16;
+const FOOTER_SIZE = 8;
+const FLAG_FINAL = 1;
+
+const isFramed = (bytes: Uint8Array) =>
+  bytes.length >= HEADER_SIZE &&
+  FRAMED_MAGIC.every((b, i) => bytes[i] === b) &&
+  bytes[3] === FRAMED_VERSION;
+
+const concatBytes = (a: Uint8Array, b: Uint8Array) => {
+  const result = new Uint8Array(a.length + b.length);
+  result.set(a);
+  result.set(b, a.length);
+  return result;
+};
+
+const baseKey = (key: string) => crypto.subtle.digest("SHA-256", new TextEncoder().encode(key));
+
+const recordKey = async (key: string, header: Uint8Array) => {
+  const hmacKey = await crypto.subtle.importKey(
+    "raw", await baseKey(key), { name: "HMAC", hash: "SHA-256" }, false, ["sign"]
+  );
+  const derived = await crypto.subtle.sign("HMAC", hmacKey, header.slice(4, HEADER_SIZE));
+  return crypto.subtle.importKey("raw", derived, { name: "AES-GCM" }, false, ["decrypt"]);
+};
+
+const decryptRecord = async (
+  cryptoKey: CryptoKey,
+  header: Uint8Array,
+  index: number,
+  record: Uint8Array
+) => {
+  const view = new DataView(record.buffer, record.byteOffset, record.byteLength);
+  const flags = record[0];
+  const length = view.getUint32(1);
+  const nonce = new Uint8Array(12);
+  new DataView(nonce.buffer).setUint32(7, index);
+  nonce[11] = flags;
+
+  const plaintext = await crypto.subtle.decrypt(
+    { name: "AES-GCM", iv: nonce, additionalData: header, tagLength: 128 },
+    cryptoKey,
+    record.slice(RECORD_HEADER_SIZE, RECORD_HEADER_SIZE + length + TAG_SIZE)
+  );
+  return { flags, text: new TextDecoder().decode(plaintext) };
+};
+
+// Расшифровывает записи по мере прихода байтов; остаток (футер) игнорируется
+async function* readFramedSegments(
+  reader: ReadableStreamDefaultReader<Uint8Array>,
+  key: string,
+  initial: Uint8Array
+) {
+  let buffer = initial;
+  let done = false;
+  const fill = async (size: number) => {
+    while (buffer.length < size && !done) {
+      const chunk = await reader.read();
+      done = chunk.done;
+      if (chunk.value) buffer = concatBytes(buffer, chunk.value);
+    }
+    if (buffer.length < size) throw new Error("Transcript stream is truncated");
+  };
+
+  await fill(HEADER_SIZE);
+  const header = buffer.slice(0, HEADER_SIZE);
+  const cryptoKey = await recordKey(key, header);
+  buffer = buffer.slice(HEADER_SIZE);
+
+  for (let index = 0; ; index++) {
+    await fill(RECORD_HEADER_SIZE);
+    const length = new DataView(buffer.buffer, buffer.byteOffset).getUint32(1);
+    const recordSize = RECORD_HEADER_SIZE + length + TAG_SIZE;
+    await fill(recordSize);
+
+    const { flags, text } = await decryptRecord(cryptoKey, header, index, buffer.slice(0, recordSize));
+    buffer = buffer.slice(recordSize);
+    if (flags & FLAG_FINAL) {
+      await reader.cancel();
+      return;
+    }
+    yield JSON.parse(text);
+  }
+}
+
+const decryptLegacy = async (encrypted: Uint8Array, key: string) => {
+  if (encrypted.length < 32) throw new Error("Data too short for decryption");
+  const cryptoKey = await crypto.subtle.importKey("raw", await baseKey(key), { name: "AES-CBC" }, false, ["decrypt"]);
+  const decrypted = await crypto.subtle.decrypt(
+    { name: "AES-CBC", iv: encrypted.slice(0, 16) },
+    cryptoKey,
+    encrypted.slice(16)
+  );
+  return new TextDecoder().decode(decrypted);
+};
+
+const readAll = async (reader: ReadableStreamDefaultReader<Uint8Array>, initial: Uint8Array) => {
+  let buffer = initial;
+  for (let chunk = await reader.read(); !chunk.done; chunk = await reader.read()) {
+    buffer = concatBytes(buffer, chunk.value);
+  }
+  return buffer;
+};
+
+// Загружает и расшифровывает одну расшифровку по серверному id.
+// onSegment вызывается для каждого сегмента по мере расшифровки (только формат v2)
+export const fetchTranscript = async (
+  serverId: number,
+  token: string,
+  key: string,
+  onSegment?: (segment: unknown) => void
+): Promise<string | null> => {
+  try {
+    const response = await fetch(`${API_URL}/transcripts/${serverId}`, {
+      headers: { Authorization: `Bearer ${token}` },
+    });
+    if (!response.ok || !response.body) {
+      console.error("Failed to fetch transcript:", response.status);
+      return null;
+    }
+
+    // Формат определяется по первым байтам, остальное читается потоком
+    const reader = response.body.getReader();
+    let head = new Uint8Array(0);
+    while (head.length < HEADER_SIZE) {
+      const chunk = await reader.read();
+      if (chunk.done) break;
+      head = concatBytes(head, chunk.value);
+    }
+
+    if (!isFramed(head)) {
+      return await decryptLegacy(await readAll(reader, head), key);
+    }
+
+    const segments: unknown[] = [];
+    for await (const segment of readFramedSegments(reader, key, head)) {
+      segments.push(segment);
+      onSegment?.(segment);
+    }
+    return JSON.stringify(segments);
+  } catch (error) {
+    console.error("Transcript decryption error:", error);
+    return null;
+  }
+};
+
+const fetchRange = async (url: string, token: string, range: string) => {
+  const response = await fetch(url, {
+    headers: { Authorization: `Bearer ${token}`, Range: `bytes=${range}` },
+  });
+  if (response.status !== 206) throw new Error(`Range request failed: ${response.status}`);
+  return {
+    bytes: new Uint8Array(await response.arrayBuffer()),
+    total: Number(response.headers.get("Content-Range")?.split("/")[1]),
+  };
+};
+
+// Загружает и расшифровывает сегменты [first, last] через Range-запросы по индексу в футере.
+// Возвращает null для старых расшифровок, у которых индекса нет
+export const fetchTranscriptSegments = async (
+  serverId: number,
+  token: string,
+  key: string,
+  first: number,
+  last: number
+): Promise<unknown[] | null> => {
+  try {
+    const url = `${API_URL}/transcripts/${serverId}`;
+    const { bytes: header } = await fetchRange(url, token, `0-${HEADER_SIZE - 1}`);
+    if (!isFramed(header)) return null;
+
+    const { bytes: footer, total } = await fetchRange(url, token, `-${FOOTER_SIZE}`);
+    const count = new DataView(footer.buffer).getUint32(0);
+    const indexStart = total - FOOTER_SIZE - 8 * (count + 1);
+    const { bytes: index } = await fetchRange(url, token, `${indexStart}-${total - FOOTER_SIZE - 1}`);
+    const offsets = Array.from({ length: count + 1 }, (_, i) =>
+      Number(new DataView(index.buffer).getBigUint64(i * 8))
+    );
+
+    last = Math.min(last, count - 1);
+    if (first > last) return [];
+
+    const { bytes: records } = await fetchRange(url, token, `${offsets[first]}-${offsets[last + 1] - 1}`);
+    const cryptoKey = await recordKey(key, header);
+    const segments = [];
+    for (let i = first; i <= last; i++) {
+      const record = records.slice(offsets[i] - offsets[first], offsets[i + 1] - offsets[first]);
+      segments.push(JSON.parse((await decryptRecord(cryptoKey, header, i, record)).text));
+    }
+    return segments;
+  } catch (error) {
+    console.error("Transcript range decryption error:", error);
+    return null;
+  }
+};
+
 export const getAccessToken = () => {
   return document.cookie.match(/access_token=([^;]+)/)?.[1] || null;
 };